@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Flex 訊息建構效能基準
+
+比較兩種建構 reply 請求內容的方式：
+1. 舊做法：每次重建巢狀 dict → FlexSendMessage 驗證 → json.dumps
+2. 範本：預先序列化的 JSON bytes，只代入 user_id
+
+用法:
+    python benchmark_flex_templates.py [--iterations 20000]
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import timeit
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flex_templates import flex_templates, build_reply_body
+
+USER_ID = 'U1234567890abcdef1234567890abcdef'
+
+
+def _substitute(node, user_id):
+    """模擬舊做法：在新建的 dict 中填入 user_id"""
+    if isinstance(node, dict):
+        return {key: _substitute(value, user_id) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_substitute(value, user_id) for value in node]
+    if isinstance(node, str):
+        return node.replace('{{user_id}}', user_id)
+    return node
+
+
+def build_legacy(contents, alt_text):
+    """舊做法：dict → SDK 物件 → JSON"""
+    from linebot.models import FlexSendMessage
+
+    message = FlexSendMessage(alt_text=alt_text, contents=_substitute(contents, USER_ID))
+    data = {
+        'replyToken': 'reply-token',
+        'messages': [message.as_json_dict()],
+        'notificationDisabled': False,
+    }
+    return json.dumps(data)
+
+
+def build_template(name):
+    """範本做法：代入欄位後直接拼接 bytes"""
+    return build_reply_body('reply-token', flex_templates.render(name, user_id=USER_ID))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Flex 訊息建構效能基準')
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"⏱️ Flex 訊息建構效能基準（每項 {args.iterations} 次）")
+    print("=" * 60)
+
+    for name in ('form_category', 'registration'):
+        template_path = os.path.join(flex_templates.template_dir, f'{name}.v{flex_templates.get(name).version}.json')
+        with open(template_path, 'r', encoding='utf-8') as f:
+            doc = json.load(f)
+        contents = copy.deepcopy(doc['contents'])
+
+        legacy = timeit.timeit(lambda: build_legacy(contents, doc['alt_text']), number=args.iterations)
+        template = timeit.timeit(lambda: build_template(name), number=args.iterations)
+
+        legacy_us = legacy / args.iterations * 1e6
+        template_us = template / args.iterations * 1e6
+        print(f"\n📦 {name}")
+        print(f"  舊做法 (dict + SDK): {legacy_us:8.1f} µs/次")
+        print(f"  預先序列化範本:      {template_us:8.1f} µs/次")
+        print(f"  加速: {legacy_us / template_us:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+用戶搜尋效能基準（需要 PostgreSQL）
+
+在獨立的 schema 中產生合成用戶資料，比較：
+1. 舊做法：name / email 的 ILIKE '%...%'（無可用索引，整表掃描）
+2. 新做法：pg_trgm GIN 索引 + 相似度排序（user_manager.build_search_query）
+
+用法:
+    DATABASE_URL=postgresql://... python benchmark_user_search.py [--users 200000] [--repeat 20]
+結束後會刪除建立的 schema，不影響既有資料。
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, or_, select, text
+
+from models import DATABASE_URL, SCHEMA_MIGRATIONS, User
+from user_manager import build_search_query
+
+SCHEMA = 'user_search_benchmark'
+QUERIES = ('王小明', 'user12345', 'Ming', '編輯部', 'usre1234')  # 最後一個為拼錯的關鍵字
+
+SURNAMES = '王李張劉陳楊黃趙吳周'
+GIVEN = '小明志偉淑芬家豪怡君俊宏'
+DEPARTMENTS = ('編輯部', '業務部', '資訊部', '行政部', '設計部')
+
+
+def legacy_query(query):
+    """舊做法：只比對 name 與 email，依 ILIKE 整表掃描"""
+    return select(User).where(
+        or_(User.name.ilike(f"%{query}%"), User.email.ilike(f"%{query}%"))
+    )
+
+
+def populate(conn, count):
+    """以 generate_series 在資料庫端產生合成用戶，避免傳輸大量資料"""
+    conn.execute(text("""
+        INSERT INTO line_users (line_id, name, english_name, department, email, mobile, extension,
+                                created_at, updated_at, user_metadata)
+        SELECT
+            'U' || md5(i::text),
+            substr(:surnames, 1 + i % 10, 1) || substr(:given, 1 + (i / 10) % 12, 1)
+                || substr(:given, 1 + (i / 120) % 12, 1),
+            'Ming' || i,
+            (:departments)[1 + i % 5],
+            'user' || i || '@example.com',
+            '09' || lpad((i % 100000000)::text, 8, '0'),
+            '#' || (100 + i % 900),
+            now(), now(), '{}'::jsonb
+        FROM generate_series(1, :count) AS i
+    """), {
+        'surnames': SURNAMES,
+        'given': GIVEN,
+        'departments': list(DEPARTMENTS),
+        'count': count,
+    })
+    conn.execute(text("ANALYZE line_users"))
+
+
+def measure(conn, stmt, repeat):
+    """回傳 (每次平均毫秒, 結果筆數)"""
+    rows = conn.execute(stmt).all()  # 預熱快取
+    start = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(stmt).all()
+    return (time.perf_counter() - start) / repeat * 1000, len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用戶搜尋效能基準')
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    if not DATABASE_URL.startswith('postgresql'):
+        print("❌ 需要 PostgreSQL（設定 DATABASE_URL）")
+        sys.exit(1)
+
+    engine = create_engine(DATABASE_URL)
+    print("=" * 60)
+    print(f"⏱️ 用戶搜尋效能基準（{args.users} 位用戶，每項 {args.repeat} 次）")
+    print("=" * 60)
+
+    with engine.connect() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        conn.execute(text(f"SET search_path TO {SCHEMA}, public"))
+        try:
+            User.__table__.create(conn)
+            started = time.perf_counter()
+            populate(conn, args.users)
+            conn.commit()
+            print(f"\n📦 產生資料: {time.perf_counter() - started:.1f} 秒")
+
+            legacy = {query: measure(conn, legacy_query(query), args.repeat) for query in QUERIES}
+
+            started = time.perf_counter()
+            for statement in SCHEMA_MIGRATIONS:
+                if 'pg_trgm' in statement or 'gin_trgm_ops' in statement:
+                    conn.execute(text(statement))
+            conn.execute(text("ANALYZE line_users"))
+            conn.commit()
+            print(f"🧱 建立 trigram 索引: {time.perf_counter() - started:.1f} 秒")
+
+            for query in QUERIES:
+                legacy_ms, legacy_rows = legacy[query]
+                ranked_ms, ranked_rows = measure(
+                    conn, build_search_query(query, limit=args.limit), args.repeat
+                )
+                print(f"\n🔎 '{query}'")
+                print(f"  舊做法 (ILIKE 掃描，全部 {legacy_rows} 筆): {legacy_ms:8.2f} ms/次")
+                print(f"  trigram 索引 + 排序（前 {ranked_rows} 筆）: {ranked_ms:8.2f} ms/次")
+                print(f"  加速: {legacy_ms / ranked_ms:.1f}x")
+        finally:
+            conn.rollback()
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            conn.commit()
+
+
+if __name__ == "__main__":
+    main()
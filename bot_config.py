@@ -2,64 +2,99 @@
 LINE Bot 群組行為配置檔案
 """
 import os
+import re
 
 class BotConfig:
     """Bot 行為配置類別"""
-    
+
     def __init__(self):
         # 從環境變數讀取 bot 名稱
         self.bot_name = os.environ.get('BOT_NAME', '視覺設計組')
-        
+
         # 群組中的 mention 關鍵字
-        self.mention_patterns = [
+        self._mention_patterns = (
             f'@{self.bot_name}',
             '@視覺設計組',  # 預設名稱
             '@assistant',  # 相容舊名稱
-        ]
-        
+        )
+
         # 在群組中允許不需要 mention 就能執行的指令
-        self.group_allowed_commands = [
+        # （main 啟動時以指令註冊表中 group_allowed 的處理器覆寫）
+        self._group_allowed_commands = (
             '/health',
             '/健康檢查',
             '/help',
-            '/說明'
-        ]
-        
-        # 允許未註冊用戶使用的指令
-        self.unregistered_allowed_commands = [
-            '/health',
-            '/健康檢查', 
-            '/註冊',
-            '/help',
-            '/說明'
-        ]
-    
+            '/說明',
+            '/幫助'
+        )
+
+        self._rebuild_matchers()
+
+    # --- 可修改的配置（修改後自動重建比對器）---
+
+    @property
+    def mention_patterns(self):
+        return self._mention_patterns
+
+    @mention_patterns.setter
+    def mention_patterns(self, patterns):
+        self._mention_patterns = tuple(patterns)
+        self._rebuild_matchers()
+
+    @property
+    def group_allowed_commands(self):
+        return self._group_allowed_commands
+
+    @group_allowed_commands.setter
+    def group_allowed_commands(self, commands):
+        self._group_allowed_commands = tuple(commands)
+        self._rebuild_matchers()
+
+    def _rebuild_matchers(self):
+        """預先編譯 mention 與指令比對器，讓每則訊息只需掃描一次"""
+        # 較長的關鍵字優先，避免 '@assistant' 先吃掉 '@assistant-bot' 的前綴
+        mentions = sorted({p for p in self._mention_patterns if p}, key=len, reverse=True)
+        mention_alternatives = [re.escape(p) for p in mentions]
+
+        self._group_allowed_set = frozenset(self._group_allowed_commands)
+
+        # 不會匹配任何字串的樣式（沒有任何關鍵字時使用）
+        never = r'(?!)'
+        self._mention_regex = re.compile('|'.join(mention_alternatives) or never)
+
+        # 群組回應判斷：訊息開頭是允許指令（後接空白或結尾），或任意位置出現 mention
+        respond_alternatives = list(mention_alternatives)
+        if self._group_allowed_set:
+            commands = '|'.join(re.escape(c) for c in sorted(self._group_allowed_set, key=len, reverse=True))
+            respond_alternatives.insert(0, rf'\A(?:{commands})(?= |\Z)')
+        self._group_respond_regex = re.compile('|'.join(respond_alternatives) or never)
+
+    def reload(self):
+        """重新讀取環境變數中的 bot 名稱並重建比對器"""
+        old_name = self.bot_name
+        self.bot_name = os.environ.get('BOT_NAME', '視覺設計組')
+        self._mention_patterns = tuple(
+            f'@{self.bot_name}' if p == f'@{old_name}' else p
+            for p in self._mention_patterns
+        )
+        self._rebuild_matchers()
+
     def is_bot_mentioned(self, message_text):
         """檢查訊息是否 mention 了 bot"""
-        return any(pattern in message_text for pattern in self.mention_patterns)
-    
+        return self._mention_regex.search(message_text) is not None
+
     def remove_mention(self, message_text):
         """移除訊息中的 mention 標記"""
-        for pattern in self.mention_patterns:
-            if pattern in message_text:
-                message_text = message_text.replace(pattern, '').strip()
-        return message_text
-    
+        cleaned, count = self._mention_regex.subn('', message_text)
+        return cleaned.strip() if count else message_text
+
     def is_group_allowed_command(self, command):
         """檢查指令是否允許在群組中不需要 mention 就執行"""
-        return command in self.group_allowed_commands
-    
-    def is_unregistered_allowed_command(self, command):
-        """檢查指令是否允許未註冊用戶使用"""
-        return command in self.unregistered_allowed_commands
-    
+        return command in self._group_allowed_set
+
     def should_respond_in_group(self, message_text):
-        """判斷是否應該在群組中回應此訊息"""
-        command = message_text.split(' ')[0]
-        
-        # 如果被 mention 或是允許的指令，則回應
-        return (self.is_bot_mentioned(message_text) or 
-                self.is_group_allowed_command(command))
+        """判斷是否應該在群組中回應此訊息（被 mention 或是允許的指令）"""
+        return self._group_respond_regex.search(message_text) is not None
 
 # 全局配置實例
 bot_config = BotConfig()
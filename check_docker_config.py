@@ -29,6 +29,21 @@ def check_dockerfile_includes():
         'bot_config.py',  # 新增的重要檔案
         'dialogflow_client.py',
         'google_credentials.py',
+        'webhook_filter.py',
+        'command_registry.py',
+        'flex_templates.py',
+        'rate_limiter.py',
+        'message_coalescer.py',
+        'priority_scheduler.py',
+        'line_delivery.py',
+        'outbound_delivery.py',
+        'line_dispatcher.py',
+        'task_store.py',
+        'user_stats.py',
+        'structured_logging.py',
+        'metrics.py',
+        'tracing.py',
+        'profiling.py',
         'requirements.txt'
     ]
     
@@ -0,0 +1,152 @@
+"""
+指令與意圖分派註冊表
+
+將直接指令、別名與 Dialogflow 意圖以字典對應到處理協程，
+取代 UnifiedMessageProcessor 中的 if/elif 分支，並自動記錄每個處理器的延遲。
+"""
+
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from metrics import COMMAND_DURATION
+from profiling import handler_profiler
+from tracing import tracer
+
+# 處理器簽名：async handler(user_id, args, reply_token)
+CommandHandler = Callable[[str, str, str], Awaitable[Any]]
+
+
+class CommandSpec:
+    """
+    單一處理器的定義與中繼資料
+
+    requires_registration: 未註冊用戶是否會先被引導註冊（handle_message 依此判斷）
+    group_allowed: 群組中不需 mention 即可觸發（同步到 bot_config 的群組比對器）
+    rate_limited: 是否另外套用指令層級的速率限制
+    """
+
+    __slots__ = ('name', 'handler', 'commands', 'requires_registration',
+                 'group_allowed', 'rate_limited')
+
+    def __init__(self, name: str, handler: CommandHandler, commands: Tuple[str, ...],
+                 requires_registration: bool, group_allowed: bool, rate_limited: bool):
+        self.name = name
+        self.handler = handler
+        self.commands = commands
+        self.requires_registration = requires_registration
+        self.group_allowed = group_allowed
+        self.rate_limited = rate_limited
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'commands': list(self.commands),
+            'requires_registration': self.requires_registration,
+            'group_allowed': self.group_allowed,
+            'rate_limited': self.rate_limited
+        }
+
+
+class CommandRegistry:
+    """指令 / 別名 / 意圖 → 處理器的 O(1) 對應表"""
+
+    def __init__(self):
+        self._specs: Dict[str, CommandSpec] = {}
+        self._commands: Dict[str, CommandSpec] = {}
+        self._intents: Dict[str, Tuple[CommandSpec, Optional[str]]] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._stats_lock = threading.Lock()
+
+    def register(self, name: str, handler: CommandHandler, commands: Iterable[str] = (),
+                 intents: Optional[Dict[str, Optional[str]]] = None,
+                 requires_registration: bool = True, group_allowed: bool = False,
+                 rate_limited: bool = False) -> CommandSpec:
+        """
+        註冊處理器
+
+        commands: 觸發此處理器的指令與別名（例如 '/填表'、'/填表單'）
+        intents: Dialogflow 意圖名稱 → 作為 args 傳入的參數名稱（None 表示不帶參數）
+        """
+        if name in self._specs:
+            raise ValueError(f"處理器已註冊: {name}")
+
+        spec = CommandSpec(name, handler, tuple(commands), requires_registration,
+                           group_allowed, rate_limited)
+        for command in spec.commands:
+            if command in self._commands:
+                raise ValueError(f"指令已註冊: {command}")
+        for command in spec.commands:
+            self._commands[command] = spec
+        for intent, param in (intents or {}).items():
+            self._intents[intent] = (spec, param)
+
+        self._specs[name] = spec
+        self._stats[name] = {'calls': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+        return spec
+
+    def resolve_command(self, command: str) -> Optional[CommandSpec]:
+        return self._commands.get(command)
+
+    def resolve_intent(self, intent: str) -> Tuple[Optional[CommandSpec], Optional[str]]:
+        return self._intents.get(intent, (None, None))
+
+    def get(self, name: str) -> Optional[CommandSpec]:
+        return self._specs.get(name)
+
+    def command_map(self) -> Dict[str, str]:
+        """指令 → 處理器名稱（相容舊的 supported_commands 格式）"""
+        return {command: spec.name for command, spec in self._commands.items()}
+
+    def group_commands(self) -> Tuple[str, ...]:
+        """群組中不需 mention 即可觸發的指令（group_allowed 的處理器）"""
+        return tuple(command for command, spec in self._commands.items() if spec.group_allowed)
+
+    def requires_registration(self, command: str) -> bool:
+        """未註冊用戶使用此指令前是否需要先註冊（未知指令與一般訊息皆需要）"""
+        spec = self._commands.get(command)
+        return spec is None or spec.requires_registration
+
+    async def dispatch(self, spec: CommandSpec, user_id: str, args: str, reply_token: str):
+        """執行處理器並記錄延遲（抽中時以 cProfile 剖析）"""
+        start = time.perf_counter()
+        failed = False
+        profiler = handler_profiler.start()
+        try:
+            with tracer.span(f'command.{spec.name}', command=spec.name):
+                return await spec.handler(user_id, args, reply_token)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            if profiler is not None:
+                handler_profiler.stop(spec.name, profiler)
+            self._record(spec.name, time.perf_counter() - start, failed)
+
+    def _record(self, name: str, elapsed: float, failed: bool):
+        COMMAND_DURATION.observe(elapsed, name, 'error' if failed else 'ok')
+        with self._stats_lock:
+            stats = self._stats[name]
+            stats['calls'] += 1
+            stats['total_seconds'] += elapsed
+            if elapsed > stats['max_seconds']:
+                stats['max_seconds'] = elapsed
+            if failed:
+                stats['errors'] += 1
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """每個處理器的呼叫次數、錯誤數與延遲"""
+        with self._stats_lock:
+            result = {}
+            for name, stats in self._stats.items():
+                calls = stats['calls']
+                result[name] = {
+                    'calls': calls,
+                    'errors': stats['errors'],
+                    'avg_ms': round(stats['total_seconds'] / calls * 1000, 2) if calls else 0.0,
+                    'max_ms': round(stats['max_seconds'] * 1000, 2)
+                }
+            return result
+
+    def describe(self):
+        return [spec.describe() for spec in self._specs.values()]
@@ -5,26 +5,56 @@ Dialogflow 整合模組
 
 import os
 import json
+import threading
 from typing import Dict, Any, Optional
-from google.cloud import dialogflow
 from google_credentials import get_google_credentials, get_project_id
 
 
 class DialogflowClient:
     def __init__(self, project_id: str = None, language_code: str = 'zh-TW'):
-        self.project_id = project_id or get_project_id() or os.environ.get('DIALOGFLOW_PROJECT_ID')
+        # 憑證、google.cloud.dialogflow 與 SessionsClient 都延遲到第一次使用時才載入
+        self._project_id_override = project_id
         self.language_code = language_code
+        self.project_id = None
         self.session_client = None
+        self.credentials = None
+        self._dialogflow = None
+        self._initialized = False
+        self._init_lock = threading.Lock()
+    
+    def _ensure_initialized(self):
+        """第一次使用時初始化 Dialogflow 客戶端"""
+        if self._initialized:
+            return
+        with self._init_lock:
+            if self._initialized:
+                return
+            self._initialize()
+            self._initialized = True
+    
+    def _initialize(self):
+        self.project_id = self._project_id_override or get_project_id() or os.environ.get('DIALOGFLOW_PROJECT_ID')
         self.credentials = get_google_credentials()
         
-        if self.project_id and self.credentials:
+        if not self.project_id:
+            print("⚠️ 未設定 DIALOGFLOW_PROJECT_ID 或 Google 憑證，將使用模擬模式")
+            return
+        
+        try:
+            from google.cloud import dialogflow
+            self._dialogflow = dialogflow
+        except ImportError as e:
+            print(f"❌ 無法載入 google-cloud-dialogflow，將使用模擬模式: {e}")
+            return
+        
+        if self.credentials:
             try:
                 self.session_client = dialogflow.SessionsClient(credentials=self.credentials)
                 print(f"✅ Dialogflow 客戶端初始化成功，項目ID: {self.project_id}")
             except Exception as e:
                 print(f"❌ Dialogflow 初始化失敗: {e}")
                 self.session_client = None
-        elif self.project_id:
+        else:
             try:
                 # 嘗試使用預設憑證
                 self.session_client = dialogflow.SessionsClient()
@@ -32,15 +62,20 @@ class DialogflowClient:
             except Exception as e:
                 print(f"❌ Dialogflow 預設憑證初始化失敗: {e}")
                 self.session_client = None
-        else:
-            print("⚠️ 未設定 DIALOGFLOW_PROJECT_ID 或 Google 憑證，將使用模擬模式")
+    
+    def warm_up(self):
+        """預先初始化客戶端（供背景預熱使用）"""
+        self._ensure_initialized()
+        return self.session_client is not None
     
     async def detect_intent(self, text: str, session_id: str, context: Dict = None) -> Dict[str, Any]:
         """檢測用戶意圖"""
+        self._ensure_initialized()
         if not self.session_client or not self.project_id:
             # 回退到模擬模式
             return await self._simulate_intent_detection(text)
         
+        dialogflow = self._dialogflow
         try:
             # 構建會話路徑
             session = self.session_client.session_path(self.project_id, session_id)
@@ -0,0 +1,38 @@
+"""
+測試用的 LINE API 替身
+
+記錄 LineBotApi._post 收到的請求，供 test_line_delivery.py 與 test_outbound_delivery.py 共用。
+"""
+
+import json
+import threading
+
+from linebot.exceptions import LineBotApiError
+from linebot.models.error import Error
+
+
+class RecordingApi:
+    """
+    記錄 _post 呼叫（路徑, 解析後的 body）
+    reject_replies: 為 True 時 reply 回應 reply_error_status（預設 400，模擬 reply token 失效）
+    fail_paths: 這些路徑會拋出例外
+    gate: 設定時每次呼叫先等待此 Event
+    """
+
+    def __init__(self, reject_replies=False, fail_paths=(), gate=None, reply_error_status=400):
+        self.calls = []
+        self.reject_replies = reject_replies
+        self.reply_error_status = reply_error_status
+        self.fail_paths = fail_paths
+        self.gate = gate
+        self._lock = threading.Lock()
+
+    def _post(self, path, data=None, timeout=None):
+        if self.gate is not None:
+            self.gate.wait()
+        if self.reject_replies and path.endswith('/reply'):
+            raise LineBotApiError(self.reply_error_status, {}, error=Error(message="Invalid reply token"))
+        if path in self.fail_paths:
+            raise RuntimeError("LINE API 無回應")
+        with self._lock:
+            self.calls.append((path, json.loads(data)))
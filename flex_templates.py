@@ -0,0 +1,128 @@
+"""
+Flex Message 範本系統
+
+從 flex_templates/<名稱>.v<版本>.json 載入 Flex bubble，啟動時預先序列化成 JSON bytes，
+每次發送只把用戶相關的欄位（例如 {{user_id}}）代入，不再重建整棵 dict，
+也不經過 LINE SDK 的模型驗證與重新序列化。
+"""
+
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional
+
+TEMPLATE_DIR = os.environ.get(
+    'FLEX_TEMPLATE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'flex_templates')
+)
+
+_FILENAME_PATTERN = re.compile(r'^(?P<name>[\w-]+)\.v(?P<version>\d+)\.json$')
+_SLOT_PATTERN = re.compile(r'\{\{(\w+)\}\}')
+
+
+class FlexTemplate:
+    """預先序列化的 Flex 訊息範本"""
+
+    def __init__(self, name: str, version: int, alt_text: str, contents: Dict, slots: List[str]):
+        self.name = name
+        self.version = version
+        self.slots = tuple(slots)
+
+        # 整個 message 物件只序列化一次，再依 {{slot}} 切成固定片段
+        message = {'type': 'flex', 'altText': alt_text, 'contents': contents}
+        serialized = json.dumps(message, ensure_ascii=True, separators=(',', ':'))
+        self._parts = []
+        position = 0
+        for match in _SLOT_PATTERN.finditer(serialized):
+            slot = match.group(1)
+            if slot not in self.slots:
+                raise ValueError(f"範本 {name} 使用了未宣告的欄位: {slot}")
+            self._parts.append(serialized[position:match.start()].encode('ascii'))
+            self._parts.append(slot)
+            position = match.end()
+        self._parts.append(serialized[position:].encode('ascii'))
+
+    def render(self, **values) -> bytes:
+        """代入欄位並回傳 message 物件的 JSON bytes"""
+        rendered = []
+        for part in self._parts:
+            if isinstance(part, bytes):
+                rendered.append(part)
+            else:
+                # 以 JSON 字串規則跳脫，去掉前後引號後嵌入
+                rendered.append(json.dumps(str(values[part]))[1:-1].encode('ascii'))
+        return b''.join(rendered)
+
+    def render_dict(self, **values) -> Dict:
+        """代入欄位並回傳 dict（供需要 SDK 物件的路徑使用）"""
+        return json.loads(self.render(**values))
+
+
+class FlexTemplateStore:
+    """載入並快取各範本的最新版本"""
+
+    def __init__(self, template_dir: str = TEMPLATE_DIR):
+        self.template_dir = template_dir
+        self._templates: Dict[str, FlexTemplate] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def load(self):
+        """讀取目錄中所有範本，同名範本保留版本號最大者"""
+        latest: Dict[str, tuple] = {}
+        for filename in sorted(os.listdir(self.template_dir)):
+            match = _FILENAME_PATTERN.match(filename)
+            if not match:
+                continue
+            name, version = match.group('name'), int(match.group('version'))
+            if name not in latest or version > latest[name][0]:
+                latest[name] = (version, os.path.join(self.template_dir, filename))
+
+        templates = {}
+        for name, (version, path) in latest.items():
+            with open(path, 'r', encoding='utf-8') as f:
+                doc = json.load(f)
+            templates[name] = FlexTemplate(
+                name=name,
+                version=version,
+                alt_text=doc['alt_text'],
+                contents=doc['contents'],
+                slots=doc.get('slots', [])
+            )
+
+        with self._lock:
+            self._templates = templates
+            self._loaded = True
+        print(f"✅ 已載入 Flex 範本: {', '.join(f'{t.name} v{t.version}' for t in templates.values())}")
+
+    def get(self, name: str) -> Optional[FlexTemplate]:
+        if not self._loaded:
+            self.load()
+        return self._templates.get(name)
+
+    def render(self, name: str, **values) -> bytes:
+        template = self.get(name)
+        if template is None:
+            raise KeyError(f"找不到 Flex 範本: {name}")
+        return template.render(**values)
+
+
+def build_reply_body(reply_token: str, *messages: bytes) -> bytes:
+    """組合 reply API 的請求內容（messages 為已序列化的 message JSON bytes）"""
+    return (
+        b'{"replyToken":' + json.dumps(reply_token).encode('ascii')
+        + b',"messages":[' + b','.join(messages) + b'],"notificationDisabled":false}'
+    )
+
+
+def build_push_body(to: str, *messages: bytes) -> bytes:
+    """組合 push API 的請求內容"""
+    return (
+        b'{"to":' + json.dumps(to).encode('ascii')
+        + b',"messages":[' + b','.join(messages) + b'],"notificationDisabled":false}'
+    )
+
+
+# 全局範本實例
+flex_templates = FlexTemplateStore()
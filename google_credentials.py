@@ -1,73 +1,164 @@
 import os
 import json
-import tempfile
-from google.oauth2 import service_account
+import threading
+from datetime import datetime
 
-def get_google_credentials():
+# Dialogflow 等 Google Cloud API 使用的授權範圍
+# 預先設定 scope，讓 SessionsClient 直接沿用同一個憑證物件（背景刷新才會生效）
+GOOGLE_API_SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+
+# 在 access token 到期前多少秒主動刷新（需大於 google-auth 內建的 3 分 45 秒門檻）
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.environ.get('GOOGLE_TOKEN_REFRESH_MARGIN', '300'))
+# 刷新失敗時的重試間隔
+TOKEN_REFRESH_RETRY_SECONDS = 30
+
+# 每個進程只解析一次憑證，之後共用同一個物件
+_credentials_lock = threading.Lock()
+_credentials_loaded = False
+_cached_credentials = None
+_token_refresher = None
+
+
+def _load_credentials():
     """
     從環境變數或檔案載入 Google 憑證
     優先順序：環境變數 > 檔案路徑
+    憑證只保留在記憶體中，不再寫入臨時檔案
     """
+    try:
+        from google.oauth2 import service_account
+    except ImportError as e:
+        print(f"❌ 無法載入 google-auth: {e}")
+        return None
+
     # 方法 1：從環境變數載入 JSON 憑證
     credentials_json = os.environ.get('GOOGLE_SERVICE_ACCOUNT_JSON')
     if credentials_json:
         try:
-            # 解析 JSON 字串
             credentials_info = json.loads(credentials_json)
-            
-            # 創建臨時檔案
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json') as temp_file:
-                json.dump(credentials_info, temp_file)
-                temp_file_path = temp_file.name
-            
-            # 設定環境變數指向臨時檔案
-            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = temp_file_path
-            
-            print(f"✅ Google 憑證已從環境變數載入並寫入臨時檔案: {temp_file_path}")
-            return service_account.Credentials.from_service_account_info(credentials_info)
-            
+            credentials = service_account.Credentials.from_service_account_info(
+                credentials_info, scopes=GOOGLE_API_SCOPES
+            )
+            print("✅ Google 憑證已從環境變數載入（記憶體）")
+            return credentials
+
         except json.JSONDecodeError as e:
             print(f"❌ 環境變數 GOOGLE_SERVICE_ACCOUNT_JSON 格式錯誤: {e}")
         except Exception as e:
             print(f"❌ 載入環境變數憑證失敗: {e}")
-    
+
     # 方法 2：從 Base64 環境變數載入
     credentials_base64 = os.environ.get('GOOGLE_CREDENTIALS_BASE64')
     if credentials_base64:
         try:
             import base64
-            # 解碼 Base64
             credentials_json = base64.b64decode(credentials_base64).decode('utf-8')
             credentials_info = json.loads(credentials_json)
-            
-            # 創建臨時檔案
-            with tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.json') as temp_file:
-                json.dump(credentials_info, temp_file)
-                temp_file_path = temp_file.name
-            
-            # 設定環境變數指向臨時檔案
-            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = temp_file_path
-            
-            print(f"✅ Google 憑證已從 Base64 環境變數載入: {temp_file_path}")
-            return service_account.Credentials.from_service_account_info(credentials_info)
-            
+            credentials = service_account.Credentials.from_service_account_info(
+                credentials_info, scopes=GOOGLE_API_SCOPES
+            )
+            print("✅ Google 憑證已從 Base64 環境變數載入（記憶體）")
+            return credentials
+
         except Exception as e:
             print(f"❌ 載入 Base64 憑證失敗: {e}")
-    
+
     # 方法 3：從檔案路徑載入
     credentials_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
     if credentials_path and os.path.exists(credentials_path):
         try:
-            credentials = service_account.Credentials.from_service_account_file(credentials_path)
+            credentials = service_account.Credentials.from_service_account_file(
+                credentials_path, scopes=GOOGLE_API_SCOPES
+            )
             print(f"✅ Google 憑證已從檔案載入: {credentials_path}")
             return credentials
         except Exception as e:
             print(f"❌ 載入檔案憑證失敗: {e}")
-    
+
     # 如果都失敗，返回 None
     print("⚠️ 未找到有效的 Google 憑證")
     return None
 
+
+class _TokenRefresher(threading.Thread):
+    """在背景於 access token 到期前主動刷新，避免 RPC 等待取得 token"""
+
+    def __init__(self, credentials, request=None):
+        super().__init__(name='google-token-refresher', daemon=True)
+        self.credentials = credentials
+        # 刷新時使用的 transport request（None 表示使用 google-auth 的 requests transport）
+        self.request = request
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _seconds_until_refresh(self):
+        expiry = self.credentials.expiry  # google-auth 使用 naive UTC 時間
+        if not self.credentials.token or expiry is None:
+            return 0
+        remaining = (expiry - datetime.utcnow()).total_seconds()
+        return max(0, remaining - TOKEN_REFRESH_MARGIN_SECONDS)
+
+    def run(self):
+        request = self.request
+        if request is None:
+            from google.auth.transport.requests import Request
+            request = Request()
+
+        while not self._stop_event.is_set():
+            wait_seconds = self._seconds_until_refresh()
+            if wait_seconds > 0:
+                self._stop_event.wait(wait_seconds)
+                continue
+
+            try:
+                self.credentials.refresh(request)
+                print(f"🔄 Google access token 已刷新，到期時間: {self.credentials.expiry}")
+            except Exception as e:
+                print(f"⚠️ Google access token 刷新失敗，{TOKEN_REFRESH_RETRY_SECONDS} 秒後重試: {e}")
+                self._stop_event.wait(TOKEN_REFRESH_RETRY_SECONDS)
+
+
+def _start_token_refresher(credentials):
+    """啟動背景 token 刷新執行緒（可用 GOOGLE_TOKEN_AUTO_REFRESH=false 關閉）"""
+    global _token_refresher
+    if os.environ.get('GOOGLE_TOKEN_AUTO_REFRESH', 'true').lower() == 'false':
+        return
+    if _token_refresher is None or not _token_refresher.is_alive():
+        _token_refresher = _TokenRefresher(credentials)
+        _token_refresher.start()
+
+
+def get_google_credentials():
+    """
+    獲取 Google 憑證（每個進程只載入一次並快取）
+    第一次呼叫時解析憑證並啟動背景 token 刷新
+    """
+    global _credentials_loaded, _cached_credentials
+    if _credentials_loaded:
+        return _cached_credentials
+
+    with _credentials_lock:
+        if not _credentials_loaded:
+            _cached_credentials = _load_credentials()
+            _credentials_loaded = True
+            if _cached_credentials is not None:
+                _start_token_refresher(_cached_credentials)
+    return _cached_credentials
+
+
+def reset_google_credentials():
+    """清除憑證快取（憑證輪替或測試時使用）"""
+    global _credentials_loaded, _cached_credentials, _token_refresher
+    with _credentials_lock:
+        if _token_refresher is not None:
+            _token_refresher.stop()
+            _token_refresher = None
+        _cached_credentials = None
+        _credentials_loaded = False
+
+
 def setup_google_credentials():
     """設定 Google 憑證，在應用程式啟動時呼叫"""
     credentials = get_google_credentials()
@@ -85,16 +176,17 @@ def setup_google_credentials():
             return False
     return False
 
+
 def get_project_id():
     """獲取 Google Cloud 專案 ID"""
     # 優先使用環境變數
     project_id = os.environ.get('DIALOGFLOW_PROJECT_ID')
     if project_id:
         return project_id
-    
-    # 嘗試從憑證中獲取
+
+    # 嘗試從快取的憑證中獲取
     credentials = get_google_credentials()
     if credentials and hasattr(credentials, 'project_id'):
         return credentials.project_id
-    
+
     return None
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+啟動 import 時間報告
+
+使用 `python -X importtime` 匯入指定模組（預設 main），
+列出耗時最多的模組，協助找出 worker 冷啟動的瓶頸。
+
+用法:
+    python import_time_report.py [--module main] [--top 25]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def run_importtime(module):
+    """在子進程中匯入模組並收集 -X importtime 輸出"""
+    env = dict(os.environ)
+    # main.py 需要 LINE 設定才能匯入；報告時不需要真的連線
+    env.setdefault('LINE_CHANNEL_ACCESS_TOKEN', 'import-time-report')
+    env.setdefault('LINE_CHANNEL_SECRET', 'import-time-report')
+    # 關閉背景預熱，只量測 import 本身
+    env['WARMUP_IN_BACKGROUND'] = 'false'
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    if result.returncode != 0:
+        print(f"⚠️ 匯入 {module} 時發生錯誤（返回碼 {result.returncode}）:")
+        print(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else '')
+    return result.stderr
+
+
+def parse_importtime(output):
+    """解析 importtime 輸出，回傳 [(模組, self_us, cumulative_us)]"""
+    entries = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            self_us = int(self_us.strip())
+            cumulative_us = int(cumulative_us.strip())
+        except ValueError:
+            continue
+        entries.append((name.rstrip(), self_us, cumulative_us))
+    return entries
+
+
+def print_report(entries, top):
+    """輸出依累計時間與頂層套件彙總的報告"""
+    if not entries:
+        print("❌ 沒有收集到 import 時間資料")
+        return
+
+    by_cumulative = sorted(entries, key=lambda e: e[2], reverse=True)
+    print(f"⏱️ 累計 import 時間前 {top} 名:")
+    print(f"  {'累計(ms)':>10} {'自身(ms)':>10}  模組")
+    for name, self_us, cumulative_us in by_cumulative[:top]:
+        print(f"  {cumulative_us / 1000:>10.1f} {self_us / 1000:>10.1f}  {name}")
+
+    packages = defaultdict(int)
+    for name, self_us, _ in entries:
+        packages[name.strip().split('.')[0]] += self_us
+    print(f"\n📦 依頂層套件彙總（自身時間）前 {top} 名:")
+    for package, total_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"  {total_us / 1000:>10.1f} ms  {package}")
+
+    total_us = sum(self_us for _, self_us, _ in entries)
+    print(f"\n🧮 總 import 時間: {total_us / 1000:.1f} ms（{len(entries)} 個模組）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='啟動 import 時間報告')
+    parser.add_argument('--module', default='main', help='要量測的模組（預設 main）')
+    parser.add_argument('--top', type=int, default=25, help='顯示前幾名（預設 25）')
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"📊 {args.module} 的 import 時間報告")
+    print("=" * 60)
+    print_report(parse_importtime(run_importtime(args.module)), args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+LINE 訊息遞送
+
+追蹤每個 reply token 的接收時間並估計剩餘有效時間，
+遞送時自動選擇 reply（免費、需在時效內）或 push（token 已過期、失效，或 reply 收到 429 時）。
+同一個處理流程中發往同一對象的 push 會合併，每次 API 呼叫最多 5 則訊息；
+合併範圍（batch）只屬於開啟它的執行緒，其他執行緒的 push 照常立即送出。
+reply 超過 5 則時，前 5 則以 reply 送出，其餘 push 給同一對象。
+
+設定（環境變數）:
+    REPLY_TOKEN_TTL_SECONDS=60         # reply token 有效時間
+    REPLY_TOKEN_SAFETY_MARGIN_SECONDS=5  # 剩餘時間低於此值即視為過期
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from linebot.exceptions import LineBotApiError
+
+from flex_templates import build_push_body, build_reply_body
+
+logger = logging.getLogger(__name__)
+
+REPLY_TOKEN_TTL_SECONDS = float(os.environ.get('REPLY_TOKEN_TTL_SECONDS', '60'))
+REPLY_TOKEN_SAFETY_MARGIN_SECONDS = float(os.environ.get('REPLY_TOKEN_SAFETY_MARGIN_SECONDS', '5'))
+
+# LINE reply / push API 每次最多 5 則訊息
+MAX_MESSAGES_PER_REQUEST = 5
+
+
+def post_json(api, path: str, body: bytes):
+    """
+    以已序列化的 JSON bytes 呼叫 LINE Messaging API（reply / push / multicast / narrowcast 共用）
+
+    依賴 line-bot-sdk 3.x 舊版 linebot.LineBotApi 的私有方法 _post(path, data=...)，
+    新的 linebot.v3 API 沒有此方法；直接送出 bytes 的呼叫都集中在這裡，升級 SDK 時只需修改此處
+    """
+    try:
+        return api._post(path, data=body)
+    except LineBotApiError as e:
+        # 帶 retry key 的重試收到 409：同一請求先前已被接受，視為成功
+        if e.status_code == 409 and e.accepted_request_id:
+            logger.info("LINE API 請求先前已被接受", extra={
+                'path': path, 'accepted_request_id': e.accepted_request_id
+            })
+            return None
+        raise
+
+
+def serialize_message(message) -> bytes:
+    """將 SDK 訊息物件或已序列化的 bytes 統一成 message JSON bytes"""
+    if isinstance(message, bytes):
+        return message
+    return json.dumps(message.as_json_dict(), separators=(',', ':')).encode('ascii')
+
+
+class _TokenEntry:
+    __slots__ = ('target', 'received_at')
+
+    def __init__(self, target: Optional[str], received_at: float):
+        self.target = target
+        self.received_at = received_at
+
+
+class ReplyTokenTracker:
+    """記錄 reply token 的接收時間與回覆對象（user / group / room ID）"""
+
+    # 追蹤上限，超過時清除已過期的 token
+    MAX_TOKENS = 20000
+
+    def __init__(self, ttl_seconds: float = REPLY_TOKEN_TTL_SECONDS,
+                 safety_margin_seconds: float = REPLY_TOKEN_SAFETY_MARGIN_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.safety_margin_seconds = safety_margin_seconds
+        self._tokens: Dict[str, _TokenEntry] = {}
+        self._lock = threading.Lock()
+
+    def record(self, reply_token: str, target: Optional[str], event_timestamp_ms: Optional[int] = None):
+        """記錄 token；event_timestamp_ms 為 webhook 事件時間（毫秒）"""
+        if not reply_token:
+            return
+        now = time.time()
+        received_at = now
+        if event_timestamp_ms:
+            # 以事件時間為準，但不接受未來時間（時鐘誤差）
+            received_at = min(now, event_timestamp_ms / 1000.0)
+        with self._lock:
+            if len(self._tokens) >= self.MAX_TOKENS:
+                self._prune(now)
+            self._tokens[reply_token] = _TokenEntry(target, received_at)
+
+    def _prune(self, now: float):
+        expired = [token for token, entry in self._tokens.items()
+                   if now - entry.received_at > self.ttl_seconds]
+        for token in expired:
+            del self._tokens[token]
+
+    def get(self, reply_token: str) -> Optional[_TokenEntry]:
+        with self._lock:
+            return self._tokens.get(reply_token)
+
+    def pop(self, reply_token: str) -> Optional[_TokenEntry]:
+        """取出並移除 token（reply token 只能使用一次）"""
+        with self._lock:
+            return self._tokens.pop(reply_token, None)
+
+    def remaining_seconds(self, entry: _TokenEntry) -> float:
+        """扣除安全邊際後的剩餘有效秒數"""
+        return self.ttl_seconds - self.safety_margin_seconds - (time.time() - entry.received_at)
+
+    def age_seconds(self, entry: _TokenEntry) -> float:
+        return time.time() - entry.received_at
+
+
+class LineDelivery:
+    """依 reply token 剩餘時效選擇 reply 或 push，並合併同對象的 push"""
+
+    def __init__(self, api, tracker: ReplyTokenTracker):
+        self.api = api
+        self.tracker = tracker
+        self._lock = threading.Lock()
+        # 每個執行緒各自的合併範圍：{target: [深度, 暫存的訊息]}
+        self._local = threading.local()
+        self._stats = {
+            'replies': 0,
+            'pushes': 0,
+            'push_requests': 0,
+            'expired_tokens': 0,
+            'invalid_token_fallbacks': 0,
+            'rate_limited_fallbacks': 0,
+            'handed_off_tokens': 0,
+            'reply_age_total_seconds': 0.0,
+            'reply_age_max_seconds': 0.0,
+        }
+
+    # --- 遞送 ---
+
+    def reply(self, reply_token: str, messages, to: Optional[str] = None) -> str:
+        """回覆訊息；token 已過期或失效時改為 push 給原本的對象，回傳實際使用的方式（reply / push）"""
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        payload = [serialize_message(m) for m in messages]
+
+        entry = self.tracker.pop(reply_token)
+        target = to or (entry.target if entry else None)
+
+        if entry is not None and self.tracker.remaining_seconds(entry) <= 0:
+            self._increment('expired_tokens')
+            if target:
+                self._push_serialized(target, payload)
+                return 'push'
+            # 沒有可 push 的對象，仍嘗試 reply
+
+        overflow = payload[MAX_MESSAGES_PER_REQUEST:]
+        if overflow and not target:
+            raise ValueError(f"reply 最多 {MAX_MESSAGES_PER_REQUEST} 則訊息，且沒有可 push 其餘訊息的對象")
+
+        try:
+            self._post_reply(reply_token, payload[:MAX_MESSAGES_PER_REQUEST])
+        except LineBotApiError as e:
+            # 400 通常表示 reply token 已失效；429 時等待 Retry-After 可能超過 token 時效
+            if e.status_code in (400, 429) and target:
+                self._increment('invalid_token_fallbacks' if e.status_code == 400 else 'rate_limited_fallbacks')
+                self._push_serialized(target, payload)
+                return 'push'
+            raise
+        if overflow:
+            self._push_serialized(target, overflow)
+
+        with self._lock:
+            self._stats['replies'] += 1
+            if entry is not None:
+                age = self.tracker.age_seconds(entry)
+                self._stats['reply_age_total_seconds'] += age
+                if age > self._stats['reply_age_max_seconds']:
+                    self._stats['reply_age_max_seconds'] = age
+        return 'reply'
+
+    def push(self, to: str, messages):
+        """push 訊息；在 batch() 範圍內會先暫存，離開時合併送出"""
+        if not isinstance(messages, (list, tuple)):
+            messages = [messages]
+        self._push_serialized(to, [serialize_message(m) for m in messages])
+
+    def hand_off(self, reply_token: str, min_remaining_seconds: float = 0) -> Dict:
+        """
+        將 reply token 交給外部系統（例如 n8n）使用
+        剩餘時間不足 min_remaining_seconds 時不交出 token（reply_token 為 None），
+        對方應改為 push 給 push_to
+        """
+        entry = self.tracker.pop(reply_token)
+        if entry is None:
+            # 未追蹤的 token（例如測試或舊流程），照原樣交出
+            return {'reply_token': reply_token, 'push_to': None, 'remaining_ms': None, 'expires_at': None}
+
+        remaining = self.tracker.remaining_seconds(entry)
+        expires_at = entry.received_at + self.tracker.ttl_seconds - self.tracker.safety_margin_seconds
+        if remaining <= min_remaining_seconds:
+            self._increment('expired_tokens')
+            return {'reply_token': None, 'push_to': entry.target, 'remaining_ms': max(0, int(remaining * 1000)),
+                    'expires_at': expires_at}
+
+        self._increment('handed_off_tokens')
+        return {'reply_token': reply_token, 'push_to': entry.target, 'remaining_ms': int(remaining * 1000),
+                'expires_at': expires_at}
+
+    @contextmanager
+    def batch(self, target: Optional[str]):
+        """目前執行緒在範圍內發往 target 的 push 會合併，離開範圍時送出"""
+        if not target:
+            yield
+            return
+        batches = self._batches()
+        state = batches.setdefault(target, [0, []])
+        state[0] += 1
+        try:
+            yield
+        finally:
+            state[0] -= 1
+            pending = None
+            if not state[0]:
+                del batches[target]
+                pending = state[1]
+            if pending:
+                self._send_pushes(target, pending)
+
+    # --- 內部 ---
+
+    def _batches(self) -> Dict[str, list]:
+        batches = getattr(self._local, 'batches', None)
+        if batches is None:
+            batches = self._local.batches = {}
+        return batches
+
+    def _push_serialized(self, target: str, payload: List[bytes]):
+        state = self._batches().get(target)
+        if state is not None:
+            state[1].extend(payload)
+            return
+        self._send_pushes(target, payload)
+
+    def _send_pushes(self, target: str, payload: List[bytes]):
+        for start in range(0, len(payload), MAX_MESSAGES_PER_REQUEST):
+            chunk = payload[start:start + MAX_MESSAGES_PER_REQUEST]
+            post_json(self.api, '/v2/bot/message/push', build_push_body(target, *chunk))
+            with self._lock:
+                self._stats['pushes'] += len(chunk)
+                self._stats['push_requests'] += 1
+
+    def _post_reply(self, reply_token: str, payload: List[bytes]):
+        post_json(self.api, '/v2/bot/message/reply', build_reply_body(reply_token, *payload))
+
+    def _increment(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def get_stats(self):
+        """遞送統計：reply / push 次數、過期 token 與回覆時 token 的年齡"""
+        with self._lock:
+            stats = dict(self._stats)
+        replies = stats.pop('replies')
+        age_total = stats.pop('reply_age_total_seconds')
+        age_max = stats.pop('reply_age_max_seconds')
+        stats.update({
+            'replies': replies,
+            'avg_reply_age_ms': round(age_total / replies * 1000, 1) if replies else 0.0,
+            'max_reply_age_ms': round(age_max * 1000, 1),
+        })
+        return stats
+
+
+# 全局 reply token 追蹤器實例（LineDelivery 於 main.py 綁定 LINE API 後建立）
+reply_token_tracker = ReplyTokenTracker()
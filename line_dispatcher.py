@@ -0,0 +1,303 @@
+"""
+LINE API 集中派送
+
+所有 LINE API 呼叫都經過同一個 HttpClient（作為 LineBotApi 的 http_client）：
+    - 全域 token bucket，依方案配額限制每秒請求數
+    - 收到 429 時依 Retry-After 暫停所有呼叫，並以抖動退避重試
+    - 等待中的呼叫數有上限，超過或等待過久即放棄（dropped）
+    - 共用連線池，避免每次呼叫都重新建立 TLS 連線
+
+推送類 API（push / multicast / narrowcast / broadcast）附帶 X-Line-Retry-Key，
+因此連線錯誤或 5xx 也可以安全重試；重試收到 409 表示先前的請求已被接受，
+409 原樣回傳並記入 accepted_retries，由呼叫端（line_delivery.post_json）視為成功。
+reply 一律不重試：429 的 Retry-After 可能超過 reply token 的時效，
+直接回傳 429 由 LineDelivery 改用 push。
+
+設定（環境變數）:
+    LINE_API_RATE_PER_SECOND=200   # 全域每秒請求數
+    LINE_API_BURST=200             # token bucket 容量
+    LINE_API_MAX_BACKLOG=500       # 同時等待中的呼叫上限
+    LINE_API_MAX_QUEUE_WAIT_SECONDS=10
+    LINE_API_MAX_RETRIES=3
+    LINE_API_POOL_SIZE=20
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from linebot.http_client import HttpClient, RequestsHttpClient, RequestsHttpResponse
+
+from metrics import LINE_API_DURATION, status_outcome
+from tracing import SPAN_KIND_CLIENT, tracer
+
+logger = logging.getLogger(__name__)
+
+# 支援 X-Line-Retry-Key 的推送類 API
+RETRY_KEY_PATHS = (
+    '/v2/bot/message/push',
+    '/v2/bot/message/multicast',
+    '/v2/bot/message/narrowcast',
+    '/v2/bot/message/broadcast',
+)
+
+REPLY_PATH = '/v2/bot/message/reply'
+
+# 退避上限（秒）
+MAX_BACKOFF_SECONDS = 30.0
+
+
+class LineApiDropped(Exception):
+    """等待佇列已滿或等待逾時，此呼叫未送出"""
+
+    def __init__(self, reason: str, path: str):
+        super().__init__(f"LINE API 呼叫未送出 ({reason}): {path}")
+        self.reason = reason
+        self.path = path
+
+
+class LineApiDispatcher:
+    """全域限速、重試與連線池"""
+
+    def __init__(self, rate_per_second: float = None, burst: float = None, max_backlog: int = None,
+                 max_queue_wait_seconds: float = None, max_retries: int = None, pool_size: int = None):
+        self.rate_per_second = rate_per_second or float(os.environ.get('LINE_API_RATE_PER_SECOND', '200'))
+        self.burst = burst or float(os.environ.get('LINE_API_BURST', self.rate_per_second))
+        self.max_backlog = max_backlog or int(os.environ.get('LINE_API_MAX_BACKLOG', '500'))
+        self.max_queue_wait_seconds = max_queue_wait_seconds or float(
+            os.environ.get('LINE_API_MAX_QUEUE_WAIT_SECONDS', '10')
+        )
+        self.max_retries = max_retries if max_retries is not None else int(
+            os.environ.get('LINE_API_MAX_RETRIES', '3')
+        )
+        self.pool_size = pool_size or int(os.environ.get('LINE_API_POOL_SIZE', '20'))
+
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._backlog = 0
+        self._session = None
+        self._stats = {
+            'calls': 0,
+            'queued': 0,
+            'retried': 0,
+            'dropped': 0,
+            'rate_limited': 0,
+            'failed': 0,
+            'accepted_retries': 0,
+            'queue_wait_total_seconds': 0.0,
+            'queue_wait_max_seconds': 0.0,
+            'max_backlog_seen': 0,
+        }
+
+    # --- 連線池 ---
+
+    def get_session(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return self._session
+
+    # --- token bucket ---
+
+    def _acquire(self, path: str):
+        """取得一個 token；必要時等待，等待中的呼叫數超過上限或等待過久則放棄"""
+        start = time.monotonic()
+        deadline = start + self.max_queue_wait_seconds
+        waiting = False
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate_per_second)
+                    self._updated = now
+                    if now >= self._paused_until and self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        if waiting:
+                            waited = now - start
+                            self._stats['queue_wait_total_seconds'] += waited
+                            if waited > self._stats['queue_wait_max_seconds']:
+                                self._stats['queue_wait_max_seconds'] = waited
+                        return
+
+                    if not waiting:
+                        if self._backlog >= self.max_backlog:
+                            self._stats['dropped'] += 1
+                            raise LineApiDropped('backlog_full', path)
+                        waiting = True
+                        self._backlog += 1
+                        self._stats['queued'] += 1
+                        if self._backlog > self._stats['max_backlog_seen']:
+                            self._stats['max_backlog_seen'] = self._backlog
+
+                    delay = max(self._paused_until - now, (1.0 - self._tokens) / self.rate_per_second)
+
+                if now + delay > deadline:
+                    with self._lock:
+                        self._stats['dropped'] += 1
+                    raise LineApiDropped('queue_timeout', path)
+                time.sleep(delay)
+        finally:
+            if waiting:
+                with self._lock:
+                    self._backlog -= 1
+
+    def _pause(self, seconds: float):
+        """收到 429 時暫停所有呼叫"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    # --- 派送 ---
+
+    @staticmethod
+    def _retry_after_seconds(response) -> Optional[float]:
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return None
+
+    def _backoff_seconds(self, attempt: int) -> float:
+        # full jitter：0 ~ 0.5 * 2^attempt 秒
+        return random.uniform(0, min(MAX_BACKOFF_SECONDS, 0.5 * (2 ** attempt)))
+
+    @staticmethod
+    def _endpoint_label(path: str) -> str:
+        """指標用的端點名稱：訊息類 API 保留完整路徑，其餘去掉 ID 等變動部分"""
+        parts = path.split('/')
+        return '/'.join(parts[:5] if len(parts) > 3 and parts[3] == 'message' else parts[:4])
+
+    def request(self, method: str, url: str, headers=None, timeout=None, **kwargs):
+        path = urlsplit(url).path
+        endpoint = self._endpoint_label(path)
+        start = time.perf_counter()
+        outcome = 'error'
+        with tracer.span('line.api', kind=SPAN_KIND_CLIENT, endpoint=endpoint, method=method) as span:
+            try:
+                response = self._request(method, url, path, headers, timeout, **kwargs)
+                outcome = status_outcome(response.status_code)
+                span.set_attribute('status', response.status_code)
+                return response
+            except LineApiDropped:
+                outcome = 'dropped'
+                raise
+            finally:
+                LINE_API_DURATION.observe(time.perf_counter() - start, endpoint, outcome)
+
+    def _request(self, method: str, url: str, path: str, headers, timeout, **kwargs):
+        headers = dict(headers or {})
+        idempotent = method == 'GET' or path.startswith(RETRY_KEY_PATHS)
+        if method == 'POST' and path.startswith(RETRY_KEY_PATHS):
+            headers.setdefault('X-Line-Retry-Key', str(uuid.uuid4()))
+
+        with self._lock:
+            self._stats['calls'] += 1
+
+        attempt = 0
+        while True:
+            self._acquire(path)
+            try:
+                response = self.get_session().request(method, url, headers=headers, timeout=timeout, **kwargs)
+            except requests.RequestException:
+                if not idempotent or attempt >= self.max_retries:
+                    with self._lock:
+                        self._stats['failed'] += 1
+                    raise
+                delay = self._backoff_seconds(attempt)
+            else:
+                status = response.status_code
+                if status == 429:
+                    with self._lock:
+                        self._stats['rate_limited'] += 1
+                    retry_after = self._retry_after_seconds(response)
+                    delay = retry_after if retry_after is not None else self._backoff_seconds(attempt)
+                    self._pause(delay)
+                    if path == REPLY_PATH:
+                        # 不在這裡等待 Retry-After，避免 reply token 在等待期間過期
+                        return response
+                elif status >= 500 and idempotent:
+                    delay = self._backoff_seconds(attempt)
+                else:
+                    # 帶 retry key 的重試收到 409 表示先前的請求已被接受（回應維持 409）
+                    if status == 409 and attempt > 0 and 'X-Line-Retry-Key' in headers:
+                        with self._lock:
+                            self._stats['accepted_retries'] += 1
+                        logger.info("LINE API 重試的請求先前已被接受", extra={
+                            'path': path, 'attempt': attempt,
+                            'accepted_request_id': response.headers.get('X-Line-Accepted-Request-Id')
+                        })
+                    return response
+
+                if attempt >= self.max_retries:
+                    with self._lock:
+                        self._stats['failed'] += 1
+                    return response
+
+            attempt += 1
+            with self._lock:
+                self._stats['retried'] += 1
+            logger.info("LINE API 重試", extra={
+                'path': path, 'attempt': attempt, 'delay': round(delay, 2), 'sampled': True
+            })
+            time.sleep(delay)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['backlog'] = self._backlog
+            paused = self._paused_until - time.monotonic()
+        queued = stats['queued']
+        wait_total = stats.pop('queue_wait_total_seconds')
+        wait_max = stats.pop('queue_wait_max_seconds')
+        stats.update({
+            'rate_per_second': self.rate_per_second,
+            'paused_ms': max(0, int(paused * 1000)),
+            'avg_queue_wait_ms': round(wait_total / queued * 1000, 1) if queued else 0.0,
+            'max_queue_wait_ms': round(wait_max * 1000, 1),
+        })
+        return stats
+
+
+# 全局派送器實例
+line_api_dispatcher = LineApiDispatcher()
+
+
+class DispatchingHttpClient(RequestsHttpClient):
+    """經由 line_api_dispatcher 送出請求的 LineBotApi http_client"""
+
+    def __init__(self, timeout=HttpClient.DEFAULT_TIMEOUT, dispatcher: LineApiDispatcher = None):
+        super(DispatchingHttpClient, self).__init__(timeout)
+        self.dispatcher = dispatcher or line_api_dispatcher
+
+    def _send(self, method, url, timeout, **kwargs):
+        if timeout is None:
+            timeout = self.timeout
+        return RequestsHttpResponse(self.dispatcher.request(method, url, timeout=timeout, **kwargs))
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._send('GET', url, timeout, headers=headers, params=params, stream=stream)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._send('POST', url, timeout, headers=headers, data=data)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._send('DELETE', url, timeout, headers=headers, data=data)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._send('PUT', url, timeout, headers=headers, data=data)
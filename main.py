@@ -1,6 +1,13 @@
 import os
+import io
+import csv
 import json
+import hmac
 import asyncio
+import logging
+import time
+import threading
+import functools
 import aiohttp
 from datetime import datetime, timezone
 import pytz  # 添加 pytz 用於時區處理
@@ -8,27 +15,24 @@ import pytz  # 添加 pytz 用於時區處理
 from dotenv import load_dotenv
 load_dotenv()
 
-# 設定台北時區
-TAIPEI_TZ = pytz.timezone('Asia/Taipei')
-
-# 導入憑證處理模組
-from google_credentials import setup_google_credentials
+# 結構化日誌：請求執行緒只把紀錄放進佇列，由背景執行緒輸出 JSON
+from structured_logging import setup_logging, user_content
+setup_logging()
+logger = logging.getLogger('linebot')
 
-# 在應用程式啟動時設定憑證
-print("🔧 正在設定 Google 憑證...")
-credentials_ready = setup_google_credentials()
+# 請求追蹤：每個 webhook 事件一個 trace（日誌 handler 會附上 trace_id）
+from profiling import PROFILING_ENABLED, ProfilerBusy, handler_profiler, sampling_profiler
+from tracing import SPAN_KIND_CLIENT, bind as bind_trace, current_span, current_trace_id, trace_headers, tracer
 
-if not credentials_ready:
-    print("⚠️ Google 憑證設定失敗，Dialogflow 功能可能無法正常工作")
-else:
-    print("✅ Google 憑證設定成功！")
+# 設定台北時區
+TAIPEI_TZ = pytz.timezone('Asia/Taipei')
 
-from flask import Flask, request, abort, send_from_directory # 導入 Flask 模組
+from flask import Flask, Response, request, abort, send_from_directory, stream_with_context # 導入 Flask 模組
 from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
+from linebot.exceptions import LineBotApiError
 from linebot.models import (
     MessageEvent, TextMessage, PostbackEvent,
-    FlexSendMessage, TextSendMessage
+    TextSendMessage
 )
 
 # --- Flask 應用實例 ---
@@ -43,86 +47,203 @@ if not LINE_CHANNEL_ACCESS_TOKEN or not LINE_CHANNEL_SECRET:
     import sys
     sys.exit(1)
 
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
+class _LazyLineBotApi:
+    """第一次呼叫 LINE API 時才建立 LineBotApi 實例"""
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._lock = threading.Lock()
+    
+    def get_instance(self):
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    self._instance = self._factory()
+        return self._instance
+    
+    def __getattr__(self, name):
+        return getattr(self.get_instance(), name)
+
+# 所有 LINE API 呼叫經由集中派送器：全域限速、429 / Retry-After 重試與連線池
+from line_dispatcher import DispatchingHttpClient, LineApiDropped, line_api_dispatcher
+line_bot_api = _LazyLineBotApi(lambda: LineBotApi(LINE_CHANNEL_ACCESS_TOKEN, http_client=DispatchingHttpClient))
 handler = WebhookHandler(LINE_CHANNEL_SECRET)
 
+# 依 reply token 剩餘時效自動選擇 reply 或 push
+from line_delivery import LineDelivery, reply_token_tracker
+line_delivery = LineDelivery(line_bot_api, reply_token_tracker)
+
+# 大量推播：相同內容合併為 multicast 分批送出
+from outbound_delivery import OutboundDeliveryService, BulkRequestError, serialize_messages
+outbound_delivery = OutboundDeliveryService(line_bot_api)
+
 # --- 智能路由配置 ---
 N8N_WEBHOOK_URL = os.environ.get('N8N_WEBHOOK_URL')
+# reply token 剩餘時間低於此值時不交給 n8n，改請 n8n 使用 push
+N8N_REPLY_MIN_REMAINING_SECONDS = float(os.environ.get('N8N_REPLY_MIN_REMAINING_SECONDS', '20'))
+# n8n 呼叫內部 API 時使用的共用金鑰（未設定則停用內部 API）
+INTERNAL_API_TOKEN = os.environ.get('INTERNAL_API_TOKEN')
 DIALOGFLOW_PROJECT_ID = os.environ.get('DIALOGFLOW_PROJECT_ID')
 
 # 導入 Dialogflow 客戶端（移除 LLM 客戶端）
+# 客戶端本身延遲初始化，第一次偵測意圖或背景預熱時才建立
 from dialogflow_client import dialogflow_client, context_manager
 
+from bot_config import bot_config
+from command_registry import CommandRegistry
+from rate_limiter import rate_limiter
+from priority_scheduler import priority_scheduler, SchedulerRejected
+from task_store import task_store, format_task_status, TaskUpdateError
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, DIALOGFLOW_DURATION, MESSAGE_DURATION, N8N_DURATION,
+    REGISTRATION_CHECK_DURATION, WEBHOOK_DURATION, WEBHOOK_EVENTS, metrics_registry, status_outcome
+)
+from sqlalchemy.exc import SQLAlchemyError
+
+# 會在 user_tasks 建立任務、由 n8n 回報進度的工作流
+TRACKED_WORKFLOWS = ('image_generation', 'rss_analysis')
+
+# 意圖 → (上下文名稱, 生命週期)
+INTENT_CONTEXTS = {
+    'form_filling_intent': ('form_filling', 5),
+    'image_generation_intent': ('image_generation', 3),
+    'rss_analysis_intent': ('rss_analysis', 5),
+}
+
 # --- 簡化的多層級路由處理器 ---
 class UnifiedMessageProcessor:
     def __init__(self):
-        self.supported_commands = {
-            '/填表': 'form_filling',
-            '/填表單': 'form_filling',
-            '/畫圖': 'image_generation',
-            '/分析RSS': 'rss_analysis',
-            '/查詢狀態': 'status_query',
-            '/取消任務': 'cancel_task',
-            '/說明': 'help',
-            '/幫助': 'help',
-            '/health': 'health_check',
-            '/健康檢查': 'health_check',
-            '/註冊': 'registration'
-        }
+        self.registry = CommandRegistry()
+        self._register_handlers()
+        # 群組中免 mention 的指令以註冊表為準
+        bot_config.group_allowed_commands = self.registry.group_commands()
+        self.supported_commands = self.registry.command_map()
+    
+    def _register_handlers(self):
+        """註冊直接指令、別名與 Dialogflow 意圖對應的處理器"""
+        register = self.registry.register
+        
+        register('form_filling',
+                 lambda user_id, args, reply_token: self.handle_form_command(user_id, reply_token),
+                 commands=['/填表', '/填表單'],
+                 intents={'form_filling_intent': None})
+        register('image_generation',
+                 lambda user_id, args, reply_token: self.handle_image_command(user_id, args, reply_token),
+                 commands=['/畫圖'],
+                 intents={'image_generation_intent': 'prompt'},
+                 rate_limited=True)
+        register('rss_analysis',
+                 lambda user_id, args, reply_token: self.handle_rss_command(user_id, args, reply_token),
+                 commands=['/分析RSS'],
+                 rate_limited=True)
+        register('rss_prompt',
+                 lambda user_id, args, reply_token: self.handle_rss_prompt(reply_token),
+                 intents={'rss_analysis_intent': None})
+        register('status_query',
+                 lambda user_id, args, reply_token: self.handle_status_command(user_id, reply_token),
+                 commands=['/查詢狀態'],
+                 intents={'status_query_intent': None})
+        register('cancel_task',
+                 lambda user_id, args, reply_token: self.handle_cancel_command(user_id, args.strip(), reply_token),
+                 commands=['/取消任務'])
+        register('help',
+                 lambda user_id, args, reply_token: self.handle_help_command(reply_token),
+                 commands=['/說明', '/幫助', '/help'],
+                 intents={'help_intent': None},
+                 requires_registration=False,
+                 group_allowed=True)
+        register('health_check',
+                 lambda user_id, args, reply_token: self.handle_health_command(user_id, reply_token),
+                 commands=['/health', '/健康檢查'],
+                 requires_registration=False,
+                 group_allowed=True)
+        register('registration',
+                 lambda user_id, args, reply_token: self.handle_registration_command(user_id, reply_token),
+                 commands=['/註冊'],
+                 requires_registration=False)
         
-    async def process_message(self, user_id, message_text, reply_token):
+    async def process_message(self, user_id, message_text, reply_token, source_type='user', group_id=None):
         """統一的訊息處理入口"""
-        try:
-            print(f"處理用戶 {user_id} 的訊息: {message_text}")
+        # 依最後到達的層級（route）與結果（outcome）記錄處理時間
+        start = time.perf_counter()
+        route = 'rate_limit'
+        outcome = 'handled'
+        with tracer.span('message.process', source_type=source_type) as span:
+            try:
+                logger.debug("處理訊息", extra={'user_id': user_id, 'text': user_content(message_text)})
             
-            # 第一層：直接指令檢測
-            if message_text.startswith('/'):
-                return await self.handle_direct_command(user_id, message_text, reply_token)
+                # 速率限制：在 Dialogflow / n8n 等昂貴流程之前擋下洗版訊息
+                throttled_key = self._check_rate_limits(user_id, group_id, message_text)
+                if throttled_key:
+                    outcome = 'throttled'
+                    return await self.send_throttled_response(reply_token, source_type, throttled_key)
             
-            # 第二層：Dialogflow 意圖分析
-            dialogflow_result = await self.handle_with_dialogflow(user_id, message_text, reply_token)
-            if dialogflow_result.get('handled'):
-                return dialogflow_result
+                # 每一層在各自的排程層級中執行，慢速的 LLM 流量不會佔用直接指令的名額
+                # 第一層：直接指令檢測
+                if message_text.startswith('/'):
+                    route = 'direct_command'
+                    async with priority_scheduler.slot('direct_command'):
+                        return await self.handle_direct_command(user_id, message_text, reply_token, source_type)
             
-            # 第三層：轉發給 n8n 進行 LLM 處理
-            return await self.forward_to_n8n_for_llm_analysis(user_id, message_text, reply_token)
+                # 第二層：Dialogflow 意圖分析
+                route = 'dialogflow'
+                async with priority_scheduler.slot('dialogflow'):
+                    dialogflow_result = await self.handle_with_dialogflow(user_id, message_text, reply_token)
+                if dialogflow_result.get('handled'):
+                    return dialogflow_result
             
-        except Exception as e:
-            print(f"訊息處理錯誤: {e}")
-            return await self.send_error_response(reply_token, str(e))
+                # 第三層：轉發給 n8n 進行 LLM 處理
+                route = 'llm_fallback'
+                async with priority_scheduler.slot('llm_fallback'):
+                    result = await self.forward_to_n8n_for_llm_analysis(user_id, message_text, reply_token)
+                if not result.get('handled'):
+                    outcome = 'unhandled'
+                return result
+            
+            except SchedulerRejected as e:
+                outcome = 'busy'
+                logger.warning("排程層級已滿，拒絕處理", extra={'user_id': user_id, 'error': str(e)})
+                return await self.send_busy_response(reply_token)
+            except LineApiDropped as e:
+                # LINE API 派送佇列已滿：錯誤回覆同樣送不出去，不再嘗試
+                outcome = 'dropped'
+                logger.warning("LINE API 呼叫未送出，放棄回覆", extra={
+                    'user_id': user_id, 'reason': e.reason, 'path': e.path
+                })
+                return None
+            except Exception as e:
+                outcome = 'error'
+                logger.exception("訊息處理錯誤", extra={'user_id': user_id})
+                return await self.send_error_response(reply_token, str(e))
+            finally:
+                MESSAGE_DURATION.observe(time.perf_counter() - start, route, outcome, source_type)
+                span.set_attribute('route', route)
+                span.set_attribute('outcome', outcome)
     
-    async def handle_direct_command(self, user_id, message_text, reply_token):
+    def _check_rate_limits(self, user_id, group_id, message_text):
+        """依群組、用戶、指令類型依序檢查 token bucket，回傳被限流的 key（未限流則為 None）"""
+        if group_id and not rate_limiter.allow('group', group_id):
+            return f'group:{group_id}'
+        if not rate_limiter.allow('user', user_id):
+            return f'user:{user_id}'
+        if message_text.startswith('/'):
+            spec = self.registry.resolve_command(message_text.split(' ', 1)[0])
+            if spec and spec.rate_limited and not rate_limiter.allow('command', f'{spec.name}:{user_id}'):
+                return f'command:{spec.name}:{user_id}'
+        return None
+    
+    async def handle_direct_command(self, user_id, message_text, reply_token, source_type='user'):
         """處理直接指令"""
         parts = message_text.split(' ', 1)
         command = parts[0]
         args = parts[1] if len(parts) > 1 else ""
         
-        if command in self.supported_commands:
-            command_type = self.supported_commands[command]
-            
-            if command_type == 'form_filling':
-                return await self.handle_form_command(user_id, reply_token)
-            elif command_type == 'image_generation':
-                return await self.handle_image_command(user_id, args, reply_token)
-            elif command_type == 'rss_analysis':
-                return await self.handle_rss_command(user_id, args, reply_token)
-            elif command_type == 'status_query':
-                return await self.handle_status_command(user_id, reply_token)
-            elif command_type == 'help':
-                return await self.handle_help_command(reply_token)
-            elif command_type == 'health_check':
-                return await self.handle_health_command(user_id, reply_token)
-            elif command_type == 'registration':
-                return await self.handle_registration_command(user_id, reply_token)
-            else:
-                return await self.trigger_n8n_workflow('direct_command', {
-                    'command': command,
-                    'args': args,
-                    'user_id': user_id,
-                    'reply_token': reply_token
-                })
-        else:
+        spec = self.registry.resolve_command(command)
+        if spec is None:
             return await self.send_unknown_command_response(reply_token, command)
+        
+        return await self.registry.dispatch(spec, user_id, args, reply_token)
     
     async def handle_with_dialogflow(self, user_id, message_text, reply_token):
         """使用 Dialogflow 進行意圖分析"""
@@ -134,13 +255,23 @@ class UnifiedMessageProcessor:
             current_context = context_manager.get_context(user_id)
             
             # 使用 Dialogflow 客戶端
-            intent_result = await dialogflow_client.detect_intent(
-                text=message_text,
-                session_id=user_id,
-                context=current_context
-            )
+            start = time.perf_counter()
+            with tracer.span('dialogflow.detect_intent', kind=SPAN_KIND_CLIENT) as span:
+                try:
+                    intent_result = await dialogflow_client.detect_intent(
+                        text=message_text,
+                        session_id=user_id,
+                        context=current_context
+                    )
+                except Exception:
+                    DIALOGFLOW_DURATION.observe(time.perf_counter() - start, 'error')
+                    raise
+                span.set_attribute('intent', intent_result.get('intent'))
+                span.set_attribute('confidence', intent_result['confidence'])
+            matched = intent_result['confidence'] > 0.7
+            DIALOGFLOW_DURATION.observe(time.perf_counter() - start, 'matched' if matched else 'low_confidence')
             
-            if intent_result['confidence'] > 0.7:
+            if matched:
                 # 更新上下文
                 self._update_user_context(user_id, intent_result)
                 return await self.route_by_intent(intent_result, user_id, reply_token)
@@ -148,59 +279,31 @@ class UnifiedMessageProcessor:
                 return {'handled': False, 'reason': 'low_confidence', 'confidence': intent_result['confidence']}
                 
         except Exception as e:
-            print(f"Dialogflow 處理錯誤: {e}")
+            logger.warning("Dialogflow 處理錯誤", extra={'user_id': user_id, 'error': str(e)})
             return {'handled': False, 'reason': 'dialogflow_error'}
     
     def _update_user_context(self, user_id, intent_result):
         """更新用戶上下文"""
-        intent_name = intent_result.get('intent', '')
-        parameters = intent_result.get('parameters', {})
-        
-        # 根據意圖設定相應的上下文
-        if intent_name == 'form_filling_intent':
-            context_manager.set_context(user_id, 'form_filling', parameters, 5)
-        elif intent_name == 'image_generation_intent':
-            context_manager.set_context(user_id, 'image_generation', parameters, 3)
-        elif intent_name == 'rss_analysis_intent':
-            context_manager.set_context(user_id, 'rss_analysis', parameters, 5)
+        context = INTENT_CONTEXTS.get(intent_result.get('intent', ''))
+        if context:
+            context_name, lifespan = context
+            context_manager.set_context(user_id, context_name, intent_result.get('parameters', {}), lifespan)
     
     async def route_by_intent(self, intent_result, user_id, reply_token):
         """根據 Dialogflow 意圖路由"""
-        intent_name = intent_result['intent']
-        parameters = intent_result.get('parameters', {})
-        
-        if intent_name == 'form_filling_intent':
-            await self.handle_form_command(user_id, reply_token)
-            return {'handled': True}
-            
-        elif intent_name == 'image_generation_intent':
-            prompt = parameters.get('prompt', '')
-            await self.handle_image_command(user_id, prompt, reply_token)
-            return {'handled': True}
-            
-        elif intent_name == 'rss_analysis_intent':
-            # 需要進一步收集 URL
-            line_bot_api.reply_message(
-                reply_token,
-                TextSendMessage(text="請提供要分析的 RSS 網址，或使用指令：/分析RSS [網址]")
-            )
-            return {'handled': True}
-            
-        elif intent_name == 'status_query_intent':
-            await self.handle_status_command(user_id, reply_token)
-            return {'handled': True}
-            
-        elif intent_name == 'help_intent':
-            await self.handle_help_command(reply_token)
-            return {'handled': True}
-            
-        else:
+        spec, param = self.registry.resolve_intent(intent_result['intent'])
+        if spec is None:
             return {'handled': False}
+        
+        args = intent_result.get('parameters', {}).get(param, '') if param else ''
+        await self.registry.dispatch(spec, user_id, args, reply_token)
+        return {'handled': True}
     
     async def forward_to_n8n_for_llm_analysis(self, user_id, message_text, reply_token):
         """轉發給 n8n 進行 LLM 分析和處理"""
         
-        # 不立即回覆，保留 reply_token 給 n8n 使用
+        # 不立即回覆，保留 reply_token 給 n8n 使用；剩餘時效不足時請 n8n 改用 push
+        token_info = line_delivery.hand_off(reply_token, N8N_REPLY_MIN_REMAINING_SECONDS)
         
         # 轉發給 n8n 的 LLM 分析工作流
         payload = {
@@ -208,25 +311,40 @@ class UnifiedMessageProcessor:
             'workflow': 'llm_intent_analyzer',  # n8n 中的 LLM 分析工作流
             'user_id': user_id,
             'message_text': message_text,
-            'reply_token': reply_token,  # n8n 可以用這個回覆用戶
+            'reply_token': token_info['reply_token'],  # n8n 可以用這個回覆用戶
+            'reply_token_remaining_ms': token_info['remaining_ms'],
+            'reply_token_expires_at': (
+                datetime.fromtimestamp(token_info['expires_at'], TAIPEI_TZ).isoformat()
+                if token_info['expires_at'] else None
+            ),
+            'delivery': 'reply' if token_info['reply_token'] else 'push',
+            'push_to': token_info['push_to'] or user_id,
             'timestamp': datetime.now(TAIPEI_TZ).isoformat(),
-            'processing_type': 'llm_analysis'
+            'processing_type': 'llm_analysis',
+            'trace_id': current_trace_id()  # 與 traceparent 標頭相同的 trace，方便對照 n8n 執行紀錄
         }
         
+        start = time.perf_counter()
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    N8N_WEBHOOK_URL,
-                    json=payload,
-                    headers={'Content-Type': 'application/json'}
-                ) as response:
-                    result = await response.text()
-                    print(f"已轉發給 n8n LLM 分析: {response.status}")
-                    return {'handled': True, 'forwarded_to_n8n': True}
+            with tracer.span('n8n.post', kind=SPAN_KIND_CLIENT, workflow='llm_intent_analyzer') as span:
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(
+                        N8N_WEBHOOK_URL,
+                        json=payload,
+                        headers={'Content-Type': 'application/json', **trace_headers()}
+                    ) as response:
+                        await response.read()
+                        span.set_attribute('status', response.status)
+                        N8N_DURATION.observe(time.perf_counter() - start, 'llm_intent_analyzer',
+                                             status_outcome(response.status))
+                        logger.info("已轉發給 n8n LLM 分析",
+                                    extra={'user_id': user_id, 'status': response.status, 'sampled': True})
+                        return {'handled': True, 'forwarded_to_n8n': True}
         except Exception as e:
-            print(f"轉發到 n8n 失敗: {e}")
+            N8N_DURATION.observe(time.perf_counter() - start, 'llm_intent_analyzer', 'error')
+            logger.error("轉發到 n8n 失敗", extra={'user_id': user_id, 'error': str(e)})
             # 發送錯誤訊息
-            line_bot_api.push_message(
+            line_delivery.push(
                 user_id,
                 TextSendMessage(text="抱歉，系統暫時無法處理您的請求，請稍後再試。")
             )
@@ -237,10 +355,10 @@ class UnifiedMessageProcessor:
     async def handle_form_command(self, user_id, reply_token):
         """處理填表指令"""
         if user_id:
-            print(f"發送 Flex Message 給 {user_id}")
+            logger.info("發送填表 Flex 訊息", extra={'user_id': user_id, 'sampled': True})
             send_flex_reply_message(reply_token, user_id)
         else:
-            line_bot_api.reply_message(
+            line_delivery.reply(
                 reply_token,
                 TextSendMessage(text="請先加為好友後再使用此功能")
             )
@@ -248,8 +366,8 @@ class UnifiedMessageProcessor:
     async def handle_image_command(self, user_id, prompt, reply_token):
         """處理畫圖指令"""
         if prompt:
-            print(f"收到畫圖指令: {prompt}")
-            line_bot_api.reply_message(
+            logger.info("收到畫圖指令", extra={'user_id': user_id, 'prompt': user_content(prompt)})
+            line_delivery.reply(
                 reply_token,
                 TextSendMessage(text="好的，您的圖片正在生成中，預計將透過 Email 傳送給您。")
             )
@@ -258,7 +376,7 @@ class UnifiedMessageProcessor:
                 'user_id': user_id
             })
         else:
-            line_bot_api.reply_message(
+            line_delivery.reply(
                 reply_token,
                 TextSendMessage(text="請提供繪圖提示詞，例如：/畫圖 一隻飛翔的龍")
             )
@@ -266,7 +384,7 @@ class UnifiedMessageProcessor:
     async def handle_rss_command(self, user_id, url, reply_token):
         """處理RSS分析指令"""
         if url:
-            line_bot_api.reply_message(
+            line_delivery.reply(
                 reply_token,
                 TextSendMessage(text=f"正在分析 RSS: {url}")
             )
@@ -275,20 +393,59 @@ class UnifiedMessageProcessor:
                 'user_id': user_id
             })
         else:
-            line_bot_api.reply_message(
+            line_delivery.reply(
                 reply_token,
                 TextSendMessage(text="請提供 RSS 網址，例如：/分析RSS https://example.com/rss")
             )
     
-    async def handle_status_command(self, user_id, reply_token):
-        """處理狀態查詢指令"""
-        line_bot_api.reply_message(
+    async def handle_rss_prompt(self, reply_token):
+        """RSS 意圖但尚未提供網址時，提示用戶"""
+        line_delivery.reply(
             reply_token,
-            TextSendMessage(text="正在查詢您的任務狀態...")
+            TextSendMessage(text="請提供要分析的 RSS 網址，或使用指令：/分析RSS [網址]")
         )
-        await self.trigger_n8n_workflow('status_query', {
-            'user_id': user_id
+    
+    async def handle_cancel_command(self, user_id, task_id, reply_token):
+        """
+        取消任務：標記 user_tasks、捨棄尚未送出的推播，並通知 n8n 中止工作流
+        task_id 為空時取消該用戶所有進行中的任務
+        """
+        try:
+            cancelled = await asyncio.to_thread(task_store.cancel_tasks, user_id, task_id or None)
+        except SQLAlchemyError as e:
+            logger.error("取消任務失敗", extra={'user_id': user_id, 'error': str(e)})
+            line_delivery.reply(reply_token, TextSendMessage(text="暫時無法取消任務，請稍後再試。"))
+            return {'handled': True, 'cancelled': 0}
+        
+        if not cancelled:
+            line_delivery.reply(reply_token, TextSendMessage(text="目前沒有可以取消的任務"))
+            return {'handled': True, 'cancelled': 0}
+        
+        task_ids = [task['task_key'] for task in cancelled if task['task_key']]
+        # 只能捨棄本 worker 上尚未送出的推播，其他 worker 已排入的批次不受影響
+        dropped_jobs = sum(outbound_delivery.cancel(task_key) for task_key in task_ids)
+        logger.info("用戶取消任務", extra={
+            'user_id': user_id, 'cancelled': len(cancelled), 'dropped_jobs': dropped_jobs
         })
+        
+        line_delivery.reply(reply_token, TextSendMessage(text=f"已取消 {len(cancelled)} 個任務"))
+        await self.trigger_n8n_workflow('cancel_task', {
+            'user_id': user_id,
+            'task_ids': task_ids
+        })
+        return {'handled': True, 'cancelled': len(cancelled)}
+    
+    async def handle_status_command(self, user_id, reply_token):
+        """處理狀態查詢指令（直接查詢本地 user_tasks，不經 n8n）"""
+        try:
+            tasks = await asyncio.to_thread(task_store.get_recent_tasks, user_id)
+            status_text = format_task_status(
+                tasks, to_local=lambda dt: pytz.utc.localize(dt).astimezone(TAIPEI_TZ)
+            )
+        except SQLAlchemyError as e:
+            logger.error("查詢任務狀態失敗", extra={'user_id': user_id, 'error': str(e)})
+            status_text = "暫時無法查詢任務狀態，請稍後再試。"
+        line_delivery.reply(reply_token, TextSendMessage(text=status_text))
     
     async def handle_help_command(self, reply_token):
         """處理說明指令"""
@@ -313,14 +470,14 @@ class UnifiedMessageProcessor:
 
 💡 您也可以直接用自然語言描述需求，我會盡力理解並協助您！
 """
-        line_bot_api.reply_message(
+        line_delivery.reply(
             reply_token,
             TextSendMessage(text=help_text)
         )
     
     async def handle_registration_command(self, user_id, reply_token):
         """處理註冊指令"""
-        print(f"用戶 {user_id} 請求註冊")
+        logger.info("用戶請求註冊", extra={'user_id': user_id})
         send_registration_flex_message(reply_token, user_id)
         
     async def handle_health_command(self, user_id, reply_token):
@@ -419,14 +576,14 @@ class UnifiedMessageProcessor:
 • 用戶 ID: {user_id[:10]}...
 """
             
-            line_bot_api.reply_message(
+            line_delivery.reply(
                 reply_token,
                 TextSendMessage(text=health_report)
             )
             
         except Exception as e:
             error_msg = f"🚫 健康檢查失敗\n\n錯誤訊息: {str(e)[:100]}..."
-            line_bot_api.reply_message(
+            line_delivery.reply(
                 reply_token,
                 TextSendMessage(text=error_msg)
             )
@@ -434,38 +591,78 @@ class UnifiedMessageProcessor:
     # --- 輔助方法 ---
     
     async def trigger_n8n_workflow(self, workflow_type, params):
-        """觸發 n8n 工作流"""
+        """觸發 n8n 工作流；需要追蹤進度的工作流先建立任務，task_id 一併傳給 n8n"""
         payload = {
             'source': 'unified_processor',
             'workflow': workflow_type,
             'timestamp': datetime.now(TAIPEI_TZ).isoformat(),
+            'trace_id': current_trace_id(),
             **params
         }
+        if workflow_type in TRACKED_WORKFLOWS:
+            with tracer.span('db.create_task', workflow=workflow_type):
+                payload['task_id'] = await asyncio.to_thread(
+                    task_store.create_task, params.get('user_id'), workflow_type, params
+                )
         
+        start = time.perf_counter()
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    N8N_WEBHOOK_URL,
-                    json=payload,
-                    headers={'Content-Type': 'application/json'}
-                ) as response:
-                    result = await response.text()
-                    print(f"n8n 工作流觸發成功: {response.status}, {result}")
-                    return True
+            with tracer.span('n8n.post', kind=SPAN_KIND_CLIENT, workflow=workflow_type,
+                             task_id=payload.get('task_id')) as span:
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(
+                        N8N_WEBHOOK_URL,
+                        json=payload,
+                        headers={'Content-Type': 'application/json', **trace_headers()}
+                    ) as response:
+                        # 不記錄 n8n 回應內容，只記狀態碼與大小
+                        body = await response.read()
+                        span.set_attribute('status', response.status)
+                        N8N_DURATION.observe(time.perf_counter() - start, workflow_type, status_outcome(response.status))
+                        logger.info("n8n 工作流觸發成功", extra={
+                            'workflow': workflow_type, 'task_id': payload.get('task_id'),
+                            'status': response.status, 'response_bytes': len(body), 'sampled': True
+                        })
+                        return True
         except Exception as e:
-            print(f"觸發 n8n 工作流失敗: {e}")
+            N8N_DURATION.observe(time.perf_counter() - start, workflow_type, 'error')
+            logger.error("觸發 n8n 工作流失敗", extra={'workflow': workflow_type, 'error': str(e)})
+            if payload.get('task_id'):
+                try:
+                    await asyncio.to_thread(task_store.apply_updates, [{
+                        'task_id': payload['task_id'], 'status': 'failed', 'message': '無法啟動工作流，請稍後再試'
+                    }])
+                except SQLAlchemyError as db_error:
+                    logger.error("更新任務狀態失敗", extra={'task_id': payload['task_id'], 'error': str(db_error)})
             return False
     
     # --- 回應方法 ---
     
     async def send_unknown_command_response(self, reply_token, command):
-        line_bot_api.reply_message(
+        line_delivery.reply(
             reply_token,
             TextSendMessage(text=f"未知指令：{command}\n\n請輸入 /說明 查看可用功能")
         )
     
+    async def send_throttled_response(self, reply_token, source_type, throttled_key):
+        """被限流時只在一對一聊天中提醒一次，群組中保持安靜"""
+        logger.info("訊息被限流", extra={'throttled_key': throttled_key, 'sampled': True})
+        if source_type == 'user' and rate_limiter.should_notify(throttled_key):
+            line_delivery.reply(
+                reply_token,
+                TextSendMessage(text="您的訊息太頻繁了，請稍候再試 🙏")
+            )
+        return {'handled': True, 'throttled': True}
+    
+    async def send_busy_response(self, reply_token):
+        line_delivery.reply(
+            reply_token,
+            TextSendMessage(text="目前系統忙碌中，請稍後再試 🙏")
+        )
+        return {'handled': True, 'busy': True}
+    
     async def send_error_response(self, reply_token, error_msg):
-        line_bot_api.reply_message(
+        line_delivery.reply(
             reply_token,
             TextSendMessage(text="處理您的請求時發生錯誤，請稍後再試。")
         )
@@ -476,23 +673,71 @@ message_processor = UnifiedMessageProcessor()
 # --- Webhook 入口點 ---
 @app.route("/callback", methods=['POST'])
 def callback():
-    signature = request.headers['X-Line-Signature']
-    body = request.get_data(as_text=True)
+    start = time.perf_counter()
+    outcome = 'error'
+    # 每個事件在 traced_event 中各自開始一個 trace，以 link 連回這個請求
+    with tracer.start_trace('line.webhook') as span:
+        try:
+            signature = request.headers['X-Line-Signature']
+            body = request.get_data(as_text=True)
 
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
-        print("Invalid signature. Please check your channel access token/channel secret.")
-        abort(400)
-    
-    return 'OK'
+            # 先驗證簽章，再直接檢查原始 JSON：
+            # 群組中未 mention 也非允許指令的文字訊息在建立 SDK 物件前就丟棄
+            if not handler.parser.signature_validator.validate(body, signature):
+                outcome = 'invalid_signature'
+                logger.warning("簽章驗證失敗，請檢查 channel access token / channel secret")
+                abort(400)
+
+            try:
+                body_json = json.loads(body)
+            except ValueError:
+                body_json = None
+            if not isinstance(body_json, dict):
+                outcome = 'bad_request'
+                abort(400)
+
+            events = body_json.get('events') or []
+            span.set_attribute('events', len(events))
+            for event in events:
+                WEBHOOK_EVENTS.inc(event.get('type'), (event.get('source') or {}).get('type'))
+
+            kept_events = group_message_filter.filter_events(body_json)
+            if not kept_events:
+                outcome = 'filtered'
+                return 'OK'
+
+            # 只有留下的事件才建立 SDK 物件；簽章已在上面驗證過
+            dispatch_events(handler, kept_events, body_json.get('destination'))
+
+            outcome = 'ok'
+            return 'OK'
+        finally:
+            WEBHOOK_DURATION.observe(time.perf_counter() - start, outcome)
+            span.set_attribute('outcome', outcome)
 
 # --- LINE 事件處理 ---
 
-# 導入 bot 配置
-from bot_config import bot_config
+from webhook_filter import dispatch_events, group_message_filter
+from flex_templates import flex_templates
+from message_coalescer import message_coalescer
+
+def traced_event(func):
+    """每個 webhook 事件各自一個 trace（trace_id 會隨日誌與 n8n payload 傳遞）"""
+    @functools.wraps(func)
+    def wrapper(event):
+        source = event.source
+        with tracer.start_trace(
+            'line.event', link=current_span(),
+            event_type=event.type,
+            source_type=source.type,
+            user_id=getattr(source, 'user_id', None),
+            webhook_event_id=getattr(event, 'webhook_event_id', None)
+        ):
+            return func(event)
+    return wrapper
 
 @handler.add(MessageEvent, message=TextMessage)
+@traced_event
 def handle_message(event):
     user_id = event.source.user_id
     message_text = event.message.text
@@ -503,264 +748,149 @@ def handle_message(event):
     group_id = getattr(event.source, 'group_id', None) if source_type == 'group' else None
     room_id = getattr(event.source, 'room_id', None) if source_type == 'room' else None
     
-    print(f"收到來自 {source_type} 的訊息 - User ID: {user_id}, Group/Room ID: {group_id or room_id}, 訊息: {message_text}")
+    # 記錄 reply token 的接收時間，逾時則自動改用 push
+    reply_token_tracker.record(reply_token, group_id or room_id or user_id, event.timestamp)
+    
+    mentioned = False
     
     # 處理群組/聊天室訊息：只有在被 mention 或特定指令時才回應
+    # （大部分已在 callback 的前置過濾器丟棄，這裡保留作為防線，且不記錄訊息內容）
     if source_type in ['group', 'room']:
         if not bot_config.should_respond_in_group(message_text):
-            print(f"群組訊息未滿足回應條件，忽略處理: {message_text}")
             return  # 不處理不符合條件的群組訊息
         
         # 移除 mention 標記以便後續處理
-        original_message = message_text
-        message_text = bot_config.remove_mention(message_text)
-        
-        if original_message != message_text:
-            print(f"群組中被 mention，處理訊息: '{original_message}' -> '{message_text}'")
-        else:
-            print(f"群組中使用允許指令: {message_text}")
+        stripped_text = bot_config.remove_mention(message_text)
+        mentioned = stripped_text != message_text
+        message_text = stripped_text
+
+    logger.info("收到訊息", extra={
+        'source_type': source_type,
+        'user_id': user_id,
+        'chat_id': group_id or room_id,
+        'mentioned': mentioned,
+        'text': user_content(message_text),
+        'sampled': True
+    })
 
     # 檢查用戶是否已註冊
     from user_manager import UserManager  # 導入 UserManager
     user_manager_instance = UserManager() # 創建 UserManager 實例
     
-    is_registered = user_manager_instance.is_registered_user(user_id)
+    start = time.perf_counter()
+    with tracer.span('db.registration_check'):
+        is_registered = user_manager_instance.is_registered_user(user_id)
+    REGISTRATION_CHECK_DURATION.observe(
+        time.perf_counter() - start, 'registered' if is_registered else 'unregistered'
+    )
     # 提取指令部分進行比較
     command_part = message_text.split(' ')[0]
 
     # 如果用戶未註冊且不是允許的指令，優先引導用戶註冊
     # 但在群組中不主動發送註冊訊息，避免打擾其他成員
-    if not is_registered and not bot_config.is_unregistered_allowed_command(command_part):
+    if not is_registered and message_processor.registry.requires_registration(command_part):
         if source_type == 'user':  # 只在一對一聊天中發送註冊引導
-            print(f"用戶 {user_id} 尚未註冊 ({is_registered=}) 且指令 '{command_part}' 非公開允許，發送註冊引導訊息。")
+            logger.info("未註冊用戶，發送註冊引導", extra={'user_id': user_id})
             send_registration_flex_message(reply_token, user_id)
         else:  # 在群組中給出簡短提示
-            print(f"群組中用戶 {user_id} 尚未註冊，給出簡短提示。")
-            line_bot_api.reply_message(
+            logger.info("群組中未註冊用戶，給出簡短提示", extra={'user_id': user_id, 'chat_id': group_id or room_id})
+            line_delivery.reply(
                 reply_token,
                 TextSendMessage(text="請先私訊我完成註冊後再使用此功能 📝")
             )
         return # 結束處理
     
-    # 如果用戶輸入的是 "/填表" 或 "/填表單"，則發送填表 Flex 訊息
-    if command_part in ['/填表', '/填表單']:
-        print(f"用戶 {user_id} 請求填表，發送填表 Flex 訊息。")
-        send_flex_reply_message(reply_token, user_id)
-        return # 結束處理
+    logger.debug("繼續處理訊息", extra={'user_id': user_id, 'registered': is_registered})
+
+    chat_id = group_id or room_id
+    coalesce_key = f"{chat_id or 'direct'}:{user_id}"
+    
+    if message_text.startswith('/'):
+        # 指令不合併；先送出之前累積的文字，維持訊息順序
+        message_coalescer.flush(coalesce_key)
+    else:
+        # 自然語言訊息：啟用合併時在視窗時間後以最新的 reply token 一次處理
+        # （計時器執行緒沿用最後一則訊息的 trace）
+        @bind_trace
+        def on_flush(merged_text, latest_reply_token, count):
+            if count > 1:
+                logger.info("合併訊息", extra={'user_id': user_id, 'count': count})
+            run_message_processing(user_id, merged_text, latest_reply_token, source_type, chat_id)
+        
+        if message_coalescer.submit(coalesce_key, message_text, reply_token, on_flush):
+            return
     
-    print(f"用戶 {user_id} 狀態: {'已註冊' if is_registered else '未註冊但指令允許'}。繼續處理訊息 '{message_text}'。")
+    run_message_processing(user_id, message_text, reply_token, source_type, chat_id)
 
-    # 使用統一處理器
+def run_message_processing(user_id, message_text, reply_token, source_type, chat_id):
+    """在獨立的事件迴圈中執行統一處理器"""
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(
-            message_processor.process_message(user_id, message_text, reply_token)
-        )
-        loop.close()
-    except Exception as e:
-        print(f"處理訊息時發生錯誤: {e}")
-        line_bot_api.reply_message(
-            reply_token,
-            TextSendMessage(text="抱歉，處理您的訊息時發生錯誤，請稍後再試。")
-        )
+        # 處理期間發往同一聊天室的 push 合併送出
+        with line_delivery.batch(chat_id or user_id):
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(
+                    message_processor.process_message(user_id, message_text, reply_token, source_type, chat_id)
+                )
+            finally:
+                loop.close()
+    except LineApiDropped as e:
+        # 離開 batch 時的合併 push 也可能未送出；派送佇列已滿時不再補送錯誤回覆
+        logger.warning("LINE API 呼叫未送出", extra={'user_id': user_id, 'reason': e.reason, 'path': e.path})
+    except Exception:
+        logger.exception("處理訊息時發生錯誤", extra={'user_id': user_id})
+        try:
+            line_delivery.reply(
+                reply_token,
+                TextSendMessage(text="抱歉，處理您的訊息時發生錯誤，請稍後再試。")
+            )
+        except (LineBotApiError, LineApiDropped) as e:
+            logger.warning("錯誤回覆送出失敗", extra={'user_id': user_id, 'error': str(e)})
 
 @handler.add(PostbackEvent)
+@traced_event
 def handle_postback(event):
     user_id = event.source.user_id
     reply_token = event.reply_token
     postback_data = event.postback.data
     
-    print(f"收到 User ID: {user_id} 的 Postback: {postback_data}")
+    reply_token_tracker.record(
+        reply_token,
+        getattr(event.source, 'group_id', None) or getattr(event.source, 'room_id', None) or user_id,
+        event.timestamp
+    )
     
-    if postback_data in ['confirm_task', 'cancel_task']:
-        if postback_data == 'confirm_task':
-            line_bot_api.reply_message(
-                reply_token,
-                TextSendMessage(text="任務已確認，正在處理中...")
-            )
-        else:
-            line_bot_api.reply_message(
-                reply_token,
-                TextSendMessage(text="任務已取消")
-            )
+    logger.info("收到 postback", extra={'user_id': user_id, 'data': postback_data[:100], 'sampled': True})
+    
+    if postback_data == 'confirm_task':
+        line_delivery.reply(
+            reply_token,
+            TextSendMessage(text="任務已確認，正在處理中...")
+        )
+    elif postback_data == 'cancel_task' or postback_data.startswith('cancel_task:'):
+        # cancel_task 取消所有進行中的任務；cancel_task:<task_id> 只取消指定任務
+        task_id = postback_data.partition(':')[2]
+        asyncio.run(message_processor.handle_cancel_command(user_id, task_id, reply_token))
     else:
-        line_bot_api.reply_message(
+        line_delivery.reply(
             reply_token,
             TextSendMessage(text=f"您選擇了: {postback_data}")
         )
 
 # --- 輔助函式 ---
 
+def reply_prebuilt_messages(reply_token, *messages):
+    """以預先序列化的 message JSON bytes 遞送（略過 SDK 模型重建；token 逾時時改用 push）"""
+    line_delivery.reply(reply_token, list(messages))
+
 def send_flex_reply_message(reply_token, user_id):
-    flex_message_contents = {
-        "type": "bubble",
-        "hero": {
-            "type": "image",
-            "url": "https://bwctaiwan.com/cozeta/wp-content/uploads/2025/03/01.png",
-            "size": "full",
-            "aspectRatio": "20:13",
-            "aspectMode": "cover"
-        },
-        "body": {
-            "type": "box",
-            "layout": "vertical",
-            "contents": [
-                {
-                    "type": "text",
-                    "text": "📌 進稿類別",
-                    "weight": "bold",
-                    "size": "lg",
-                    "align": "center",
-                    "color": "#474646FF"
-                },
-                {
-                    "type": "text",
-                    "text": "請選擇合適的進稿方式👇",
-                    "size": "sm",
-                    "color": "#9E9E9EFF",
-                    "align": "center",
-                    "wrap": True
-                },
-                {
-                    "type": "button",
-                    "style": "primary",
-                    "color": "#4D513CFF",
-                    "margin": "lg",
-                    "action": {
-                        "type": "uri",
-                        "label": "📄 紙本進稿單",
-                        "uri": "https://form.typeform.com/to/q1Ih9jmJ#userid=" + user_id + "&category=paper"
-                    }
-                },
-                {
-                    "type": "button",
-                    "style": "primary",
-                    "color": "#4D513CFF",
-                    "margin": "sm",
-                    "action": {
-                        "type": "uri",
-                        "label": "📱 數位進稿單",
-                        "uri": "https://form.typeform.com/to/q1Ih9jmJ#userid=" + user_id + "&category=digital"
-                    }
-                }
-            ]
-        }
-    }
-    line_bot_api.reply_message(
-        reply_token,
-        FlexSendMessage(alt_text="選擇進稿類別", contents=flex_message_contents)
-    )
+    """發送選擇進稿類別的 Flex 訊息"""
+    reply_prebuilt_messages(reply_token, flex_templates.render('form_category', user_id=user_id))
 
 def send_registration_flex_message(reply_token, user_id):
     """發送用戶註冊的 Flex 訊息"""
-    flex_message_contents = {
-        "type": "bubble",
-        "hero": {
-            "type": "image",
-            "url": "https://bwctaiwan.com/cozeta/wp-content/uploads/2025/03/register.png",
-            "size": "full",
-            "aspectRatio": "20:13",
-            "aspectMode": "cover"
-        },
-        "body": {
-            "type": "box",
-            "layout": "vertical",
-            "contents": [
-                {
-                    "type": "text",
-                    "text": "📝 用戶註冊",
-                    "weight": "bold",
-                    "size": "xl",
-                    "align": "center",
-                    "color": "#1E3A8AFF"
-                },
-                {
-                    "type": "text",
-                    "text": "請完成註冊以使用更多功能",
-                    "size": "sm",
-                    "color": "#6B7280FF",
-                    "align": "center",
-                    "wrap": True,
-                    "margin": "md"
-                },
-                {
-                    "type": "box",
-                    "layout": "vertical",
-                    "margin": "lg",
-                    "spacing": "sm",
-                    "contents": [
-                        {
-                            "type": "button",
-                            "style": "primary",
-                            "color": "#1E3A8AFF",
-                            "action": {
-                                "type": "uri",
-                                "label": "👤 立即註冊",
-                                "uri": f"https://bweline.zeabur.app/registerUI/index.html?userId={user_id}"
-                            },
-                            "height": "sm"
-                        }
-                    ]
-                },
-                {
-                    "type": "box",
-                    "layout": "vertical",
-                    "margin": "lg",
-                    "contents": [
-                        {
-                            "type": "text",
-                            "text": "註冊後即可使用以下功能：",
-                            "size": "xs",
-                            "color": "#6B7280FF"
-                        },
-                        {
-                            "type": "text",
-                            "text": "• 自然語言對話",
-                            "size": "xs",
-                            "color": "#6B7280FF",
-                            "margin": "sm"
-                        },
-                        {
-                            "type": "text",
-                            "text": "• 填寫表單",
-                            "size": "xs",
-                            "color": "#6B7280FF"
-                        },
-                        {
-                            "type": "text",
-                            "text": "• 圖片生成",
-                            "size": "xs",
-                            "color": "#6B7280FF"
-                        },
-                        {
-                            "type": "text",
-                            "text": "• RSS 分析",
-                            "size": "xs",
-                            "color": "#6B7280FF"
-                        }
-                    ]
-                }
-            ]
-        },
-        "footer": {
-            "type": "box",
-            "layout": "vertical",
-            "contents": [
-                {
-                    "type": "text",
-                    "text": "如有問題請聯繫客服",
-                    "size": "xs",
-                    "color": "#6B7280FF",
-                    "align": "center"
-                }
-            ]
-        }
-    }
-    line_bot_api.reply_message(
-        reply_token,
-        FlexSendMessage(alt_text="用戶註冊", contents=flex_message_contents)
-    )
+    reply_prebuilt_messages(reply_token, flex_templates.render('registration', user_id=user_id))
 
 # --- 靜態文件路由 ---
 @app.route('/registerUI/<path:filename>')
@@ -831,7 +961,16 @@ def health_check():
                 "dialogflow": "configured" if DIALOGFLOW_PROJECT_ID else "not_configured"
             },
             "version": version_val,
-            "timezone": "Asia/Taipei (GMT+8)"
+            "timezone": "Asia/Taipei (GMT+8)",
+            "webhook_filter": group_message_filter.get_stats(),
+            "command_handlers": message_processor.registry.get_stats(),
+            "rate_limit": rate_limiter.get_stats(),
+            "message_coalescing": message_coalescer.get_stats(),
+            "scheduler": priority_scheduler.get_stats(),
+            "line_delivery": line_delivery.get_stats(),
+            "outbound_delivery": outbound_delivery.get_stats(),
+            "line_api": line_api_dispatcher.get_stats(),
+            "tracing": tracer.get_stats()
         }
         
         return health_data, 200 if db_status and n8n_status else 503
@@ -859,16 +998,13 @@ def api_register_user():
         if not all([line_id, name, english_name, department, email, mobile, extension]):
             return {"status": "error", "message": "缺少必要的欄位"}, 400
 
-        from user_manager import UserManager
+        from user_manager import (
+            UserManager, REGISTER_CREATED, REGISTER_LINE_ID_EXISTS, REGISTER_EMAIL_EXISTS
+        )
         user_manager_instance = UserManager()
 
-        if user_manager_instance.get_user_by_line_id(line_id):
-            return {"status": "error", "message": "此 LINE ID 已註冊"}, 409
-        
-        if user_manager_instance.get_user_by_email(email):
-            return {"status": "error", "message": "此電子郵件已註冊"}, 409
-
-        success = user_manager_instance.add_user(
+        # 單一語句完成重複檢查與寫入，並發送出的表單也能得到正確的 409
+        result = user_manager_instance.register_user(
             line_id=line_id,
             name=name,
             english_name=english_name,
@@ -878,20 +1014,373 @@ def api_register_user():
             extension=extension
         )
 
-        if success:
+        if result == REGISTER_CREATED:
             return {"status": "success", "message": "用戶註冊成功"}, 201
-        else:
-            return {"status": "error", "message": "用戶註冊失敗，請稍後再試"}, 500
+        if result == REGISTER_LINE_ID_EXISTS:
+            return {"status": "error", "message": "此 LINE ID 已註冊"}, 409
+        if result == REGISTER_EMAIL_EXISTS:
+            return {"status": "error", "message": "此電子郵件已註冊"}, 409
+        return {"status": "error", "message": "用戶註冊失敗，請稍後再試"}, 500
 
     except Exception as e:
-        print(f"註冊 API 錯誤: {e}")
+        logger.exception("註冊 API 錯誤")
         return {"status": "error", "message": str(e)}, 500
 
+# --- 內部 API（供 n8n 呼叫）---
+
+def require_internal_token(view):
+    """檢查 Authorization: Bearer <INTERNAL_API_TOKEN>；未設定金鑰時內部 API 一律停用"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not INTERNAL_API_TOKEN:
+            return {"status": "error", "message": "內部 API 未啟用"}, 503
+        auth_header = request.headers.get('Authorization', '')
+        token = auth_header[len('Bearer '):] if auth_header.startswith('Bearer ') else ''
+        if not hmac.compare_digest(token.encode(), INTERNAL_API_TOKEN.encode()):
+            return {"status": "error", "message": "未授權"}, 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def continue_trace(name):
+    """n8n 回呼帶回轉發時的 traceparent 標頭時，接續同一個 trace"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            traceparent = request.headers.get('traceparent')
+            if not traceparent:
+                return view(*args, **kwargs)
+            with tracer.start_trace(name, traceparent=traceparent):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@app.route("/api/internal/bulk-send", methods=['POST'])
+@require_internal_token
+def api_bulk_send():
+    """
+    大量推播（非同步執行，回傳 job_id 供查詢）
+    工作狀態只保存在處理此請求的 worker 中，回應的 worker_pid 標示所屬進程
+    multicast: {"task_id": "...", "deliveries": [{"to": ["U..."], "messages": [...]}]}
+    narrowcast: {"task_id": "...", "narrowcast": {"messages": [...], "recipient": {...}, "filter": {...}}}
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return {"status": "error", "message": "無效的請求數據"}, 400
+
+    try:
+        if 'narrowcast' in data:
+            narrowcast = data['narrowcast'] if isinstance(data['narrowcast'], dict) else {}
+            job = outbound_delivery.submit_narrowcast(
+                narrowcast.get('messages'),
+                recipient=narrowcast.get('recipient'),
+                filter=narrowcast.get('filter'),
+                task_id=data.get('task_id')
+            )
+        else:
+            job = outbound_delivery.submit_multicast(data.get('deliveries'), task_id=data.get('task_id'))
+    except BulkRequestError as e:
+        return {"status": "error", "message": str(e)}, 400
+
+    logger.info("收到大量推播請求", extra={
+        'job_id': job.job_id, 'recipients': job.recipients, 'requests_total': job.requests_total
+    })
+    return job.to_dict(), 202
+
+@app.route("/api/internal/bulk-send/<job_id>", methods=['GET'])
+@require_internal_token
+def api_bulk_send_status(job_id):
+    job = outbound_delivery.get_job(job_id)
+    if job is None:
+        # 也可能是由其他 worker 建立，或進程重啟後已遺失
+        return {"status": "error", "message": "找不到此工作（工作狀態只保存在建立它的 worker 中）",
+                "worker_pid": os.getpid()}, 404
+    return job.to_dict(), 200
+
+def _callback_items(data):
+    """n8n 回呼可傳單筆物件、物件陣列或 {"results": [...]}"""
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return data['results']
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        return [data]
+    return None
+
+def _callback_messages(item):
+    """取出並序列化訊息；可用 text 簡寫單則文字訊息"""
+    if not isinstance(item, dict):
+        raise BulkRequestError("每一項必須是物件")
+    messages = item.get('messages')
+    if messages is None and isinstance(item.get('text'), str):
+        messages = [{'type': 'text', 'text': item['text']}]
+    return serialize_messages(messages)
+
+def _callback_response(results):
+    """全部成功 200；全部失敗依原因 400 / 502；部分成功 207"""
+    failed = [r for r in results if 'error' in r]
+    if not failed:
+        return {"status": "success", "results": results}, 200
+    if len(failed) < len(results):
+        return {"status": "partial", "results": results}, 207
+    if all(r.get('invalid') for r in failed):
+        return {"status": "error", "results": results}, 400
+    return {"status": "error", "results": results}, 502
+
+@app.route("/api/n8n/reply", methods=['POST'])
+@require_internal_token
+@continue_trace('n8n.reply')
+def api_n8n_reply():
+    """
+    n8n 處理結果經由 bot 的 LINE 派送器回覆
+    {"reply_token": "...", "messages": [...], "push_to": "U..."}（或批次 {"results": [...]}）
+    token 已逾時或失效時改 push 給 push_to（未提供則使用 token 原本的聊天室）
+    """
+    items = _callback_items(request.get_json(silent=True))
+    if not items:
+        return {"status": "error", "message": "無效的請求數據"}, 400
+
+    results = []
+    for index, item in enumerate(items):
+        try:
+            messages = _callback_messages(item)
+            if not item.get('reply_token'):
+                raise BulkRequestError("缺少 reply_token")
+        except BulkRequestError as e:
+            results.append({'index': index, 'error': str(e), 'invalid': True})
+            continue
+        try:
+            mode = line_delivery.reply(item['reply_token'], messages, to=item.get('push_to'))
+            results.append({'index': index, 'delivery': mode})
+        except (LineBotApiError, LineApiDropped) as e:
+            logger.warning("n8n 回覆失敗", extra={'error': str(e)})
+            results.append({'index': index, 'error': str(e)})
+    return _callback_response(results)
+
+@app.route("/api/n8n/push", methods=['POST'])
+@require_internal_token
+@continue_trace('n8n.push')
+def api_n8n_push():
+    """
+    n8n 主動推送：{"to": "U...", "messages": [...]}（或批次 {"results": [...]}）
+    同一對象的多筆結果合併成最少次數的 push 呼叫
+    """
+    items = _callback_items(request.get_json(silent=True))
+    if not items:
+        return {"status": "error", "message": "無效的請求數據"}, 400
+
+    results = []
+    by_target = {}
+    for index, item in enumerate(items):
+        try:
+            messages = _callback_messages(item)
+            if not isinstance(item.get('to'), str) or not item['to']:
+                raise BulkRequestError("缺少 to")
+        except BulkRequestError as e:
+            results.append({'index': index, 'error': str(e), 'invalid': True})
+            continue
+        by_target.setdefault(item['to'], []).append((index, messages))
+
+    for target, entries in by_target.items():
+        try:
+            with line_delivery.batch(target):
+                for _, messages in entries:
+                    line_delivery.push(target, messages)
+            results.extend({'index': index, 'delivery': 'push'} for index, _ in entries)
+        except (LineBotApiError, LineApiDropped) as e:
+            logger.warning("n8n 推送失敗", extra={'target': target, 'error': str(e)})
+            results.extend({'index': index, 'error': str(e)} for index, _ in entries)
+
+    results.sort(key=lambda r: r['index'])
+    return _callback_response(results)
+
+@app.route("/api/n8n/tasks", methods=['POST'])
+@require_internal_token
+@continue_trace('n8n.task_updates')
+def api_n8n_task_updates():
+    """
+    n8n 回報任務進度（單筆、陣列或 {"updates": [...]}）
+    {"task_id": "...", "status": "running|completed|failed|cancelled", "message": "...", "result": {...}}
+    """
+    data = request.get_json(silent=True)
+    if isinstance(data, dict) and isinstance(data.get('updates'), list):
+        data = data['updates']
+    updates = _callback_items(data)
+    if not updates:
+        return {"status": "error", "message": "無效的請求數據"}, 400
+
+    try:
+        summary = task_store.apply_updates(updates)
+    except TaskUpdateError as e:
+        return {"status": "error", "message": str(e)}, 400
+    except SQLAlchemyError as e:
+        logger.error("任務狀態更新失敗", extra={'error': str(e)})
+        return {"status": "error", "message": "資料庫錯誤"}, 500
+    return {"status": "success", **summary}, 200
+
+# --- 指標 ---
+
+# 既有元件的統計在抓取時轉成 gauge（指令處理器的延遲已有直方圖，不重複輸出）
+metrics_registry.register_stats('linebot_webhook_filter', group_message_filter.get_stats)
+metrics_registry.register_stats('linebot_rate_limit', rate_limiter.get_stats, label='scope')
+metrics_registry.register_stats('linebot_message_coalescing', message_coalescer.get_stats)
+metrics_registry.register_stats('linebot_scheduler', priority_scheduler.get_stats, label='tier', by_label=True)
+metrics_registry.register_stats('linebot_line_delivery', line_delivery.get_stats)
+metrics_registry.register_stats('linebot_outbound_delivery', outbound_delivery.get_stats)
+metrics_registry.register_stats('linebot_line_api', line_api_dispatcher.get_stats)
+metrics_registry.register_stats('linebot_tracing', tracer.get_stats)
+
+@app.route("/metrics", methods=['GET'])
+@require_internal_token
+def metrics_endpoint():
+    """Prometheus 抓取端點；與內部 API 共用 INTERNAL_API_TOKEN（scrape 設定 authorization: credentials）"""
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+# --- 管理 API ---
+
+EXPORT_FIELDS = ('line_id', 'name', 'english_name', 'department', 'email', 'mobile', 'extension',
+                 'created_at', 'updated_at', 'user_metadata')
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def _export_ndjson(users):
+    for user in users:
+        yield json.dumps({key: _export_value(user[key]) for key in EXPORT_FIELDS}, ensure_ascii=False) + "\n"
+
+def _export_csv(users):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for user in users:
+        row = [_export_value(user[key]) for key in EXPORT_FIELDS]
+        row[-1] = json.dumps(user['user_metadata'] or {}, ensure_ascii=False)
+        writer.writerow(row)
+        # 累積一段再送出，減少 chunk 數量
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+@app.route("/api/admin/users/export", methods=['GET'])
+@require_internal_token
+def api_export_users():
+    """
+    串流匯出所有用戶（?format=ndjson 預設，或 csv）
+    以伺服器端游標分批讀取，記憶體用量與用戶數無關
+    """
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in ('ndjson', 'csv'):
+        return {"status": "error", "message": "format 必須是 ndjson 或 csv"}, 400
+
+    from user_manager import UserManager
+    users = UserManager().iter_users(batch_size=1000, raw=True)
+    filename = f"users-{datetime.now(TAIPEI_TZ):%Y%m%d-%H%M%S}.{export_format}"
+    if export_format == 'csv':
+        body, mimetype = _export_csv(users), 'text/csv; charset=utf-8'
+    else:
+        body, mimetype = _export_ndjson(users), 'application/x-ndjson; charset=utf-8'
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+# --- 效能剖析（PROFILING_ENABLED=true 時啟用；只剖析處理此請求的 worker）---
+
+PROFILE_SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+
+@app.route("/api/admin/profile", methods=['GET'])
+@require_internal_token
+def api_profile():
+    """
+    取樣剖析目前的 worker，回傳 collapsed stack（可交給 flamegraph.pl / speedscope）
+    ?seconds=10&interval_ms=10&thread=<執行緒名稱前綴>
+    """
+    if not PROFILING_ENABLED:
+        abort(404)
+    try:
+        seconds = float(request.args.get('seconds', '10'))
+        interval = float(request.args.get('interval_ms', '10')) / 1000
+    except ValueError:
+        return {"status": "error", "message": "seconds 與 interval_ms 必須是數字"}, 400
+    try:
+        stacks = sampling_profiler.sample(seconds, interval, request.args.get('thread'))
+    except ProfilerBusy as e:
+        return {"status": "error", "message": str(e)}, 409
+    return Response(sampling_profiler.collapse(stacks), mimetype='text/plain')
+
+@app.route("/api/admin/profile/handlers", methods=['GET', 'DELETE'])
+@require_internal_token
+def api_profile_handlers():
+    """
+    GET: 以 cProfile 抽樣剖析的處理器結果（?handler=<名稱>&sort=cumulative|tottime|ncalls&limit=30）
+    DELETE: 清除累積的結果
+    """
+    if not PROFILING_ENABLED:
+        abort(404)
+    if request.method == 'DELETE':
+        handler_profiler.reset()
+        return {"status": "success"}
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in PROFILE_SORT_KEYS:
+        return {"status": "error", "message": f"sort 必須是 {' / '.join(PROFILE_SORT_KEYS)}"}, 400
+    try:
+        limit = int(request.args.get('limit', '30'))
+    except ValueError:
+        return {"status": "error", "message": "limit 必須是整數"}, 400
+    report = handler_profiler.report(request.args.get('handler'), sort=sort, limit=limit)
+    return Response(report or "尚無剖析結果（確認 PROFILE_HANDLER_SAMPLE_RATE > 0）\n", mimetype='text/plain')
+
+# --- 背景預熱 ---
+
+def warm_up_clients():
+    """在背景初始化憑證、Dialogflow、資料庫與 LINE 客戶端，縮短第一個請求的等待"""
+    from google_credentials import setup_google_credentials
+    from models import get_engine
+    
+    logger.info("正在設定 Google 憑證")
+    if setup_google_credentials():
+        logger.info("Google 憑證設定成功")
+    else:
+        logger.warning("Google 憑證設定失敗，Dialogflow 功能可能無法正常工作")
+    
+    steps = [
+        ("Flex 範本", flex_templates.load),
+        ("Dialogflow 客戶端", dialogflow_client.warm_up),
+        ("資料庫引擎", get_engine),
+        ("LINE 客戶端", line_bot_api.get_instance),
+    ]
+    for name, step in steps:
+        try:
+            step()
+        except Exception as e:
+            logger.warning("預熱失敗，將於第一次使用時重試", extra={'step': name, 'error': str(e)})
+    logger.info("背景預熱完成")
+
+def start_background_warmup():
+    """
+    以 daemon 執行緒啟動預熱，不阻塞埠口綁定（WARMUP_IN_BACKGROUND=false 可關閉）
+    匯入 main 時不會自動執行；以 WSGI 伺服器啟動時應在 worker fork 之後呼叫（例如 gunicorn 的 post_fork）
+    """
+    if os.environ.get('WARMUP_IN_BACKGROUND', 'true').lower() == 'false':
+        return None
+    thread = threading.Thread(target=warm_up_clients, name='client-warmup', daemon=True)
+    thread.start()
+    return thread
+
 if __name__ == "__main__":
     print(f"LINE_CHANNEL_ACCESS_TOKEN: {'已設定' if LINE_CHANNEL_ACCESS_TOKEN else '未設定'}")
     print(f"LINE_CHANNEL_SECRET: {'已設定' if LINE_CHANNEL_SECRET else '未設定'}")
     print(f"N8N_WEBHOOK_URL: {'已設定' if N8N_WEBHOOK_URL else '未設定'}")
     print(f"DIALOGFLOW_PROJECT_ID: {'已設定' if DIALOGFLOW_PROJECT_ID else '未設定'}")
     
+    debug = True
+    # debug 模式的 reloader 會先啟動只負責監看檔案的父進程，只在實際服務請求的子進程預熱
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_warmup()
+    
     print("啟動本地 Flask 伺服器...")
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    app.run(host='0.0.0.0', port=8080, debug=debug)
@@ -0,0 +1,129 @@
+"""
+訊息合併（debounce）
+
+用戶常把一個需求拆成好幾則快速送出的訊息。啟用後，同一用戶在視窗時間內送出的
+自然語言訊息會合併成一次請求再交給 Dialogflow / n8n，並使用最新的 reply token。
+
+設定（環境變數）:
+    MESSAGE_COALESCE_WINDOW_MS=0       # 0 表示停用
+    MESSAGE_COALESCE_MAX_WAIT_MS=4000  # 從第一則訊息起最多等待多久（保護 reply token 時效）
+    MESSAGE_COALESCE_MAX_MESSAGES=5    # 累積到此數量立即送出
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+# on_flush(合併後文字, 最新 reply token, 合併訊息數)
+FlushCallback = Callable[[str, str, int], None]
+
+
+class _PendingBatch:
+    __slots__ = ('texts', 'reply_token', 'on_flush', 'first_at', 'timer')
+
+    def __init__(self, on_flush: FlushCallback):
+        self.texts: List[str] = []
+        self.reply_token = None
+        self.on_flush = on_flush
+        self.first_at = time.monotonic()
+        self.timer = None
+
+
+class MessageCoalescer:
+    """依 key（通常是聊天室 + 用戶）合併短時間內的連續訊息"""
+
+    def __init__(self, window_seconds: float = None, max_wait_seconds: float = None,
+                 max_messages: int = None):
+        if window_seconds is None:
+            window_seconds = int(os.environ.get('MESSAGE_COALESCE_WINDOW_MS', '0')) / 1000.0
+        if max_wait_seconds is None:
+            max_wait_seconds = int(os.environ.get('MESSAGE_COALESCE_MAX_WAIT_MS', '4000')) / 1000.0
+        if max_messages is None:
+            max_messages = int(os.environ.get('MESSAGE_COALESCE_MAX_MESSAGES', '5'))
+
+        self.window_seconds = window_seconds
+        self.max_wait_seconds = max(max_wait_seconds, window_seconds)
+        self.max_messages = max_messages
+
+        self._pending: Dict[str, _PendingBatch] = {}
+        self._lock = threading.Lock()
+        self._messages_buffered = 0
+        self._batches_flushed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window_seconds > 0
+
+    def submit(self, key: str, text: str, reply_token: str, on_flush: FlushCallback) -> bool:
+        """
+        緩衝一則訊息；回傳 False 表示未啟用，呼叫者應直接處理該訊息
+        """
+        if not self.enabled:
+            return False
+
+        flush_now = False
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = _PendingBatch(on_flush)
+                self._pending[key] = batch
+            elif batch.timer is not None:
+                batch.timer.cancel()
+
+            batch.texts.append(text)
+            batch.reply_token = reply_token
+            batch.on_flush = on_flush
+            self._messages_buffered += 1
+
+            # 每則新訊息重新計時，但不超過從第一則起算的最長等待時間
+            remaining = self.max_wait_seconds - (time.monotonic() - batch.first_at)
+            delay = min(self.window_seconds, remaining)
+            if len(batch.texts) >= self.max_messages or delay <= 0:
+                flush_now = True
+            else:
+                batch.timer = threading.Timer(delay, self.flush, args=(key,))
+                batch.timer.daemon = True
+                batch.timer.start()
+
+        if flush_now:
+            self.flush(key)
+        return True
+
+    def flush(self, key: str) -> bool:
+        """立即送出該 key 累積的訊息（例如收到指令前先送出先前的文字）"""
+        with self._lock:
+            batch = self._pending.pop(key, None)
+            if batch is None:
+                return False
+            if batch.timer is not None:
+                batch.timer.cancel()
+            self._batches_flushed += 1
+
+        merged_text = '\n'.join(batch.texts)
+        try:
+            batch.on_flush(merged_text, batch.reply_token, len(batch.texts))
+        except Exception:
+            logger.exception("合併訊息處理失敗", extra={'messages': len(batch.texts)})
+        return True
+
+    def get_stats(self):
+        """合併統計：省下的上游呼叫數 = 緩衝訊息數 - 實際送出批次數"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'window_ms': int(self.window_seconds * 1000),
+                'messages_buffered': self._messages_buffered,
+                'batches_flushed': self._batches_flushed,
+                'pending_batches': len(self._pending),
+                'upstream_calls_saved': self._messages_buffered - self._batches_flushed - sum(
+                    len(batch.texts) for batch in self._pending.values()
+                )
+            }
+
+
+# 全局合併器實例
+message_coalescer = MessageCoalescer()
@@ -0,0 +1,259 @@
+"""
+Prometheus 格式的指標
+
+不依賴 prometheus_client：計數器與延遲直方圖各自以一把鎖保護，
+熱路徑上每次記錄只是一次字典查找與幾個整數加法。
+既有元件的 get_stats() 以 collector 的形式在抓取時轉成 gauge，不重複計數。
+
+/metrics 輸出 text exposition format 0.0.4；以 gunicorn 多 worker 執行時每個 worker 各自計數。
+端點需帶 INTERNAL_API_TOKEN（Bearer），Prometheus 以 scrape 設定的 authorization 帶入。
+"""
+
+import bisect
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# 預設延遲分桶（秒）：涵蓋本地指令（毫秒級）到 LLM / n8n 呼叫（數秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_INVALID_NAME_CHARS = re.compile(r'[^a-zA-Z0-9_]')
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple = ()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不減的計數器"""
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1.0):
+        key = tuple(str(value) for value in labelvalues)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f'{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}'
+            for key, value in values
+        ]
+
+
+class Histogram:
+    """延遲直方圖（累積分桶、_sum、_count）"""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # 每組標籤：[各分桶（非累積）計數..., +Inf 計數, 總和]
+        self._values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, seconds: float, *labelvalues):
+        key = tuple(str(value) for value in labelvalues)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            values[index] += 1
+            values[-1] += seconds
+
+    @contextmanager
+    def time(self, *labelvalues):
+        """以 with 區塊計時；標籤在區塊結束時才決定時，改用 observe"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts)) for key, counts in self._values.items()]
+        lines = []
+        for key, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, (('le', _format_value(float(bound))),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(counts[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class StatsCollector:
+    """
+    在抓取時呼叫元件的 get_stats()，把數值轉成 gauge（字串等非數值略過）
+    第一層的數值輸出為 <prefix>_<key>；第二層的 dict 依 by_label 決定：
+        by_label=False: {'checked': {'user': 1}} → <prefix>_checked{label="user"}
+        by_label=True:  {'form_filling': {'calls': 1}} → <prefix>_calls{label="form_filling"}
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, prefix: str, get_stats: Callable[[], Dict], label: str = 'name', by_label: bool = False):
+        self.prefix = prefix
+        self.get_stats = get_stats
+        self.label = label
+        self.by_label = by_label
+
+    @staticmethod
+    def _number(value) -> Optional[float]:
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, (int, float)):
+            return value
+        return None
+
+    def _name(self, key) -> str:
+        return f'{self.prefix}_{_INVALID_NAME_CHARS.sub("_", str(key))}'
+
+    def samples(self) -> Dict[str, List[Tuple[str, float]]]:
+        """{metric 名稱: [(label 字串, 值), ...]}"""
+        result: Dict[str, List[Tuple[str, float]]] = {}
+        for key, value in self.get_stats().items():
+            if isinstance(value, dict):
+                for sub_key, sub_value in value.items():
+                    number = self._number(sub_value)
+                    if number is None:
+                        continue
+                    name, label_value = (sub_key, key) if self.by_label else (key, sub_key)
+                    result.setdefault(self._name(name), []).append(
+                        (_format_labels((self.label,), (label_value,)), number)
+                    )
+                continue
+            number = self._number(value)
+            if number is not None:
+                result.setdefault(self._name(key), []).append(('', number))
+        return result
+
+    def collect(self) -> List[str]:
+        try:
+            samples = self.samples()
+        except Exception:
+            # 單一元件的統計失敗不影響其他指標輸出
+            return []
+        lines = []
+        for name, values in samples.items():
+            lines.append(f'# TYPE {name} gauge')
+            lines.extend(f'{name}{labels} {_format_value(value)}' for labels, value in values)
+        return lines
+
+
+class MetricsRegistry:
+    """本服務專用的指標登錄（不使用全域的 prometheus_client REGISTRY）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, object] = {}
+        self._collectors: List[StatsCollector] = []
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_stats(self, prefix: str, get_stats: Callable[[], Dict], label: str = 'name',
+                       by_label: bool = False):
+        """登錄既有元件的 get_stats()；同一 prefix 重複登錄時取代舊的"""
+        with self._lock:
+            self._collectors = [c for c in self._collectors if c.prefix != prefix]
+            self._collectors.append(StatsCollector(prefix, get_stats, label, by_label))
+
+    def render(self) -> str:
+        """輸出 Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.collect())
+        for collector in collectors:
+            lines.extend(collector.collect())
+        return '\n'.join(lines) + '\n'
+
+
+# 全局指標登錄
+metrics_registry = MetricsRegistry()
+
+# --- 各層的延遲與結果 ---
+
+WEBHOOK_EVENTS = metrics_registry.counter(
+    'linebot_webhook_events', '收到的 webhook 事件數', ('event_type', 'source_type')
+)
+
+WEBHOOK_DURATION = metrics_registry.histogram(
+    'linebot_webhook_duration_seconds', 'LINE webhook 請求處理時間', ('outcome',)
+)
+MESSAGE_DURATION = metrics_registry.histogram(
+    'linebot_message_duration_seconds', '訊息經路由處理的時間', ('route', 'outcome', 'source_type')
+)
+REGISTRATION_CHECK_DURATION = metrics_registry.histogram(
+    'linebot_registration_check_duration_seconds', '查詢用戶是否已註冊的資料庫時間', ('outcome',)
+)
+DIALOGFLOW_DURATION = metrics_registry.histogram(
+    'linebot_dialogflow_request_duration_seconds', 'Dialogflow 意圖偵測呼叫時間', ('outcome',)
+)
+N8N_DURATION = metrics_registry.histogram(
+    'linebot_n8n_request_duration_seconds', 'n8n webhook POST 時間', ('workflow', 'outcome')
+)
+LINE_API_DURATION = metrics_registry.histogram(
+    'linebot_line_api_request_duration_seconds', 'LINE API 呼叫時間（含排隊與重試）', ('endpoint', 'outcome')
+)
+COMMAND_DURATION = metrics_registry.histogram(
+    'linebot_command_duration_seconds', '指令處理器執行時間', ('command', 'outcome')
+)
+
+
+def status_outcome(status: int) -> str:
+    """HTTP 狀態碼轉為 2xx / 4xx / 5xx，避免 label 組合過多"""
+    return f'{status // 100}xx'
@@ -1,74 +1,272 @@
+import argparse
 import json
 import os
+import time
 from datetime import datetime
-from models import User, SessionLocal
-from sqlalchemy.exc import SQLAlchemyError
+from models import User, get_engine
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 import logging
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def load_json_data(json_file_path):
-    """載入 JSON 資料"""
+DEFAULT_JSON_PATH = "data/users/users.json"
+DEFAULT_CHUNK_SIZE = int(os.environ.get('MIGRATE_CHUNK_SIZE', '1000'))
+# 每次從檔案讀取的字元數；記憶體用量只與此值及單一用戶資料大小有關
+READ_SIZE = 1 << 16
+
+# 直接對應到 line_users 欄位的資料，其餘欄位放進 user_metadata
+USER_COLUMNS = ('name', 'english_name', 'department', 'email', 'mobile', 'extension')
+UPDATE_COLUMNS = USER_COLUMNS + ('user_metadata', 'updated_at')
+
+
+class _StreamReader:
+    """以固定大小分段讀取檔案，並以 JSONDecoder.raw_decode 逐一解析值"""
+
+    _WHITESPACE = ' \t\n\r'
+
+    def __init__(self, f, read_size=READ_SIZE):
+        self.f = f
+        self.read_size = read_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """讀入下一段；已消耗的部分超過一半時丟棄，避免緩衝區無限成長"""
+        if self.pos > len(self.buffer) // 2:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        chunk = self.f.read(self.read_size)
+        if chunk:
+            self.buffer += chunk
+        else:
+            self.eof = True
+
+    def peek(self):
+        """跳過空白並回傳下一個字元（檔案結束時回傳空字串）"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self._WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"JSON 格式錯誤：位置附近預期 '{char}'，實際為 '{self.peek()}'")
+        self.pos += 1
+
+    def value(self):
+        """解析下一個完整的 JSON 值；值可能跨越多段讀取"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # 值剛好在緩衝區結尾（例如數字）時可能尚未完整，再讀一段確認
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def iter_json_users(f, read_size=READ_SIZE):
+    """
+    逐筆產生 (line_id, user_data)，不把整個檔案載入記憶體
+    檔案格式：{"users": {"<line_id>": {...}, ...}, ...}
+    """
+    reader = _StreamReader(f, read_size)
+    reader.expect('{')
+    while reader.peek() != '}':
+        key = reader.value()
+        reader.expect(':')
+        if key == 'users':
+            reader.expect('{')
+            while reader.peek() != '}':
+                line_id = reader.value()
+                reader.expect(':')
+                yield line_id, reader.value()
+                if reader.peek() == ',':
+                    reader.pos += 1
+            reader.expect('}')
+        else:
+            reader.value()  # 其他頂層欄位略過
+        if reader.peek() == ',':
+            reader.pos += 1
+    reader.expect('}')
+
+
+def build_user_row(line_id, user_data, now):
+    """將 JSON 中的一筆用戶資料轉成 line_users 的欄位"""
+    row = {'line_id': line_id, 'created_at': now, 'updated_at': now}
+    for column in USER_COLUMNS:
+        row[column] = user_data.get(column)
+    # 準備元數據（寫入 user_metadata，而非 SQLAlchemy 保留的 metadata 屬性）
+    row['user_metadata'] = {k: v for k, v in user_data.items()
+                            if k not in USER_COLUMNS and k not in ('line_id', 'created_at')}
+    # 設置時間戳
+    if user_data.get('created_at'):
+        try:
+            row['created_at'] = datetime.fromisoformat(user_data['created_at'])
+        except (TypeError, ValueError):
+            pass
+    return row
+
+
+def _upsert_statement(dialect_name):
+    """
+    依資料庫方言建立 INSERT ... ON CONFLICT (line_id) DO UPDATE
+    語句不綁定資料，以 executemany 執行，編譯結果可重複使用（psycopg2 會批次送出）
+    """
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise ValueError(f"不支援的資料庫：{dialect_name}")
+    stmt = insert(User.__table__)
+    # 重複匯入時更新資料，但保留原本的建立時間
+    return stmt.on_conflict_do_update(
+        index_elements=['line_id'],
+        set_={column: stmt.excluded[column] for column in UPDATE_COLUMNS}
+    )
+
+
+def _dedupe(rows):
+    """同一批中 line_id 或 email 重複時保留最後一筆（ON CONFLICT 不能在同一語句更新同一列兩次）"""
+    by_line_id = {}
+    for row in rows:
+        by_line_id[row['line_id']] = row
+    by_email = {}
+    unique = []
+    for row in reversed(list(by_line_id.values())):
+        email = row.get('email')
+        if email:
+            if email in by_email:
+                continue
+            by_email[email] = row
+        unique.append(row)
+    unique.reverse()
+    return unique
+
+
+def write_chunk(engine, rows):
+    """
+    以單一語句寫入一批資料；若與既有資料的 email 衝突，
+    改為逐筆寫入（各自使用 savepoint），跳過衝突的資料
+    回傳 (寫入筆數, 跳過筆數)
+    """
+    unique = _dedupe(rows)
+    duplicates = len(rows) - len(unique)
+    rows = unique
+    stmt = _upsert_statement(engine.dialect.name)
     try:
-        if not os.path.exists(json_file_path):
-            logger.error(f"找不到 JSON 檔案：{json_file_path}")
-            return None
-        
-        with open(json_file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return data
-    except Exception as e:
-        logger.error(f"載入 JSON 資料失敗：{e}")
-        return None
-
-def migrate_users():
-    """將用戶資料從 JSON 遷移到 PostgreSQL"""
-    json_file_path = "data/users/users.json"
-    data = load_json_data(json_file_path)
-    
-    if not data or "users" not in data:
-        logger.error("無效的用戶資料格式")
+        with engine.begin() as conn:
+            conn.execute(stmt, rows)
+        return len(rows), duplicates
+    except IntegrityError:
+        logger.warning("批次寫入違反唯一性限制，改為逐筆寫入")
+
+    written = 0
+    with engine.begin() as conn:
+        for row in rows:
+            try:
+                with conn.begin_nested():
+                    conn.execute(stmt, row)
+                written += 1
+            except IntegrityError:
+                duplicates += 1
+                logger.warning(f"跳過 email 重複的用戶：{row['line_id']}")
+    return written, duplicates
+
+
+def _read_checkpoint(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return int(json.load(f).get('processed', 0))
+    except (OSError, ValueError):
+        return 0
+
+
+def _write_checkpoint(path, processed):
+    # 先寫暫存檔再取代，避免中斷時留下損毀的檢查點
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'processed': processed, 'updated_at': datetime.utcnow().isoformat()}, f)
+    os.replace(tmp_path, path)
+
+
+def migrate_users(json_file_path=DEFAULT_JSON_PATH, chunk_size=DEFAULT_CHUNK_SIZE,
+                  checkpoint_path=None, resume=True, engine=None):
+    """
+    將用戶資料從 JSON 串流匯入 PostgreSQL
+    - 分批 upsert，可重複執行（同一用戶再次匯入時更新資料）
+    - 每批提交後記錄檢查點，失敗後重新執行會從上次完成的位置繼續
+    """
+    if not os.path.exists(json_file_path):
+        logger.error(f"找不到 JSON 檔案：{json_file_path}")
         return False
-    
-    db = SessionLocal()
+
+    engine = engine or get_engine()
+    checkpoint_path = checkpoint_path or f"{json_file_path}.checkpoint"
+    skip = _read_checkpoint(checkpoint_path) if resume else 0
+    if skip:
+        logger.info(f"從檢查點繼續：略過已匯入的 {skip} 筆")
+
+    processed = 0
+    written = 0
+    duplicates = 0
+    chunk = []
+    start = time.monotonic()
+    now = datetime.utcnow()
+
+    def flush():
+        nonlocal written, duplicates
+        chunk_written, chunk_duplicates = write_chunk(engine, chunk)
+        written += chunk_written
+        duplicates += chunk_duplicates
+        _write_checkpoint(checkpoint_path, processed)
+        elapsed = time.monotonic() - start
+        logger.info(f"已處理 {processed} 筆（寫入 {written}，跳過 {duplicates}），"
+                    f"{(processed - skip) / elapsed if elapsed else 0:.0f} 筆/秒")
+        chunk.clear()
+
     try:
-        for line_id, user_data in data["users"].items():
-            # 準備基本資料
-            user = User(
-                line_id=line_id,
-                name=user_data.get("name"),
-                email=user_data.get("email")
-            )
-            
-            # 準備元數據
-            metadata = {k: v for k, v in user_data.items() 
-                      if k not in ["line_id", "name", "email"]}
-            user.metadata = metadata
-            
-            # 設置時間戳
-            if "created_at" in user_data:
-                try:
-                    user.created_at = datetime.fromisoformat(user_data["created_at"])
-                except ValueError:
-                    user.created_at = datetime.utcnow()
-            
-            # 新增到資料庫
-            db.add(user)
-            logger.info(f"遷移用戶資料：{line_id}")
-        
-        # 提交所有變更
-        db.commit()
-        logger.info("資料遷移完成")
-        return True
-        
-    except SQLAlchemyError as e:
-        db.rollback()
-        logger.error(f"資料遷移失敗：{e}")
+        with open(json_file_path, 'r', encoding='utf-8') as f:
+            for line_id, user_data in iter_json_users(f):
+                processed += 1
+                if processed <= skip:
+                    continue
+                if not isinstance(user_data, dict):
+                    logger.warning(f"略過格式錯誤的用戶資料：{line_id}")
+                    continue
+                chunk.append(build_user_row(line_id, user_data, now))
+                if len(chunk) >= chunk_size:
+                    flush()
+            if chunk:
+                flush()
+    except (ValueError, SQLAlchemyError) as e:
+        logger.error(f"資料遷移失敗（已完成 {processed - len(chunk)} 筆，可重新執行以繼續）：{e}")
         return False
-    finally:
-        db.close()
+
+    # 全部完成後移除檢查點，下次執行視為全新匯入
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    logger.info(f"資料遷移完成：共 {processed} 筆，寫入 {written}，跳過 {duplicates}，"
+                f"耗時 {time.monotonic() - start:.1f} 秒")
+    return True
+
 
 if __name__ == "__main__":
-    migrate_users() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='將用戶資料從 JSON 串流匯入資料庫')
+    parser.add_argument('--file', default=DEFAULT_JSON_PATH, help='用戶 JSON 檔案路徑')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='每批寫入筆數')
+    parser.add_argument('--checkpoint', default=None, help='檢查點檔案（預設為 <file>.checkpoint）')
+    parser.add_argument('--restart', action='store_true', help='忽略檢查點，從頭匯入')
+    args = parser.parse_args()
+    migrate_users(args.file, args.chunk_size, args.checkpoint, resume=not args.restart)
@@ -0,0 +1,290 @@
+"""
+大量推播服務
+
+把 n8n 工作流或系統公告要送給大量用戶的訊息合併成 multicast 呼叫
+（每次最多 500 位收件者、5 則訊息），內容相同的訊息共用同一批呼叫，
+並以有限的併發數在背景執行緒中送出。也支援依受眾送出的 narrowcast。
+
+工作狀態只保存在建立它的進程記憶體中：以多個 worker 執行時，
+查詢與取消只對同一個 worker 上的工作有效（回應中的 worker_pid 標示所屬進程），
+進程重啟後尚未送出的批次也會遺失。
+
+設定（環境變數）:
+    OUTBOUND_CONCURRENCY=4       # 同時進行的 multicast 呼叫數
+    OUTBOUND_JOB_HISTORY=200     # 保留多少筆已完成工作的狀態供查詢
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from linebot.exceptions import LineBotApiError
+
+from line_delivery import post_json
+
+logger = logging.getLogger(__name__)
+
+# LINE multicast 每次最多 500 位收件者，每則請求最多 5 則訊息
+MULTICAST_MAX_RECIPIENTS = 500
+MAX_MESSAGES_PER_REQUEST = 5
+
+
+class BulkRequestError(ValueError):
+    """大量推播請求格式錯誤"""
+
+
+def _dumps(data) -> bytes:
+    return json.dumps(data, ensure_ascii=True, separators=(',', ':')).encode('ascii')
+
+
+def serialize_messages(messages) -> List[bytes]:
+    if not isinstance(messages, list) or not messages:
+        raise BulkRequestError("messages 必須是非空陣列")
+    if len(messages) > MAX_MESSAGES_PER_REQUEST:
+        raise BulkRequestError(f"每次最多 {MAX_MESSAGES_PER_REQUEST} 則訊息")
+    serialized = []
+    for message in messages:
+        if not isinstance(message, dict) or 'type' not in message:
+            raise BulkRequestError("每則訊息必須是含 type 的 LINE message 物件")
+        serialized.append(_dumps(message))
+    return serialized
+
+
+class BulkJob:
+    """一次大量推播的狀態"""
+
+    def __init__(self, job_id: str, task_id: Optional[str], kind: str):
+        self.job_id = job_id
+        self.task_id = task_id
+        self.kind = kind
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.finished_at = None
+        self.recipients = 0
+        self.requests_total = 0
+        self.requests_done = 0
+        self.delivered = 0
+        self.failed = 0
+        self.errors: List[str] = []
+        self.cancelled = False
+
+    def to_dict(self) -> Dict:
+        return {
+            'job_id': self.job_id,
+            'task_id': self.task_id,
+            'kind': self.kind,
+            'status': self.status,
+            'recipients': self.recipients,
+            'requests_total': self.requests_total,
+            'requests_done': self.requests_done,
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'errors': self.errors[-5:],
+            'duration_ms': int(((self.finished_at or time.time()) - self.created_at) * 1000),
+            # 工作只存在此進程中，查詢需送到同一個 worker
+            'worker_pid': os.getpid()
+        }
+
+
+class OutboundDeliveryService:
+    """
+    合併相同內容的推播並以 multicast 分批併發送出
+
+    _jobs 為單一進程內的狀態，get_job() 與 cancel() 看不到其他 worker 建立的工作
+    """
+
+    def __init__(self, api, concurrency: int = None, job_history: int = None):
+        self.api = api
+        self.concurrency = concurrency or int(os.environ.get('OUTBOUND_CONCURRENCY', '4'))
+        self.job_history = job_history or int(os.environ.get('OUTBOUND_JOB_HISTORY', '200'))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._jobs: 'OrderedDict[str, BulkJob]' = OrderedDict()
+        self._stats = {
+            'jobs': 0,
+            'multicast_requests': 0,
+            'narrowcast_requests': 0,
+            'recipients': 0,
+            'failed_requests': 0,
+            'cancelled_jobs': 0,
+        }
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.concurrency, thread_name_prefix='line-outbound'
+                    )
+        return self._executor
+
+    # --- 建立工作 ---
+
+    def submit_multicast(self, deliveries: List[Dict], task_id: Optional[str] = None) -> BulkJob:
+        """
+        deliveries: [{'to': [user_id, ...], 'messages': [LINE message 物件, ...]}, ...]
+        內容相同的項目會合併收件者；同一收件者重複出現只送一次
+        """
+        if not isinstance(deliveries, list) or not deliveries:
+            raise BulkRequestError("deliveries 必須是非空陣列")
+
+        # 以序列化後的訊息內容分組，合併收件者並保留順序
+        groups: 'OrderedDict[tuple, OrderedDict]' = OrderedDict()
+        for delivery in deliveries:
+            if not isinstance(delivery, dict):
+                raise BulkRequestError("deliveries 中的每一項必須是物件")
+            recipients = delivery.get('to')
+            if isinstance(recipients, str):
+                recipients = [recipients]
+            if not isinstance(recipients, list) or not recipients:
+                raise BulkRequestError("to 必須是非空的用戶 ID 陣列")
+            key = tuple(serialize_messages(delivery.get('messages')))
+            bucket = groups.setdefault(key, OrderedDict())
+            for user_id in recipients:
+                if not isinstance(user_id, str) or not user_id:
+                    raise BulkRequestError("to 中的用戶 ID 必須是字串")
+                bucket[user_id] = None
+
+        requests = []
+        for messages, recipients in groups.items():
+            user_ids = list(recipients)
+            for start in range(0, len(user_ids), MULTICAST_MAX_RECIPIENTS):
+                requests.append((user_ids[start:start + MULTICAST_MAX_RECIPIENTS], messages))
+
+        job = self._new_job(task_id, 'multicast')
+        job.recipients = sum(len(recipients) for recipients in groups.values())
+        job.requests_total = len(requests)
+        self._start(job, [(self._send_multicast, chunk, messages) for chunk, messages in requests])
+        return job
+
+    def submit_narrowcast(self, messages: List[Dict], recipient: Optional[Dict] = None,
+                          filter: Optional[Dict] = None, task_id: Optional[str] = None) -> BulkJob:
+        """依受眾（recipient）或屬性（filter）送出 narrowcast，由 LINE 端展開收件者"""
+        serialized = serialize_messages(messages)
+        body = b'{"messages":[' + b','.join(serialized) + b']'
+        if recipient:
+            body += b',"recipient":' + _dumps(recipient)
+        if filter:
+            body += b',"filter":' + _dumps(filter)
+        body += b'}'
+
+        job = self._new_job(task_id, 'narrowcast')
+        job.requests_total = 1
+        self._start(job, [(self._send_narrowcast, body)])
+        return job
+
+    def _new_job(self, task_id: Optional[str], kind: str) -> BulkJob:
+        job = BulkJob(uuid.uuid4().hex, task_id, kind)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > self.job_history:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest.status in ('queued', 'sending'):
+                    break
+                del self._jobs[oldest_id]
+            self._stats['jobs'] += 1
+        return job
+
+    def _start(self, job: BulkJob, calls: List[tuple]):
+        if not calls:
+            self._finish(job)
+            return
+        job.status = 'sending'
+        executor = self._get_executor()
+        for send, *args in calls:
+            executor.submit(self._run, job, send, *args)
+
+    # --- 送出 ---
+
+    def _run(self, job: BulkJob, send, *args):
+        if job.cancelled:
+            self._complete_request(job, delivered=0, failed=0)
+            return
+        try:
+            delivered = send(*args)
+            self._complete_request(job, delivered=delivered, failed=0)
+        except LineBotApiError as e:
+            self._complete_request(job, delivered=0, failed=self._recipient_count(args),
+                                   error=f"{e.status_code} {e.error.message}")
+        except Exception as e:
+            self._complete_request(job, delivered=0, failed=self._recipient_count(args), error=str(e))
+
+    @staticmethod
+    def _recipient_count(args) -> int:
+        return len(args[0]) if args and isinstance(args[0], list) else 0
+
+    def _send_multicast(self, user_ids: List[str], messages: tuple) -> int:
+        body = (
+            b'{"to":' + _dumps(user_ids)
+            + b',"messages":[' + b','.join(messages) + b'],"notificationDisabled":false}'
+        )
+        post_json(self.api, '/v2/bot/message/multicast', body)
+        with self._lock:
+            self._stats['multicast_requests'] += 1
+            self._stats['recipients'] += len(user_ids)
+        return len(user_ids)
+
+    def _send_narrowcast(self, body: bytes) -> int:
+        post_json(self.api, '/v2/bot/message/narrowcast', body)
+        with self._lock:
+            self._stats['narrowcast_requests'] += 1
+        return 0
+
+    def _complete_request(self, job: BulkJob, delivered: int, failed: int, error: str = None):
+        with self._lock:
+            job.requests_done += 1
+            job.delivered += delivered
+            job.failed += failed
+            if error:
+                job.errors.append(error)
+                self._stats['failed_requests'] += 1
+            done = job.requests_done >= job.requests_total
+        if error:
+            logger.warning("大量推播部分失敗", extra={'job_id': job.job_id, 'error': error})
+        if done:
+            self._finish(job)
+
+    def _finish(self, job: BulkJob):
+        with self._lock:
+            job.finished_at = time.time()
+            if job.cancelled:
+                job.status = 'cancelled'
+            elif job.errors:
+                # 至少一批成功即為部分完成
+                job.status = 'partial' if job.requests_done > len(job.errors) else 'failed'
+            else:
+                job.status = 'done'
+        logger.info("大量推播完成", extra={
+            'job_id': job.job_id, 'status': job.status,
+            'delivered': job.delivered, 'recipients': job.recipients
+        })
+
+    # --- 查詢與取消 ---
+
+    def get_job(self, job_id: str) -> Optional[BulkJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, task_id: str) -> int:
+        """取消指定 task_id 尚未送出的批次，回傳受影響的工作數（只涵蓋本進程的工作）"""
+        cancelled = 0
+        with self._lock:
+            for job in self._jobs.values():
+                if job.task_id == task_id and job.status in ('queued', 'sending') and not job.cancelled:
+                    job.cancelled = True
+                    cancelled += 1
+            self._stats['cancelled_jobs'] += cancelled
+        return cancelled
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['active_jobs'] = sum(1 for job in self._jobs.values() if job.status in ('queued', 'sending'))
+        stats['concurrency'] = self.concurrency
+        return stats
@@ -0,0 +1,174 @@
+"""
+分級排程器
+
+把訊息處理分成三個層級，各自有獨立的併發上限與有界等待佇列：
+    direct_command  直接指令（/說明、/填表 等，快速）
+    dialogflow      經 Dialogflow 意圖路由的訊息
+    llm_fallback    轉發 n8n 進行 LLM 分析（慢）
+大量自然語言訊息只會佔滿 llm_fallback 的名額，不會拖慢直接指令。
+
+設定（環境變數）:
+    SCHEDULER_<TIER>_CONCURRENCY  併發上限
+    SCHEDULER_<TIER>_QUEUE        等待佇列上限（超過直接拒絕）
+    SCHEDULER_<TIER>_TIMEOUT_MS   最長等待時間
+"""
+
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+
+# 層級 → (併發上限, 佇列上限, 等待逾時毫秒)
+DEFAULT_TIER_LIMITS = {
+    'direct_command': (32, 64, 5000),
+    'dialogflow': (16, 32, 8000),
+    'llm_fallback': (4, 16, 10000),
+}
+
+
+class SchedulerRejected(Exception):
+    """佇列已滿或等待逾時"""
+
+    def __init__(self, tier: str, reason: str):
+        super().__init__(f"{tier}: {reason}")
+        self.tier = tier
+        self.reason = reason
+
+
+class _Tier:
+    """單一層級的併發狀態與等待時間統計"""
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, timeout_seconds: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.timeout_seconds = timeout_seconds
+        self.condition = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def try_acquire(self) -> bool:
+        with self.condition:
+            if self.active < self.concurrency and self.waiting == 0:
+                self.active += 1
+                self.admitted += 1
+                return True
+            return False
+
+    def acquire(self) -> float:
+        """阻塞等待名額，回傳等待秒數"""
+        start = time.monotonic()
+        deadline = start + self.timeout_seconds
+        with self.condition:
+            if self.waiting >= self.max_queue:
+                self.rejected += 1
+                raise SchedulerRejected(self.name, 'queue_full')
+            self.waiting += 1
+            try:
+                while self.active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise SchedulerRejected(self.name, 'timeout')
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+            waited = time.monotonic() - start
+            self.active += 1
+            self.admitted += 1
+            self.wait_total += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+            return waited
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def stats(self) -> Dict:
+        with self.condition:
+            return {
+                'concurrency': self.concurrency,
+                'max_queue': self.max_queue,
+                'active': self.active,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'avg_wait_ms': round(self.wait_total / self.admitted * 1000, 2) if self.admitted else 0.0,
+                'max_wait_ms': round(self.wait_max * 1000, 2)
+            }
+
+
+class PriorityScheduler:
+    """依層級限制併發，並記錄每個層級的佇列等待時間"""
+
+    def __init__(self, limits: Dict[str, tuple] = None):
+        limits = limits or self._limits_from_env()
+        self._tiers = {
+            name: _Tier(name, concurrency, max_queue, timeout_ms / 1000.0)
+            for name, (concurrency, max_queue, timeout_ms) in limits.items()
+        }
+
+    @staticmethod
+    def _limits_from_env() -> Dict[str, tuple]:
+        limits = {}
+        for name, (concurrency, max_queue, timeout_ms) in DEFAULT_TIER_LIMITS.items():
+            prefix = f'SCHEDULER_{name.upper()}'
+            limits[name] = (
+                int(os.environ.get(f'{prefix}_CONCURRENCY', concurrency)),
+                int(os.environ.get(f'{prefix}_QUEUE', max_queue)),
+                int(os.environ.get(f'{prefix}_TIMEOUT_MS', timeout_ms)),
+            )
+        return limits
+
+    @asynccontextmanager
+    async def slot(self, tier_name: str):
+        """取得層級名額；有空位時不切換執行緒，否則在背景執行緒中等待"""
+        tier = self._tiers[tier_name]
+        if not tier.try_acquire():
+            await self._wait_for_slot(tier)
+        try:
+            yield
+        finally:
+            tier.release()
+
+    @staticmethod
+    async def _wait_for_slot(tier: _Tier):
+        """
+        在背景執行緒中等待名額
+        等待中的協程被取消時背景執行緒仍會取得名額，此時由最後完成的一方釋放，避免名額永久佔用
+        """
+        lock = threading.Lock()
+        state = {'acquired': False, 'abandoned': False}
+
+        def acquire():
+            tier.acquire()
+            with lock:
+                if state['abandoned']:
+                    tier.release()
+                else:
+                    state['acquired'] = True
+
+        try:
+            await asyncio.to_thread(acquire)
+        except asyncio.CancelledError:
+            with lock:
+                state['abandoned'] = True
+                if state['acquired']:
+                    tier.release()
+            raise
+
+    def get_stats(self) -> Dict[str, Dict]:
+        return {name: tier.stats() for name, tier in self._tiers.items()}
+
+
+# 全局排程器實例
+priority_scheduler = PriorityScheduler()
@@ -0,0 +1,159 @@
+"""
+線上效能剖析
+
+兩種工具，預設皆關閉（PROFILING_ENABLED=false 時端點回傳 404，處理器不做任何剖析）：
+
+1. 取樣剖析器：在目前的 worker 內每隔 interval 以 sys._current_frames() 擷取所有執行緒的堆疊，
+   持續指定秒數後輸出 collapsed stack 格式（「thread;檔案:函數;... 次數」），
+   可直接交給 flamegraph.pl / speedscope 繪製火焰圖。只讀取堆疊，不影響其他執行緒的執行。
+2. 處理器剖析：依 PROFILE_HANDLER_SAMPLE_RATE 抽樣，以 cProfile 包住 CommandRegistry 分派的
+   單一處理器，結果依處理器名稱累積，可以 pstats 格式讀取。
+   cProfile 記錄的是所在執行緒，等待期間同一事件迴圈上的其他協程也會計入。
+   未抽中時只多一次亂數比較；關閉時連亂數都不取。
+
+設定（環境變數）:
+    PROFILING_ENABLED=false
+    PROFILER_MAX_SECONDS=30             # 單次取樣剖析的最長秒數
+    PROFILE_HANDLER_SAMPLE_RATE=0       # 以 cProfile 剖析的處理器呼叫比例
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+
+
+class ProfilerBusy(Exception):
+    """同一時間只允許一個取樣剖析"""
+
+
+class SamplingProfiler:
+    """以固定間隔擷取所有執行緒堆疊的取樣剖析器"""
+
+    def __init__(self, max_seconds: float = None, min_interval: float = 0.001):
+        self.max_seconds = max_seconds if max_seconds is not None else float(
+            os.environ.get('PROFILER_MAX_SECONDS', '30')
+        )
+        self.min_interval = min_interval
+        self._running = threading.Lock()
+        self._labels: Dict[object, str] = {}
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = self._labels[code] = f'{os.path.basename(code.co_filename)}:{name}'
+        return label
+
+    def _stack(self, frame) -> list:
+        stack = []
+        while frame is not None:
+            stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def sample(self, seconds: float, interval: float = 0.01, thread_prefix: Optional[str] = None) -> Counter:
+        """
+        取樣 seconds 秒，回傳 {collapsed stack: 次數}
+        thread_prefix: 只記錄名稱以此開頭的執行緒（None 表示全部）
+        同時有另一個剖析進行中時拋出 ProfilerBusy
+        """
+        # 以比較式夾住範圍，NaN 也會落回預設值
+        seconds = min(seconds, self.max_seconds) if seconds > 0 else 0.0
+        interval = interval if interval > self.min_interval else self.min_interval
+        if not self._running.acquire(blocking=False):
+            raise ProfilerBusy("已有剖析進行中")
+        try:
+            own_id = threading.get_ident()
+            stacks: Counter = Counter()
+            deadline = time.monotonic() + seconds
+            while True:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    name = names.get(thread_id, str(thread_id))
+                    if thread_prefix and not name.startswith(thread_prefix):
+                        continue
+                    stacks[';'.join([name] + self._stack(frame))] += 1
+                if time.monotonic() >= deadline:
+                    return stacks
+                time.sleep(interval)
+        finally:
+            self._running.release()
+
+    @staticmethod
+    def collapse(stacks: Counter) -> str:
+        """flamegraph.pl 的 collapsed stack 格式，次數多的在前"""
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+
+class HandlerProfiler:
+    """依比例以 cProfile 剖析單次處理器呼叫，結果依名稱累積"""
+
+    def __init__(self, sample_rate: float = None, enabled: bool = None):
+        enabled = PROFILING_ENABLED if enabled is None else enabled
+        if sample_rate is None:
+            sample_rate = float(os.environ.get('PROFILE_HANDLER_SAMPLE_RATE', '0'))
+        self.sample_rate = sample_rate if enabled else 0.0
+        self._lock = threading.Lock()
+        self._stats: Dict[str, pstats.Stats] = {}
+        self._calls: Dict[str, int] = {}
+
+    def start(self) -> Optional[cProfile.Profile]:
+        """抽中時開始剖析並回傳 profiler，否則回傳 None"""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 同一執行緒已有其他 profiler 啟用中
+            return None
+        return profiler
+
+    def stop(self, name: str, profiler: cProfile.Profile):
+        profiler.disable()
+        with self._lock:
+            if name in self._stats:
+                self._stats[name].add(profiler)
+            else:
+                self._stats[name] = pstats.Stats(profiler)
+            self._calls[name] = self._calls.get(name, 0) + 1
+
+    def report(self, name: Optional[str] = None, sort: str = 'cumulative', limit: int = 30) -> str:
+        """以 pstats 文字格式輸出累積結果（name 為 None 時輸出全部處理器）"""
+        with self._lock:
+            names = [name] if name else sorted(self._stats)
+            output = io.StringIO()
+            for handler_name in names:
+                stats = self._stats.get(handler_name)
+                if stats is None:
+                    continue
+                output.write(f'=== {handler_name}（剖析 {self._calls[handler_name]} 次）===\n')
+                stats.stream = output
+                stats.sort_stats(sort).print_stats(limit)
+            return output.getvalue()
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._calls.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {'sample_rate': self.sample_rate, 'profiled_calls': dict(self._calls)}
+
+
+# 全局剖析器實例
+sampling_profiler = SamplingProfiler()
+handler_profiler = HandlerProfiler()
@@ -0,0 +1,224 @@
+"""
+Token bucket 速率限制
+
+依 user_id、group_id 與指令類型限制訊息頻率，
+在 Dialogflow / n8n / LINE push 等昂貴流程之前擋下洗版訊息。
+
+設定（環境變數）:
+    RATE_LIMIT_ENABLED=true
+    RATE_LIMIT_BACKEND=memory | postgres   # postgres 讓多個 worker 共用狀態
+    RATE_LIMIT_<SCOPE>_BURST / RATE_LIMIT_<SCOPE>_PER_MINUTE
+    SCOPE: USER、GROUP、COMMAND
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+# 各範圍的預設值：(容量, 每分鐘補充數)
+DEFAULT_RULES = {
+    'user': (10, 20),
+    'group': (20, 60),
+    'command': (3, 6),
+}
+
+# 同一個 key 被限流後，多久內不再重複提醒
+THROTTLE_NOTICE_COOLDOWN_SECONDS = 60
+
+
+class BucketRule:
+    """單一範圍的 token bucket 設定"""
+
+    __slots__ = ('burst', 'rate_per_second')
+
+    def __init__(self, burst: float, per_minute: float):
+        self.burst = float(burst)
+        self.rate_per_second = float(per_minute) / 60.0
+
+    @property
+    def refill_seconds(self) -> float:
+        """從空到補滿所需的秒數（不補充時為無限大）"""
+        return self.burst / self.rate_per_second if self.rate_per_second > 0 else float('inf')
+
+
+def load_rules_from_env() -> Dict[str, BucketRule]:
+    """從環境變數讀取各範圍的設定"""
+    rules = {}
+    for scope, (burst, per_minute) in DEFAULT_RULES.items():
+        prefix = f'RATE_LIMIT_{scope.upper()}'
+        rules[scope] = BucketRule(
+            burst=float(os.environ.get(f'{prefix}_BURST', burst)),
+            per_minute=float(os.environ.get(f'{prefix}_PER_MINUTE', per_minute))
+        )
+    return rules
+
+
+class MemoryBucketStore:
+    """
+    單一進程內的 bucket 狀態：key → [tokens, 上次更新時間]，依最後更新時間排序
+
+    idle_seconds: 閒置多久後 bucket 必定已補滿（所有規則中最長的 refill_seconds），
+    此時與新建的 bucket 等價，可以直接移除
+    """
+
+    # bucket 數量上限；超過時移除最久未更新的 bucket
+    MAX_KEYS = 50000
+
+    def __init__(self, idle_seconds: float = 600, max_keys: int = MAX_KEYS):
+        self.idle_seconds = idle_seconds
+        self.max_keys = max_keys
+        self._buckets: 'OrderedDict[str, list]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._evicted = 0
+
+    def consume(self, key: str, rule: BucketRule) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                self._prune(now)
+                self._buckets[key] = [rule.burst - 1.0, now]
+                return True
+
+            self._buckets.move_to_end(key)
+            tokens = min(rule.burst, bucket[0] + (now - bucket[1]) * rule.rate_per_second)
+            bucket[1] = now
+            if tokens >= 1.0:
+                bucket[0] = tokens - 1.0
+                return True
+            bucket[0] = tokens
+            return False
+
+    def _prune(self, now: float):
+        """從最久未更新的一端移除已補滿的 bucket；仍超過上限時提前移除（該 key 視同重新開始）"""
+        while self._buckets:
+            _, updated = next(iter(self._buckets.values()))
+            if now - updated <= self.idle_seconds:
+                if len(self._buckets) < self.max_keys:
+                    return
+                self._evicted += 1
+            self._buckets.popitem(last=False)
+
+    @property
+    def evicted(self) -> int:
+        """尚未補滿就因數量上限被移除的 bucket 數"""
+        return self._evicted
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class PostgresBucketStore:
+    """多 worker 共用的 bucket 狀態，每次檢查只需一個 UPSERT"""
+
+    # statement_timestamp() 在同一句中固定不變：每次展開的補充量相同，
+    # updated_at 也正好是計算補充量的時間點，不會漏掉兩者之間的 token
+    _REFILL = (
+        "LEAST(:burst, rate_limit_buckets.tokens + "
+        "EXTRACT(EPOCH FROM (statement_timestamp() - rate_limit_buckets.updated_at)) * :rate)"
+    )
+    _CONSUME_SQL = text(f"""
+        INSERT INTO rate_limit_buckets (bucket_key, tokens, allowed, updated_at)
+        VALUES (:key, :burst - 1, true, statement_timestamp())
+        ON CONFLICT (bucket_key) DO UPDATE SET
+            tokens = CASE WHEN {_REFILL} >= 1 THEN {_REFILL} - 1 ELSE {_REFILL} END,
+            allowed = {_REFILL} >= 1,
+            updated_at = statement_timestamp()
+        RETURNING allowed
+    """)
+
+    def consume(self, key: str, rule: BucketRule) -> bool:
+        from models import get_engine
+
+        try:
+            with get_engine().begin() as conn:
+                return bool(conn.execute(self._CONSUME_SQL, {
+                    'key': key,
+                    'burst': rule.burst,
+                    'rate': rule.rate_per_second
+                }).scalar())
+        except SQLAlchemyError as e:
+            # 資料庫異常時放行，避免限流機制本身造成服務中斷
+            logger.warning("共用速率限制查詢失敗，暫時放行", extra={'key': key, 'error': str(e)})
+            return True
+
+    # 狀態存在資料庫中，不在進程內移除
+    evicted = 0
+
+    def __len__(self):
+        return 0
+
+
+class RateLimiter:
+    """依範圍套用 token bucket 並統計被限流的次數"""
+
+    def __init__(self, rules: Optional[Dict[str, BucketRule]] = None, backend: Optional[str] = None,
+                 enabled: Optional[bool] = None):
+        self.rules = rules or load_rules_from_env()
+        if enabled is None:
+            enabled = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() != 'false'
+        self.enabled = enabled
+        self.backend = (backend or os.environ.get('RATE_LIMIT_BACKEND', 'memory')).lower()
+        if self.backend == 'postgres':
+            self.store = PostgresBucketStore()
+        else:
+            # 閒置超過最長的補滿時間才移除，移除後不會讓被限流的 key 提前恢復
+            self.store = MemoryBucketStore(
+                idle_seconds=max((rule.refill_seconds for rule in self.rules.values()), default=0)
+            )
+
+        self._lock = threading.Lock()
+        self._checked = {scope: 0 for scope in self.rules}
+        self._throttled = {scope: 0 for scope in self.rules}
+        self._last_notice: Dict[str, float] = {}
+
+    def allow(self, scope: str, key: str) -> bool:
+        """消耗一個 token；回傳 False 表示此訊息應被限流"""
+        if not self.enabled or not key:
+            return True
+        rule = self.rules.get(scope)
+        if rule is None:
+            return True
+
+        allowed = self.store.consume(f'{scope}:{key}', rule)
+        with self._lock:
+            self._checked[scope] += 1
+            if not allowed:
+                self._throttled[scope] += 1
+        return allowed
+
+    def should_notify(self, key: str) -> bool:
+        """同一個 key 在冷卻時間內只提醒一次"""
+        now = time.monotonic()
+        with self._lock:
+            last = self._last_notice.get(key)
+            if last is not None and now - last < THROTTLE_NOTICE_COOLDOWN_SECONDS:
+                return False
+            if len(self._last_notice) >= MemoryBucketStore.MAX_KEYS:
+                self._last_notice.clear()
+            self._last_notice[key] = now
+            return True
+
+    def get_stats(self):
+        """各範圍的檢查與限流次數"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'backend': self.backend,
+                'tracked_buckets': len(self.store),
+                'evicted_buckets': self.store.evicted,
+                'checked': dict(self._checked),
+                'throttled': dict(self._throttled)
+            }
+
+
+# 全局限流器實例
+rate_limiter = RateLimiter()
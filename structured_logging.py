@@ -0,0 +1,148 @@
+"""
+結構化日誌
+
+請求執行緒只把 LogRecord 放進佇列（QueueHandler），由背景的 QueueListener
+格式化成一行 JSON 寫到 stdout，避免在處理訊息時同步寫入 stdout。
+高頻率的紀錄以 extra={'sampled': True} 標記，依 LOG_SAMPLE_RATE 抽樣保留
+（WARNING 以上一律保留）；用戶訊息內容經 user_content() 遮蔽或截斷後才寫入。
+佇列 handler 在請求執行緒上為每筆紀錄附上目前的 trace_id / span_id，
+所有模組的 logger 都能以 trace 查詢。
+
+設定（環境變數）:
+    LOG_LEVEL=INFO
+    LOG_FORMAT=json              # json 或 text
+    LOG_SAMPLE_RATE=1.0          # 標記為 sampled 的紀錄保留比例
+    LOG_USER_CONTENT=redact      # redact（只記長度）/ truncate / full
+    LOG_USER_CONTENT_MAX_CHARS=40
+"""
+
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from tracing import TraceContextFilter
+
+LOG_USER_CONTENT = os.environ.get('LOG_USER_CONTENT', 'redact').lower()
+LOG_USER_CONTENT_MAX_CHARS = int(os.environ.get('LOG_USER_CONTENT_MAX_CHARS', '40'))
+
+# LogRecord 本身的屬性；其餘屬性來自 extra，輸出為 JSON 欄位
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+def user_content(text, mode: str = None, max_chars: int = None) -> str:
+    """用戶輸入的內容在寫入日誌前遮蔽或截斷"""
+    if text is None:
+        return None
+    text = str(text)
+    mode = mode or LOG_USER_CONTENT
+    if mode == 'full':
+        return text
+    if mode == 'truncate':
+        max_chars = max_chars or LOG_USER_CONTENT_MAX_CHARS
+        return text if len(text) <= max_chars else text[:max_chars] + '…'
+    return f"<已遮蔽 {len(text)} 字>"
+
+
+class JsonFormatter(logging.Formatter):
+    """一筆紀錄一行 JSON：ts、level、logger、msg，加上 extra 傳入的欄位"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """extra={'sampled': True} 的紀錄依比例保留；WARNING 以上不抽樣"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not getattr(record, 'sampled', False):
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+class _StructuredQueueHandler(QueueHandler):
+    """
+    預設的 QueueHandler.prepare 會先把整筆紀錄格式化成字串；
+    這裡只合併訊息參數並保留 extra 欄位，由背景執行緒再格式化
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_lock = threading.Lock()
+_listener = None
+_queue_handler = None
+
+
+def setup_logging(level: str = None, log_format: str = None, sample_rate: float = None, stream=None):
+    """設定 root logger 經由佇列非同步輸出（重複呼叫不會重複加入 handler）"""
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is not None:
+            return
+        level = (level or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+        log_format = (log_format or os.environ.get('LOG_FORMAT', 'json')).lower()
+        if sample_rate is None:
+            sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', '1.0'))
+
+        output = logging.StreamHandler(stream or sys.stdout)
+        if log_format == 'json':
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+        log_queue = queue.SimpleQueue()
+        _queue_handler = _StructuredQueueHandler(log_queue)
+        # 追蹤上下文存在 contextvars 中，必須在放入佇列前（請求執行緒上）讀取
+        _queue_handler.addFilter(TraceContextFilter())
+        _queue_handler.addFilter(SamplingFilter(sample_rate))
+        _listener = QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+
+        root = logging.getLogger()
+        root.setLevel(level)
+        root.addHandler(_queue_handler)
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """送出佇列中剩餘的紀錄並移除 handler"""
+    global _listener, _queue_handler
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        logging.getLogger().removeHandler(_queue_handler)
+        _listener = None
+        _queue_handler = None
@@ -0,0 +1,218 @@
+"""
+任務狀態儲存
+
+觸發 n8n 工作流時在 user_tasks 建立任務，n8n 透過批次端點回報進度，
+/查詢狀態 直接以索引查詢回覆，不必再觸發一次 n8n 工作流。
+"""
+
+import logging
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import JSON, bindparam, func, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import UserTask
+
+logger = logging.getLogger(__name__)
+
+# 任務狀態
+TASK_STATUSES = ('pending', 'running', 'completed', 'failed', 'cancelled')
+# 結束狀態：寫入 completed_at，且已取消的任務不再被 n8n 的進度覆寫
+TERMINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+TASK_TYPE_LABELS = {
+    'image_generation': '圖片生成',
+    'rss_analysis': 'RSS 分析',
+    'llm_analysis': '智能分析',
+}
+
+STATUS_LABELS = {
+    'pending': '⏳ 等待中',
+    'running': '🔄 處理中',
+    'completed': '✅ 已完成',
+    'failed': '❌ 失敗',
+    'cancelled': '🚫 已取消',
+}
+
+
+class TaskUpdateError(ValueError):
+    """任務更新內容格式錯誤"""
+
+
+def _default_engine():
+    from models import get_engine
+    return get_engine()
+
+
+class TaskStore:
+    """user_tasks 的寫入與查詢"""
+
+    def __init__(self, engine_factory: Callable = None):
+        self._engine_factory = engine_factory or _default_engine
+
+    def create_task(self, user_id: str, task_type: str, task_data: Optional[Dict] = None) -> Optional[str]:
+        """建立任務並回傳 task_key（傳給 n8n）；資料庫異常時回傳 None，不阻擋工作流"""
+        task_key = uuid.uuid4().hex
+        now = datetime.utcnow()
+        try:
+            with self._engine_factory().begin() as conn:
+                conn.execute(UserTask.__table__.insert().values(
+                    task_key=task_key,
+                    user_id=user_id,
+                    task_type=task_type,
+                    task_data=task_data or {},
+                    status='pending',
+                    created_at=now,
+                    updated_at=now
+                ))
+            return task_key
+        except SQLAlchemyError as e:
+            logger.warning("建立任務紀錄失敗", extra={'user_id': user_id, 'task_type': task_type, 'error': str(e)})
+            return None
+
+    @staticmethod
+    def _normalize(update_item: Dict) -> Dict:
+        if not isinstance(update_item, dict):
+            raise TaskUpdateError("每一項必須是物件")
+        task_key = update_item.get('task_id')
+        status = update_item.get('status')
+        if not isinstance(task_key, str) or not task_key:
+            raise TaskUpdateError("缺少 task_id")
+        if status not in TASK_STATUSES:
+            raise TaskUpdateError(f"無效的狀態: {status}")
+        message = update_item.get('message')
+        return {
+            'b_task_key': task_key,
+            'b_status': status,
+            'b_status_message': str(message)[:500] if message is not None else None,
+            'b_result': update_item.get('result'),
+            'b_completed_at': None,
+            'new_user_id': update_item.get('user_id'),
+            'new_task_type': update_item.get('task_type'),
+        }
+
+    def apply_updates(self, updates: List[Dict]) -> Dict:
+        """
+        批次套用 n8n 回報的任務狀態
+        updates: [{'task_id', 'status', 'message'?, 'result'?, 'user_id'?, 'task_type'?}, ...]
+        不存在的任務若附帶 user_id 與 task_type（n8n 自行建立的任務）則新增
+        """
+        rows = [self._normalize(item) for item in updates]
+        # 同一任務在同一批中出現多次時以最後一筆為準
+        latest = {row['b_task_key']: row for row in rows}
+        now = datetime.utcnow()
+        for row in latest.values():
+            row['b_updated_at'] = now
+            if row['b_status'] in TERMINAL_STATUSES:
+                row['b_completed_at'] = now
+
+        table = UserTask.__table__
+        update_stmt = (
+            update(table)
+            .where(table.c.task_key == bindparam('b_task_key'))
+            .where(table.c.status != 'cancelled')
+            .values(
+                status=bindparam('b_status'),
+                # 未回報說明或結果時保留原值
+                status_message=func.coalesce(bindparam('b_status_message'), table.c.status_message),
+                result=func.coalesce(bindparam('b_result', type_=JSON(none_as_null=True)), table.c.result),
+                completed_at=bindparam('b_completed_at'),
+                updated_at=bindparam('b_updated_at')
+            )
+        )
+
+        with self._engine_factory().begin() as conn:
+            existing = dict(conn.execute(
+                select(table.c.task_key, table.c.status).where(table.c.task_key.in_(list(latest)))
+            ).all())
+
+            to_update = [
+                row for key, row in latest.items()
+                if key in existing and existing[key] != 'cancelled'
+            ]
+            to_insert = [
+                row for key, row in latest.items()
+                if key not in existing and row['new_user_id'] and row['new_task_type']
+            ]
+
+            if to_update:
+                conn.execute(update_stmt, to_update)
+            if to_insert:
+                conn.execute(table.insert(), [{
+                    'task_key': row['b_task_key'],
+                    'user_id': row['new_user_id'],
+                    'task_type': row['new_task_type'],
+                    'task_data': {},
+                    'status': row['b_status'],
+                    'status_message': row['b_status_message'],
+                    'result': row['b_result'],
+                    'created_at': now,
+                    'updated_at': now,
+                    'completed_at': row['b_completed_at'],
+                } for row in to_insert])
+
+        skipped = sum(1 for key in latest if existing.get(key) == 'cancelled')
+        return {
+            'received': len(rows),
+            'updated': len(to_update),
+            'inserted': len(to_insert),
+            'skipped_cancelled': skipped,
+            'unknown': len(latest) - len(to_update) - len(to_insert) - skipped,
+        }
+
+    def cancel_tasks(self, user_id: str, task_key: Optional[str] = None) -> List[Dict]:
+        """
+        取消用戶尚未結束的任務（指定 task_key 時只取消該任務），回傳被取消的任務
+        只限本人的任務，避免以他人的 task_id 取消
+        """
+        table = UserTask.__table__
+        now = datetime.utcnow()
+        stmt = (
+            update(table)
+            .where(table.c.user_id == user_id)
+            .where(table.c.status.in_(('pending', 'running')))
+            .values(status='cancelled', status_message='已由用戶取消', completed_at=now, updated_at=now)
+            .returning(table.c.task_key, table.c.task_type)
+        )
+        if task_key:
+            stmt = stmt.where(table.c.task_key == task_key)
+        with self._engine_factory().begin() as conn:
+            return [dict(row._mapping) for row in conn.execute(stmt)]
+
+    def get_recent_tasks(self, user_id: str, limit: int = 5) -> List[Dict]:
+        """用戶最新的任務（走 user_id, created_at DESC 索引）"""
+        table = UserTask.__table__
+        query = (
+            select(table.c.task_key, table.c.task_type, table.c.status, table.c.status_message,
+                   table.c.created_at, table.c.completed_at)
+            .where(table.c.user_id == user_id)
+            .order_by(table.c.created_at.desc(), table.c.id.desc())
+            .limit(limit)
+        )
+        with self._engine_factory().connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(query)]
+
+
+def format_task_status(tasks: List[Dict], to_local: Callable[[datetime], datetime] = None) -> str:
+    """組合 /查詢狀態 的回覆文字"""
+    if not tasks:
+        return "📋 目前沒有任務紀錄"
+
+    lines = ["📋 最近的任務狀態："]
+    for task in tasks:
+        created_at = task['created_at']
+        if to_local and created_at:
+            created_at = to_local(created_at)
+        label = TASK_TYPE_LABELS.get(task['task_type'], task['task_type'])
+        status = STATUS_LABELS.get(task['status'], task['status'])
+        line = f"\n{status} {label}（{created_at:%m/%d %H:%M}）" if created_at else f"\n{status} {label}"
+        if task.get('status_message'):
+            line += f"\n   {task['status_message']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+# 全局任務儲存實例
+task_store = TaskStore()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+指令分派註冊表測試腳本
+
+驗證指令、別名與意圖的對應，以及處理器延遲統計。
+"""
+
+import sys
+import os
+import asyncio
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from command_registry import CommandRegistry
+
+
+def build_registry(calls):
+    """建立測試用註冊表，處理器會把收到的參數記錄到 calls"""
+    registry = CommandRegistry()
+
+    async def form_handler(user_id, args, reply_token):
+        calls.append(('form', user_id, args, reply_token))
+        return 'form'
+
+    async def image_handler(user_id, args, reply_token):
+        calls.append(('image', user_id, args, reply_token))
+
+    async def broken_handler(user_id, args, reply_token):
+        raise RuntimeError("boom")
+
+    registry.register('form_filling', form_handler, commands=['/填表', '/填表單'],
+                      intents={'form_filling_intent': None})
+    registry.register('image_generation', image_handler, commands=['/畫圖'],
+                      intents={'image_generation_intent': 'prompt'}, rate_limited=True)
+    registry.register('broken', broken_handler, commands=['/壞掉'])
+    registry.register('health_check', form_handler, commands=['/health', '/健康檢查'],
+                      requires_registration=False, group_allowed=True)
+    registry.register('registration', form_handler, commands=['/註冊'],
+                      requires_registration=False)
+    return registry
+
+
+def test_command_resolution():
+    """測試指令與別名解析"""
+    print("🔎 測試指令解析\n")
+    registry = build_registry([])
+
+    test_cases = [
+        ('/填表', 'form_filling'),
+        ('/填表單', 'form_filling'),
+        ('/畫圖', 'image_generation'),
+        ('/unknown', None),
+    ]
+    for command, expected in test_cases:
+        spec = registry.resolve_command(command)
+        result = spec.name if spec else None
+        status = "✅ PASS" if result == expected else "❌ FAIL"
+        print(f"{status} | {command} -> {result} (預期: {expected})")
+        assert result == expected
+
+    assert registry.command_map()['/填表單'] == 'form_filling'
+    assert registry.get('image_generation').rate_limited is True
+
+
+def test_intent_dispatch():
+    """測試意圖分派與參數傳遞"""
+    print("\n🧭 測試意圖分派\n")
+    calls = []
+    registry = build_registry(calls)
+
+    spec, param = registry.resolve_intent('image_generation_intent')
+    assert spec.name == 'image_generation' and param == 'prompt'
+    asyncio.run(registry.dispatch(spec, 'U1', '一隻貓', 'token'))
+    print(f"✅ PASS | 意圖分派呼叫: {calls[-1]}")
+    assert calls[-1] == ('image', 'U1', '一隻貓', 'token')
+
+    assert registry.resolve_intent('unknown_intent') == (None, None)
+
+
+def test_handler_stats():
+    """測試處理器延遲與錯誤統計"""
+    print("\n⏱️ 測試處理器統計\n")
+    registry = build_registry([])
+
+    result = asyncio.run(registry.dispatch(registry.get('form_filling'), 'U1', '', 'token'))
+    assert result == 'form'
+
+    try:
+        asyncio.run(registry.dispatch(registry.get('broken'), 'U1', '', 'token'))
+        raise AssertionError("預期處理器拋出錯誤")
+    except RuntimeError:
+        pass
+
+    stats = registry.get_stats()
+    print(f"📊 統計: {stats}")
+    assert stats['form_filling']['calls'] == 1
+    assert stats['broken']['errors'] == 1
+    assert stats['image_generation']['calls'] == 0
+
+
+def test_command_permissions():
+    """測試註冊與群組權限由處理器中繼資料決定"""
+    print("\n🔐 測試指令權限\n")
+    registry = build_registry([])
+
+    test_cases = [
+        ('/health', False),
+        ('/註冊', False),
+        ('/填表', True),
+        ('/unknown', True),
+        ('你好', True),
+    ]
+    for command, expected in test_cases:
+        result = registry.requires_registration(command)
+        status = "✅ PASS" if result == expected else "❌ FAIL"
+        print(f"{status} | {command} 需要註冊: {result} (預期: {expected})")
+        assert result == expected
+
+    assert registry.group_commands() == ('/health', '/健康檢查')
+
+    from bot_config import BotConfig
+    config = BotConfig()
+    config.group_allowed_commands = registry.group_commands()
+    assert config.should_respond_in_group('/健康檢查')
+    assert not config.should_respond_in_group('/註冊')
+
+
+def test_duplicate_registration():
+    """測試重複註冊指令會被拒絕"""
+    print("\n🚫 測試重複註冊\n")
+    registry = build_registry([])
+
+    async def handler(user_id, args, reply_token):
+        return None
+
+    try:
+        registry.register('form_again', handler, commands=['/填表'])
+        raise AssertionError("預期重複指令被拒絕")
+    except ValueError as e:
+        print(f"✅ PASS | {e}")
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("指令分派註冊表測試")
+    print("=" * 60)
+    test_command_resolution()
+    test_intent_dispatch()
+    test_handler_stats()
+    test_command_permissions()
+    test_duplicate_registration()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Flex 範本測試腳本
+
+驗證每個範本的輸出與舊的 dict + FlexSendMessage 建構結果相同，
+以及用戶值的 JSON 跳脫與 reply 請求內容的格式。
+"""
+
+import sys
+import os
+import json
+import tempfile
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flex_templates import FlexTemplateStore, build_push_body, build_reply_body, flex_templates
+
+USER_ID = 'U1234567890abcdef1234567890abcdef'
+
+
+def _substitute(node, values):
+    """舊做法：在新建的 dict 中填入欄位值"""
+    if isinstance(node, dict):
+        return {key: _substitute(value, values) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_substitute(value, values) for value in node]
+    if isinstance(node, str):
+        for slot, value in values.items():
+            node = node.replace('{{' + slot + '}}', value)
+    return node
+
+
+def build_legacy(doc, values):
+    """舊做法：dict → FlexSendMessage → JSON dict"""
+    from linebot.models import FlexSendMessage
+
+    message = FlexSendMessage(alt_text=doc['alt_text'], contents=_substitute(doc['contents'], values))
+    data = message.as_json_dict()
+    # SDK 會替圖片補上預設的 animated=false，範本不帶此欄位
+    hero = data['contents'].get('hero')
+    if hero and hero.get('animated') is False:
+        del hero['animated']
+    return data
+
+
+def template_files():
+    return sorted(name for name in os.listdir(flex_templates.template_dir) if name.endswith('.json'))
+
+
+def test_templates_match_legacy():
+    """每個 *.v*.json 範本的輸出等同舊的建構結果"""
+    print("📦 測試範本輸出\n")
+    files = template_files()
+    assert files
+    for filename in files:
+        with open(os.path.join(flex_templates.template_dir, filename), 'r', encoding='utf-8') as f:
+            doc = json.load(f)
+        values = {slot: USER_ID for slot in doc.get('slots', [])}
+        rendered = flex_templates.render(doc['name'], **values)
+        result = json.loads(rendered)
+        status = "✅ PASS" if result == build_legacy(doc, values) else "❌ FAIL"
+        print(f"{status} | {filename} ({len(rendered)} bytes)")
+        assert result == build_legacy(doc, values)
+
+
+def test_escaping():
+    """引號、反斜線、換行與非 ASCII 字元代入後仍是合法 JSON，且值保持原樣"""
+    print("\n🔐 測試 JSON 跳脫\n")
+    tricky_values = ['a"b', 'back\\slash', 'line\nbreak\ttab', '中文\u2028', '{{user_id}}']
+    for value in tricky_values:
+        for name in ('form_category', 'registration'):
+            result = json.loads(flex_templates.render(name, user_id=value))
+            with open(os.path.join(flex_templates.template_dir, f'{name}.v1.json'), 'r', encoding='utf-8') as f:
+                doc = json.load(f)
+            assert result == build_legacy(doc, {'user_id': value}), (name, value)
+        print(f"✅ PASS | {value!r}")
+
+    message = flex_templates.render('registration', user_id='x"y')
+    body = json.loads(build_reply_body('token"1', message))
+    assert body['replyToken'] == 'token"1' and body['messages'][0]['type'] == 'flex'
+    assert body['notificationDisabled'] is False
+    assert json.loads(build_push_body('U"1', message, message))['to'] == 'U"1'
+
+
+def test_store_versions():
+    """同名範本保留最新版本；使用未宣告的欄位時拒絕載入"""
+    print("\n🗂️ 測試範本版本\n")
+    with tempfile.TemporaryDirectory() as template_dir:
+        for version, text in ((1, '舊版 {{user_id}}'), (2, '新版 {{user_id}}')):
+            with open(os.path.join(template_dir, f'card.v{version}.json'), 'w', encoding='utf-8') as f:
+                json.dump({'alt_text': text, 'slots': ['user_id'], 'contents': {'type': 'bubble'}}, f)
+        store = FlexTemplateStore(template_dir)
+        assert store.get('card').version == 2
+        assert store.get('card').render_dict(user_id='U1')['altText'] == '新版 U1'
+
+        with open(os.path.join(template_dir, 'broken.v1.json'), 'w', encoding='utf-8') as f:
+            json.dump({'alt_text': '{{name}}', 'contents': {'type': 'bubble'}}, f)
+        try:
+            store.load()
+            raise AssertionError("預期未宣告的欄位被拒絕")
+        except ValueError as e:
+            print(f"✅ PASS | {e}")
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("Flex 範本測試")
+    print("=" * 60)
+    test_templates_match_legacy()
+    test_escaping()
+    test_store_versions()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Google 憑證快取測試腳本
+
+以假的憑證物件驗證：每個進程只載入一次、背景執行緒在 access token 到期前刷新，
+以及重設快取時刷新執行緒會停止。
+"""
+
+import sys
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import google_credentials
+from google_credentials import TOKEN_REFRESH_MARGIN_SECONDS, _TokenRefresher
+
+FAKE_REQUEST = object()
+
+
+class FakeCredentials:
+    """記錄刷新時間的假憑證，token 在 expires_in 秒後到期"""
+
+    def __init__(self, expires_in):
+        self.token = 'token-0'
+        self.expiry = datetime.utcnow() + timedelta(seconds=expires_in)
+        self.refreshes = []
+        self.refreshed = threading.Event()
+
+    def refresh(self, request):
+        assert request is FAKE_REQUEST
+        self.refreshes.append((datetime.utcnow(), self.expiry))
+        self.token = f'token-{len(self.refreshes)}'
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+        self.refreshed.set()
+
+
+class FakeRefresher(_TokenRefresher):
+    def __init__(self, credentials):
+        super().__init__(credentials, request=FAKE_REQUEST)
+
+
+def test_credentials_loaded_once():
+    """多執行緒同時取得憑證時只載入一次，之後回傳同一個物件"""
+    print("🔑 測試憑證快取\n")
+    loads = []
+    credentials = FakeCredentials(expires_in=3600)
+
+    def fake_load():
+        loads.append(1)
+        time.sleep(0.05)
+        return credentials
+
+    original_load = google_credentials._load_credentials
+    original_refresher = google_credentials._TokenRefresher
+    google_credentials.reset_google_credentials()
+    try:
+        google_credentials._load_credentials = fake_load
+        google_credentials._TokenRefresher = FakeRefresher
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(google_credentials.get_google_credentials()))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        print(f"  載入次數: {len(loads)}，取得 {len(results)} 次")
+        assert len(loads) == 1
+        assert all(result is credentials for result in results)
+        assert google_credentials._token_refresher.is_alive()
+
+        # 重設快取後刷新執行緒停止，下次取得時重新載入
+        refresher = google_credentials._token_refresher
+        google_credentials.reset_google_credentials()
+        refresher.join(timeout=1)
+        assert not refresher.is_alive()
+        google_credentials.get_google_credentials()
+        assert len(loads) == 2
+    finally:
+        google_credentials.reset_google_credentials()
+        google_credentials._load_credentials = original_load
+        google_credentials._TokenRefresher = original_refresher
+
+
+def test_refresh_before_expiry():
+    """剩餘時間低於 TOKEN_REFRESH_MARGIN_SECONDS 時在到期前刷新，之後等到下一次"""
+    print("\n🔄 測試到期前刷新\n")
+    credentials = FakeCredentials(expires_in=TOKEN_REFRESH_MARGIN_SECONDS + 0.2)
+    refresher = FakeRefresher(credentials)
+    refresher.start()
+    try:
+        assert credentials.refreshed.wait(2), "未在時限內刷新"
+        time.sleep(0.1)
+        refreshed_at, old_expiry = credentials.refreshes[0]
+        print(f"  刷新時距離到期: {(old_expiry - refreshed_at).total_seconds():.1f} 秒")
+        assert refreshed_at < old_expiry
+        assert len(credentials.refreshes) == 1  # 新 token 一小時後才到期
+        assert credentials.token == 'token-1'
+    finally:
+        refresher.stop()
+        refresher.join(timeout=1)
+    assert not refresher.is_alive()
+
+
+def test_refresher_stops_while_waiting():
+    """stop() 會喚醒等待中的執行緒，不必等到下一次刷新"""
+    print("\n🛑 測試停止刷新\n")
+    credentials = FakeCredentials(expires_in=3600)
+    refresher = FakeRefresher(credentials)
+    refresher.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    refresher.stop()
+    refresher.join(timeout=1)
+    print(f"  停止耗時: {time.monotonic() - start:.3f} 秒")
+    assert not refresher.is_alive()
+    assert credentials.refreshes == []
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("Google 憑證快取測試")
+    print("=" * 60)
+    test_credentials_loaded_once()
+    test_refresh_before_expiry()
+    test_refresher_stops_while_waiting()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
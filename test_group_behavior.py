@@ -85,17 +85,90 @@ def test_command_permissions():
     for cmd in bot_config.group_allowed_commands:
         print(f"  • {cmd}")
     
-    print("\n📌 未註冊用戶允許指令:")
-    for cmd in bot_config.unregistered_allowed_commands:
-        print(f"  • {cmd}")
-    
     print("\n📋 權限測試:")
     test_commands = ["/health", "/填表", "/註冊", "/help", "/畫圖", "/unknown"]
     
     for cmd in test_commands:
         group_ok = bot_config.is_group_allowed_command(cmd)
-        unreg_ok = bot_config.is_unregistered_allowed_command(cmd)
-        print(f"  {cmd:12} | 群組: {'✅' if group_ok else '❌'} | 未註冊: {'✅' if unreg_ok else '❌'}")
+        print(f"  {cmd:12} | 群組: {'✅' if group_ok else '❌'}")
+
+def test_matcher_rebuild():
+    """測試修改配置後比對器會重建"""
+    
+    print("🔄 測試比對器重建\n")
+    
+    from bot_config import BotConfig
+    config = BotConfig()
+    
+    config.mention_patterns = ['@assistant', '@assistant-bot']
+    config.group_allowed_commands = ['/ping']
+    
+    test_cases = [
+        (config.should_respond_in_group("/ping"), True, "新增的群組允許指令"),
+        (config.should_respond_in_group("/health"), False, "已移除的群組允許指令"),
+        (config.should_respond_in_group("/pingpong"), False, "指令前綴不算允許指令"),
+        (config.is_bot_mentioned("@視覺設計組 你好"), False, "已移除的 mention 關鍵字"),
+        (config.remove_mention("@assistant-bot 你好"), "你好", "較長的 mention 優先移除"),
+    ]
+    
+    for result, expected, description in test_cases:
+        status = "✅ PASS" if result == expected else "❌ FAIL"
+        print(f"{status} | {description}: {result!r} (預期: {expected!r})")
+        assert result == expected, description
+
+def test_mixed_batch_dispatch():
+    """同一批事件中只建立並分派未被過濾的事件"""
+    
+    print("📦 測試混合批次的前置過濾\n")
+    
+    import webhook_filter
+    from linebot import WebhookHandler
+    from linebot.models import MessageEvent, TextMessage, FollowEvent
+    from webhook_filter import GroupMessageFilter, dispatch_events
+    
+    def text_event(event_id, text, source_type='group'):
+        source = {'type': source_type, 'userId': 'U1'}
+        if source_type == 'group':
+            source['groupId'] = 'G1'
+        return {
+            'type': 'message', 'mode': 'active', 'timestamp': 1, 'webhookEventId': event_id,
+            'source': source, 'replyToken': f'r-{event_id}',
+            'message': {'type': 'text', 'id': event_id, 'text': text}
+        }
+    
+    body_json = {'destination': 'Ubot', 'events': [
+        text_event('1', '大家好啊'),
+        text_event('2', '@視覺設計組 你好'),
+        text_event('3', '誰可以幫我填表？'),
+        text_event('4', '私訊內容', source_type='user'),
+        {'type': 'follow', 'mode': 'active', 'timestamp': 1, 'webhookEventId': '5',
+         'source': {'type': 'user', 'userId': 'U2'}, 'replyToken': 'r-5'},
+    ]}
+    
+    handler = WebhookHandler('secret')
+    handled = []
+    
+    @handler.add(MessageEvent, message=TextMessage)
+    def on_text(event):
+        handled.append(event.message.text)
+    
+    @handler.add(FollowEvent)
+    def on_follow(event, destination):
+        handled.append(('follow', destination))
+    
+    built = []
+    original_build = webhook_filter.build_event
+    webhook_filter.build_event = lambda event: built.append(event['webhookEventId']) or original_build(event)
+    try:
+        kept = GroupMessageFilter().filter_events(body_json)
+        dispatch_events(handler, kept, body_json['destination'])
+    finally:
+        webhook_filter.build_event = original_build
+    
+    print(f"  建立的事件: {built}")
+    print(f"  處理結果: {handled}")
+    assert built == ['2', '4', '5']
+    assert handled == ['@視覺設計組 你好', '私訊內容', ('follow', 'Ubot')]
 
 def main():
     """主測試函數"""
@@ -116,6 +189,10 @@ def main():
     test_mention_removal()
     print("-" * 60)
     test_command_permissions()
+    print("-" * 60)
+    test_matcher_rebuild()
+    print("-" * 60)
+    test_mixed_batch_dispatch()
     
     print("\n" + "=" * 60)
     print("測試完成！")
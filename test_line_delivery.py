@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+LINE 訊息遞送測試腳本
+
+驗證 reply token 時效判斷、逾時與失效 token 改用 push，以及 push 合併。
+"""
+
+import sys
+import os
+import threading
+import time
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from linebot.models import TextSendMessage
+
+from fake_line_api import RecordingApi
+from line_delivery import LineDelivery, ReplyTokenTracker
+
+
+def make_delivery(api):
+    return LineDelivery(api, ReplyTokenTracker(ttl_seconds=60, safety_margin_seconds=5))
+
+
+def test_reply_within_deadline():
+    """token 在時效內時使用 reply"""
+    print("📨 測試時效內 reply\n")
+    api = RecordingApi()
+    delivery = make_delivery(api)
+    delivery.tracker.record('rt-1', 'U1', int(time.time() * 1000))
+
+    delivery.reply('rt-1', TextSendMessage(text='hi'))
+    print(f"  呼叫: {api.calls}")
+    assert api.calls == [('/v2/bot/message/reply', {
+        'replyToken': 'rt-1',
+        'messages': [{'type': 'text', 'text': 'hi'}],
+        'notificationDisabled': False
+    })]
+    assert delivery.get_stats()['replies'] == 1
+
+
+def test_expired_token_falls_back_to_push():
+    """token 已逾時時改為 push 給原本的聊天室"""
+    print("\n⌛ 測試逾時改用 push\n")
+    api = RecordingApi()
+    delivery = make_delivery(api)
+    delivery.tracker.record('rt-old', 'G1', int((time.time() - 58) * 1000))
+
+    delivery.reply('rt-old', TextSendMessage(text='late'))
+    print(f"  呼叫: {api.calls}")
+    assert api.calls[0][0] == '/v2/bot/message/push'
+    assert api.calls[0][1]['to'] == 'G1'
+    stats = delivery.get_stats()
+    assert stats['expired_tokens'] == 1 and stats['replies'] == 0
+
+
+def test_invalid_token_falls_back_to_push():
+    """LINE 回應 400（token 失效）時改為 push"""
+    print("\n🚫 測試失效 token 改用 push\n")
+    api = RecordingApi(reject_replies=True)
+    delivery = make_delivery(api)
+    delivery.tracker.record('rt-bad', 'U1')
+
+    delivery.reply('rt-bad', TextSendMessage(text='retry'))
+    assert [path for path, _ in api.calls] == ['/v2/bot/message/push']
+    assert delivery.get_stats()['invalid_token_fallbacks'] == 1
+
+    # reply 被限流（429）時同樣改用 push，不等待 Retry-After
+    api = RecordingApi(reject_replies=True, reply_error_status=429)
+    delivery = make_delivery(api)
+    delivery.tracker.record('rt-busy', 'G1')
+    assert delivery.reply('rt-busy', TextSendMessage(text='busy')) == 'push'
+    assert api.calls[0][1]['to'] == 'G1'
+    assert delivery.get_stats()['rate_limited_fallbacks'] == 1
+
+
+def test_batched_pushes():
+    """batch 範圍內的 push 合併，每次最多 5 則"""
+    print("\n📦 測試 push 合併\n")
+    api = RecordingApi()
+    delivery = make_delivery(api)
+
+    with delivery.batch('U1'):
+        for i in range(7):
+            delivery.push('U1', TextSendMessage(text=str(i)))
+        assert api.calls == []
+
+    print(f"  push 呼叫次數: {len(api.calls)}")
+    assert [len(body['messages']) for _, body in api.calls] == [5, 2]
+    stats = delivery.get_stats()
+    assert stats['pushes'] == 7 and stats['push_requests'] == 2
+
+
+def test_batch_is_per_thread():
+    """其他執行緒發往同一對象的 push 不會被暫存進這個執行緒的 batch"""
+    print("\n🧵 測試 batch 只屬於開啟它的執行緒\n")
+    api = RecordingApi()
+    delivery = make_delivery(api)
+
+    with delivery.batch('U1'):
+        delivery.push('U1', TextSendMessage(text='batched'))
+        other = threading.Thread(target=delivery.push, args=('U1', TextSendMessage(text='other thread')))
+        other.start()
+        other.join()
+        # 其他執行緒的 push 已立即送出
+        assert [body['messages'][0]['text'] for _, body in api.calls] == ['other thread']
+
+    assert [body['messages'][0]['text'] for _, body in api.calls] == ['other thread', 'batched']
+
+
+def test_reply_overflow_pushes_rest():
+    """reply 超過 5 則時，其餘訊息 push 給同一對象；沒有對象時拋出錯誤"""
+    print("\n📨 測試 reply 超過 5 則\n")
+    api = RecordingApi()
+    delivery = make_delivery(api)
+    delivery.tracker.record('rt-1', 'U1')
+
+    messages = [TextSendMessage(text=str(i)) for i in range(7)]
+    assert delivery.reply('rt-1', messages) == 'reply'
+    print(f"  呼叫: {[(path, len(body['messages'])) for path, body in api.calls]}")
+    assert [(path, len(body['messages'])) for path, body in api.calls] == [
+        ('/v2/bot/message/reply', 5), ('/v2/bot/message/push', 2)
+    ]
+    assert api.calls[1][1]['to'] == 'U1'
+
+    try:
+        delivery.reply('rt-untracked', messages)
+        assert False, "應拋出 ValueError"
+    except ValueError:
+        pass
+    assert len(api.calls) == 2
+
+
+def test_hand_off():
+    """剩餘時間不足時不把 token 交給外部系統"""
+    print("\n🤝 測試 token 交接\n")
+    delivery = make_delivery(RecordingApi())
+    delivery.tracker.record('rt-ok', 'U1')
+    delivery.tracker.record('rt-late', 'U1', int((time.time() - 45) * 1000))
+
+    ok = delivery.hand_off('rt-ok', min_remaining_seconds=20)
+    late = delivery.hand_off('rt-late', min_remaining_seconds=20)
+    print(f"  可交接: {ok}\n  不足: {late}")
+    assert ok['reply_token'] == 'rt-ok' and ok['remaining_ms'] > 20000
+    assert late['reply_token'] is None and late['push_to'] == 'U1'
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("LINE 訊息遞送測試")
+    print("=" * 60)
+    test_reply_within_deadline()
+    test_expired_token_falls_back_to_push()
+    test_invalid_token_falls_back_to_push()
+    test_batched_pushes()
+    test_batch_is_per_thread()
+    test_reply_overflow_pushes_rest()
+    test_hand_off()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
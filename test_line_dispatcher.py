@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+LINE API 集中派送測試腳本
+
+驗證 429 / Retry-After 重試、reply 的 429 不等待、retry key 與 409、等待佇列上限與全域限速。
+"""
+
+import sys
+import os
+import threading
+import time
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+
+from line_dispatcher import LineApiDispatcher, LineApiDropped, DispatchingHttpClient
+
+PUSH_URL = 'https://api.line.me/v2/bot/message/push'
+REPLY_URL = 'https://api.line.me/v2/bot/message/reply'
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = ''
+
+    def json(self):
+        return {}
+
+
+class FakeSession:
+    """依序回傳預先設定的回應，並記錄每次請求的 headers"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def request(self, method, url, headers=None, timeout=None, **kwargs):
+        self.requests.append((method, url, dict(headers or {})))
+        result = self.responses.pop(0) if self.responses else FakeResponse(200)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def make_dispatcher(responses, **kwargs):
+    options = {'rate_per_second': 1000, 'max_retries': 3, 'max_queue_wait_seconds': 2}
+    options.update(kwargs)
+    dispatcher = LineApiDispatcher(**options)
+    dispatcher._session = FakeSession(responses)
+    dispatcher._backoff_seconds = lambda attempt: 0.0
+    return dispatcher
+
+
+def test_retry_after_429():
+    """收到 429 時依 Retry-After 等待後重試，重試使用同一個 retry key"""
+    print("⏳ 測試 429 與 Retry-After\n")
+    dispatcher = make_dispatcher([FakeResponse(429, {'Retry-After': '0.05'}), FakeResponse(200)])
+    start = time.monotonic()
+    response = dispatcher.request('POST', PUSH_URL, headers={'Content-Type': 'application/json'}, data=b'{}')
+    elapsed = time.monotonic() - start
+
+    keys = {headers['X-Line-Retry-Key'] for _, _, headers in dispatcher._session.requests}
+    stats = dispatcher.get_stats()
+    print(f"  耗時 {elapsed:.3f}s, 統計: {stats}")
+    assert response.status_code == 200
+    assert elapsed >= 0.05
+    assert len(dispatcher._session.requests) == 2 and len(keys) == 1
+    assert stats['rate_limited'] == 1 and stats['retried'] == 1
+
+
+def test_reply_not_retried_on_server_error():
+    """reply 沒有 retry key，5xx 不重試以免重複回覆"""
+    print("\n🚫 測試 reply 不重試 5xx\n")
+    dispatcher = make_dispatcher([FakeResponse(500)])
+    response = dispatcher.request('POST', REPLY_URL, data=b'{}')
+    assert response.status_code == 500
+    assert len(dispatcher._session.requests) == 1
+    assert 'X-Line-Retry-Key' not in dispatcher._session.requests[0][2]
+
+
+def test_push_retried_on_connection_error():
+    """push 連線錯誤時重試；重試收到 409 時原樣回傳並記入 accepted_retries"""
+    print("\n🔁 測試 push 連線錯誤重試\n")
+    dispatcher = make_dispatcher([requests.ConnectionError('reset'), FakeResponse(409)])
+    response = dispatcher.request('POST', PUSH_URL, data=b'{}')
+    assert response.status_code == 409
+    stats = dispatcher.get_stats()
+    assert stats['retried'] == 1 and stats['accepted_retries'] == 1
+
+
+def test_reply_429_returned_without_waiting():
+    """reply 收到 429 時不等待 Retry-After，直接回傳讓呼叫端改用 push"""
+    print("\n⌛ 測試 reply 的 429\n")
+    dispatcher = make_dispatcher([FakeResponse(429, {'Retry-After': '30'})])
+    start = time.monotonic()
+    response = dispatcher.request('POST', REPLY_URL, data=b'{}')
+    elapsed = time.monotonic() - start
+    print(f"  耗時 {elapsed:.3f}s")
+    assert response.status_code == 429 and elapsed < 1
+    assert len(dispatcher._session.requests) == 1
+    assert dispatcher.get_stats()['rate_limited'] == 1
+
+
+def test_backlog_limit():
+    """等待中的呼叫超過上限時直接放棄"""
+    print("\n📦 測試等待佇列上限\n")
+    dispatcher = make_dispatcher([], rate_per_second=5, burst=1, max_backlog=1)
+    dispatcher.request('GET', 'https://api.line.me/v2/bot/info')
+
+    results = []
+
+    def call():
+        try:
+            dispatcher.request('GET', 'https://api.line.me/v2/bot/info')
+            results.append('sent')
+        except LineApiDropped as e:
+            results.append(e.reason)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats = dispatcher.get_stats()
+    print(f"  結果: {sorted(results)}, 統計: {stats}")
+    assert 'backlog_full' in results
+    assert stats['dropped'] >= 1 and stats['queued'] >= 1
+
+
+def test_http_client_integration():
+    """DispatchingHttpClient 可作為 LineBotApi 的 http_client"""
+    print("\n🔌 測試 LineBotApi 整合\n")
+    from linebot import LineBotApi
+    from linebot.models import TextSendMessage
+
+    dispatcher = make_dispatcher([FakeResponse(200)])
+    api = LineBotApi('token', http_client=lambda timeout: DispatchingHttpClient(timeout, dispatcher))
+    api.push_message('U1', TextSendMessage(text='hi'))
+    method, url, headers = dispatcher._session.requests[0]
+    assert (method, url) == ('POST', PUSH_URL)
+    assert headers['Authorization'] == 'Bearer token'
+
+    # 重試收到帶 X-Line-Accepted-Request-Id 的 409：post_json 視為成功
+    from line_delivery import post_json
+    dispatcher = make_dispatcher([
+        requests.ConnectionError('reset'),
+        FakeResponse(409, {'X-Line-Accepted-Request-Id': 'req-1'})
+    ])
+    api = LineBotApi('token', http_client=lambda timeout: DispatchingHttpClient(timeout, dispatcher))
+    assert post_json(api, '/v2/bot/message/push', b'{"to":"U1","messages":[]}') is None
+    assert dispatcher.get_stats()['accepted_retries'] == 1
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("LINE API 集中派送測試")
+    print("=" * 60)
+    test_retry_after_429()
+    test_reply_not_retried_on_server_error()
+    test_push_retried_on_connection_error()
+    test_reply_429_returned_without_waiting()
+    test_backlog_limit()
+    test_http_client_integration()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
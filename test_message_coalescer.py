@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+訊息合併測試腳本
+
+驗證視窗時間內的連續訊息會合併成一次處理，並使用最新的 reply token。
+"""
+
+import sys
+import os
+import threading
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from message_coalescer import MessageCoalescer
+
+
+class FlushRecorder:
+    """記錄 on_flush 收到的內容"""
+
+    def __init__(self):
+        self.calls = []
+        self.event = threading.Event()
+
+    def __call__(self, text, reply_token, count):
+        self.calls.append((text, reply_token, count))
+        self.event.set()
+
+
+def test_disabled_passthrough():
+    """測試未啟用時不緩衝"""
+    print("🚫 測試未啟用\n")
+    coalescer = MessageCoalescer(window_seconds=0)
+    assert coalescer.submit('U1', '你好', 'token-1', FlushRecorder()) is False
+    print("✅ PASS | 未啟用時交由呼叫者直接處理")
+
+
+def test_merge_within_window():
+    """測試視窗時間內的訊息合併"""
+    print("\n🧩 測試視窗內合併\n")
+    coalescer = MessageCoalescer(window_seconds=0.05, max_wait_seconds=1, max_messages=10)
+    recorder = FlushRecorder()
+    for i, text in enumerate(['幫我', '畫一隻', '貓'], 1):
+        assert coalescer.submit('U1', text, f'token-{i}', recorder) is True
+
+    assert recorder.event.wait(2), "合併訊息未送出"
+    print(f"  送出內容: {recorder.calls}")
+    assert recorder.calls == [('幫我\n畫一隻\n貓', 'token-3', 3)]
+
+    stats = coalescer.get_stats()
+    print(f"  統計: {stats}")
+    assert stats['upstream_calls_saved'] == 2
+
+
+def test_max_messages_and_manual_flush():
+    """測試達到上限立即送出，以及手動送出"""
+    print("\n⚡ 測試上限與手動送出\n")
+    coalescer = MessageCoalescer(window_seconds=10, max_wait_seconds=10, max_messages=2)
+    recorder = FlushRecorder()
+    coalescer.submit('U1', 'a', 'token-1', recorder)
+    coalescer.submit('U1', 'b', 'token-2', recorder)
+    assert recorder.calls == [('a\nb', 'token-2', 2)]
+
+    coalescer.submit('U2', 'c', 'token-3', recorder)
+    assert coalescer.flush('U2') is True
+    assert coalescer.flush('U2') is False
+    assert recorder.calls[-1] == ('c', 'token-3', 1)
+    print("✅ PASS | 上限與手動送出正常")
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("訊息合併測試")
+    print("=" * 60)
+    test_disabled_passthrough()
+    test_merge_within_window()
+    test_max_messages_and_manual_flush()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
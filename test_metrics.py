@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+指標測試腳本
+
+驗證計數器與延遲直方圖的 text exposition 輸出，以及既有 get_stats() 轉成 gauge。
+"""
+
+import sys
+import os
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from metrics import MetricsRegistry, status_outcome
+
+
+def test_counter():
+    """同一組標籤累加，輸出 _total"""
+    print("🔢 測試計數器\n")
+    registry = MetricsRegistry()
+    events = registry.counter('linebot_webhook_events', '收到的 webhook 事件數', ('event_type', 'source_type'))
+    events.inc('message', 'group')
+    events.inc('message', 'group')
+    events.inc('follow', 'user')
+    output = registry.render()
+    print(output)
+    assert '# TYPE linebot_webhook_events counter' in output
+    assert 'linebot_webhook_events_total{event_type="message",source_type="group"} 2' in output
+    assert 'linebot_webhook_events_total{event_type="follow",source_type="user"} 1' in output
+    # 同名重複登錄取得同一個實例
+    assert registry.counter('linebot_webhook_events', '', ('event_type', 'source_type')) is events
+
+
+def test_histogram():
+    """分桶為累積值，_count 與 _sum 正確"""
+    print("\n⏱️ 測試延遲直方圖\n")
+    registry = MetricsRegistry()
+    duration = registry.histogram('linebot_command_duration_seconds', '指令處理器執行時間',
+                                  ('command', 'outcome'), buckets=(0.1, 1.0))
+    duration.observe(0.05, 'help', 'ok')
+    duration.observe(0.5, 'help', 'ok')
+    duration.observe(3.0, 'help', 'ok')
+    with duration.time('task', 'error'):
+        pass
+    output = registry.render()
+    print(output)
+    assert 'linebot_command_duration_seconds_bucket{command="help",outcome="ok",le="0.1"} 1' in output
+    assert 'linebot_command_duration_seconds_bucket{command="help",outcome="ok",le="1"} 2' in output
+    assert 'linebot_command_duration_seconds_bucket{command="help",outcome="ok",le="+Inf"} 3' in output
+    assert 'linebot_command_duration_seconds_count{command="help",outcome="ok"} 3' in output
+    assert 'linebot_command_duration_seconds_sum{command="help",outcome="ok"} 3.55' in output
+    assert 'linebot_command_duration_seconds_count{command="task",outcome="error"} 1' in output
+
+
+def test_stats_collector():
+    """get_stats() 的數值轉成 gauge，非數值略過，失敗時不影響其他輸出"""
+    print("\n📊 測試統計轉換\n")
+    registry = MetricsRegistry()
+    registry.register_stats('linebot_rate_limit', lambda: {
+        'enabled': True,
+        'backend': 'memory',
+        'throttled': {'user': 3, 'group': 1},
+    }, label='scope')
+    registry.register_stats('linebot_scheduler', lambda: {
+        'form_filling': {'calls': 5, 'active': 1},
+    }, label='tier', by_label=True)
+    registry.register_stats('linebot_broken', lambda: 1 / 0)
+    output = registry.render()
+    print(output)
+    assert 'linebot_rate_limit_enabled 1' in output
+    assert 'backend' not in output
+    assert 'linebot_rate_limit_throttled{scope="user"} 3' in output
+    assert 'linebot_scheduler_calls{tier="form_filling"} 5' in output
+    assert 'linebot_broken' not in output
+
+    # 同一 prefix 重複登錄時取代舊的
+    registry.register_stats('linebot_rate_limit', lambda: {'enabled': False}, label='scope')
+    assert registry.render().count('# TYPE linebot_rate_limit_enabled gauge') == 1
+    assert 'linebot_rate_limit_enabled 0' in registry.render()
+
+
+def test_status_outcome():
+    """HTTP 狀態碼轉為狀態類別"""
+    print("\n🏷️ 測試狀態類別\n")
+    assert status_outcome(200) == '2xx'
+    assert status_outcome(429) == '4xx'
+    assert status_outcome(503) == '5xx'
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("指標測試")
+    print("=" * 60)
+    test_counter()
+    test_histogram()
+    test_stats_collector()
+    test_status_outcome()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
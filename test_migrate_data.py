@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+資料遷移測試腳本
+
+驗證 JSON 串流解析（值跨越讀取區段）、分批 upsert 可重複執行，
+以及中斷後依檢查點繼續匯入。
+"""
+
+import sys
+import os
+import io
+import json
+import tempfile
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import StaticPool
+
+import models
+import migrate_data
+from migrate_data import iter_json_users, migrate_users
+
+
+def make_users(count):
+    return {
+        f"U{i:04d}": {
+            'name': f'用戶{i}',
+            'email': f'user{i}@example.com',
+            'department': '編輯部',
+            'created_at': '2024-01-02T03:04:05',
+            'role': 'member',
+        }
+        for i in range(count)
+    }
+
+
+def make_engine():
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    models.Base.metadata.create_all(engine)
+    return engine
+
+
+def count_users(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(models.User.__table__)).scalar()
+
+
+def test_stream_parser():
+    """以極小的讀取區段解析，結果與 json.load 相同"""
+    print("🧩 測試串流解析\n")
+    data = {'version': 2, 'users': make_users(20), 'meta': {'note': '中文, } 與 "引號"'}}
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    for read_size in (1, 7, 4096):
+        parsed = dict(iter_json_users(io.StringIO(text), read_size=read_size))
+        assert parsed == data['users'], read_size
+    print(f"  解析 {len(data['users'])} 筆用戶")
+
+
+def test_idempotent_and_resumable():
+    """重複匯入不產生重複資料；寫入失敗後依檢查點繼續"""
+    print("\n🔁 測試重複匯入與中斷繼續\n")
+    engine = make_engine()
+    users = make_users(25)
+    users['U0003']['email'] = users['U0001']['email']  # 與同批資料 email 重複
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'users.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'users': users}, f, ensure_ascii=False)
+
+        # 第二批寫入時模擬資料庫中斷
+        original_write = migrate_data.write_chunk
+        calls = []
+
+        def failing_write(db_engine, rows):
+            calls.append(len(rows))
+            if len(calls) == 2:
+                raise SQLAlchemyError('connection lost')
+            return original_write(db_engine, rows)
+
+        migrate_data.write_chunk = failing_write
+        try:
+            assert migrate_users(path, chunk_size=10, engine=engine) is False
+        finally:
+            migrate_data.write_chunk = original_write
+        with open(path + '.checkpoint', encoding='utf-8') as f:
+            assert json.load(f)['processed'] == 10
+        print(f"  中斷後已寫入 {count_users(engine)} 筆")
+
+        assert migrate_users(path, chunk_size=10, engine=engine) is True
+        assert not os.path.exists(path + '.checkpoint')
+        assert count_users(engine) == 24
+
+        # 全部重新匯入：資料更新而非重複
+        users['U0000']['name'] = '改名'
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'users': users}, f, ensure_ascii=False)
+        assert migrate_users(path, chunk_size=7, engine=engine) is True
+        assert count_users(engine) == 24
+
+    with engine.connect() as conn:
+        row = conn.execute(
+            select(models.User.__table__).where(models.User.__table__.c.line_id == 'U0000')
+        ).one()
+    print(f"  U0000: {row.name}, {row.user_metadata}")
+    assert row.name == '改名'
+    assert row.user_metadata == {'role': 'member'}
+    assert row.created_at.year == 2024
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("資料遷移測試")
+    print("=" * 60)
+    test_stream_parser()
+    test_idempotent_and_resumable()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+大量推播服務測試腳本
+
+驗證相同內容合併為 multicast、每批最多 500 位收件者、失敗統計與取消。
+"""
+
+import sys
+import os
+import threading
+import time
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from fake_line_api import RecordingApi
+from outbound_delivery import OutboundDeliveryService, BulkRequestError
+
+
+def wait_for(job, timeout=2.0):
+    deadline = time.time() + timeout
+    while job.status in ('queued', 'sending') and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+TEXT = {'type': 'text', 'text': '系統維護通知'}
+
+
+def test_group_identical_messages():
+    """相同內容的收件者合併，重複的收件者只送一次，每批最多 500 位"""
+    print("📣 測試 multicast 合併\n")
+    api = RecordingApi()
+    service = OutboundDeliveryService(api, concurrency=4)
+
+    users = [f'U{i:04d}' for i in range(1200)]
+    deliveries = [{'to': [user_id], 'messages': [TEXT]} for user_id in users]
+    deliveries.append({'to': users[:10], 'messages': [TEXT]})
+    deliveries.append({'to': ['U9999'], 'messages': [{'type': 'text', 'text': '另一則'}]})
+
+    job = wait_for(service.submit_multicast(deliveries, task_id='t-1'))
+    sizes = sorted(len(body['to']) for _, body in api.calls)
+    print(f"  工作狀態: {job.to_dict()}")
+    print(f"  每批收件者數: {sizes}")
+    assert job.status == 'done'
+    assert job.recipients == 1201 and job.delivered == 1201
+    assert sizes == [1, 200, 500, 500]
+    assert all(path == '/v2/bot/message/multicast' for path, _ in api.calls)
+
+
+def test_invalid_request():
+    """格式錯誤的請求在建立工作前就被拒絕"""
+    print("\n🚫 測試請求驗證\n")
+    service = OutboundDeliveryService(RecordingApi())
+    for deliveries in ([], [{'to': [], 'messages': [TEXT]}], [{'to': ['U1'], 'messages': [TEXT] * 6}]):
+        try:
+            service.submit_multicast(deliveries)
+            raise AssertionError(f"預期拒絕: {deliveries}")
+        except BulkRequestError as e:
+            print(f"✅ PASS | {e}")
+    assert service.get_stats()['jobs'] == 0
+
+
+def test_failures_and_narrowcast():
+    """API 失敗時記錄失敗數；narrowcast 一次送出"""
+    print("\n⚠️ 測試失敗統計與 narrowcast\n")
+    api = RecordingApi(fail_paths=('/v2/bot/message/multicast',))
+    service = OutboundDeliveryService(api)
+
+    failed = wait_for(service.submit_multicast([{'to': ['U1', 'U2'], 'messages': [TEXT]}]))
+    assert failed.status == 'failed' and failed.failed == 2
+
+    narrowcast = wait_for(service.submit_narrowcast([TEXT], recipient={'type': 'audience', 'audienceGroupId': 1}))
+    print(f"  narrowcast: {api.calls}")
+    assert narrowcast.status == 'done'
+    assert api.calls[0][1]['recipient']['audienceGroupId'] == 1
+
+
+def test_cancel():
+    """取消 task 後尚未送出的批次不再呼叫 API"""
+    print("\n🛑 測試取消\n")
+    gate = threading.Event()
+    api = RecordingApi(gate=gate)
+    service = OutboundDeliveryService(api, concurrency=1)
+
+    users = [f'U{i}' for i in range(1500)]
+    job = service.submit_multicast([{'to': users, 'messages': [TEXT]}], task_id='t-cancel')
+    assert service.cancel('t-cancel') == 1
+    gate.set()
+    wait_for(job)
+    print(f"  工作狀態: {job.to_dict()}")
+    assert job.status == 'cancelled'
+    assert len(api.calls) <= 1
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("大量推播服務測試")
+    print("=" * 60)
+    test_group_identical_messages()
+    test_invalid_request()
+    test_failures_and_narrowcast()
+    test_cancel()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+分級排程器測試腳本
+
+驗證各層級獨立的併發上限、佇列上限與等待時間統計。
+"""
+
+import sys
+import os
+import asyncio
+import threading
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from priority_scheduler import PriorityScheduler, SchedulerRejected
+
+
+def make_scheduler():
+    return PriorityScheduler({
+        'direct_command': (2, 2, 1000),
+        'llm_fallback': (1, 1, 200),
+    })
+
+
+def test_tiers_are_isolated():
+    """LLM 層級佔滿時，直接指令仍可立即取得名額"""
+    print("🧱 測試層級隔離\n")
+    scheduler = make_scheduler()
+
+    async def scenario():
+        async with scheduler.slot('llm_fallback'):
+            async with scheduler.slot('direct_command'):
+                return scheduler.get_stats()
+
+    stats = asyncio.run(scenario())
+    print(f"  統計: {stats}")
+    assert stats['llm_fallback']['active'] == 1
+    assert stats['direct_command']['active'] == 1
+    assert stats['direct_command']['max_wait_ms'] == 0.0
+
+
+def test_wait_and_timeout():
+    """名額被佔用時會等待，逾時則拒絕"""
+    print("\n⏳ 測試等待與逾時\n")
+    scheduler = make_scheduler()
+    tier = scheduler._tiers['llm_fallback']
+    assert tier.try_acquire()
+
+    release_timer = threading.Timer(0.05, tier.release)
+    release_timer.start()
+
+    async def wait_for_slot():
+        async with scheduler.slot('llm_fallback'):
+            return True
+
+    assert asyncio.run(wait_for_slot()) is True
+    stats = scheduler.get_stats()['llm_fallback']
+    print(f"  等待後取得名額: {stats}")
+    assert stats['max_wait_ms'] > 0
+
+    assert tier.try_acquire()
+    try:
+        asyncio.run(wait_for_slot())
+        raise AssertionError("預期等待逾時")
+    except SchedulerRejected as e:
+        print(f"✅ PASS | 逾時拒絕: {e}")
+        assert e.reason == 'timeout'
+    finally:
+        tier.release()
+
+
+def test_queue_full():
+    """等待佇列已滿時立即拒絕"""
+    print("\n🚦 測試佇列上限\n")
+    scheduler = make_scheduler()
+    tier = scheduler._tiers['llm_fallback']
+    assert tier.try_acquire()
+
+    with tier.condition:
+        tier.waiting = tier.max_queue
+    try:
+        tier.acquire()
+        raise AssertionError("預期佇列已滿")
+    except SchedulerRejected as e:
+        print(f"✅ PASS | 佇列已滿: {e}")
+        assert e.reason == 'queue_full'
+    finally:
+        with tier.condition:
+            tier.waiting = 0
+        tier.release()
+
+    assert scheduler.get_stats()['llm_fallback']['rejected'] == 1
+
+
+def test_cancelled_wait_releases_slot():
+    """等待名額時被取消，背景執行緒之後取得的名額會被釋放"""
+    print("\n🛑 測試等待中取消\n")
+    scheduler = make_scheduler()
+    tier = scheduler._tiers['direct_command']
+    assert tier.try_acquire() and tier.try_acquire()
+
+    async def scenario():
+        entered = []
+
+        async def wait_for_slot():
+            async with scheduler.slot('direct_command'):
+                entered.append(True)
+
+        task = asyncio.ensure_future(wait_for_slot())
+        await asyncio.sleep(0.05)
+        assert scheduler.get_stats()['direct_command']['waiting'] == 1
+        task.cancel()
+        try:
+            await task
+            raise AssertionError("預期等待被取消")
+        except asyncio.CancelledError:
+            pass
+
+        # 佔用者釋放後，背景執行緒取得名額並立即歸還
+        tier.release()
+        for _ in range(100):
+            stats = scheduler.get_stats()['direct_command']
+            if stats['waiting'] == 0 and stats['active'] == 1:
+                break
+            await asyncio.sleep(0.01)
+        return entered
+
+    assert asyncio.run(scenario()) == []
+    tier.release()
+    stats = scheduler.get_stats()['direct_command']
+    print(f"  統計: {stats}")
+    assert stats['active'] == 0 and stats['waiting'] == 0
+    assert tier.try_acquire() and tier.try_acquire()
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("分級排程器測試")
+    print("=" * 60)
+    test_tiers_are_isolated()
+    test_wait_and_timeout()
+    test_queue_full()
+    test_cancelled_wait_releases_slot()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
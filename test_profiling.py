@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+效能剖析測試腳本
+
+驗證取樣剖析器的 collapsed stack 輸出與互斥，以及處理器的抽樣 cProfile。
+"""
+
+import sys
+import os
+import asyncio
+import threading
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from command_registry import CommandRegistry
+from profiling import HandlerProfiler, ProfilerBusy, SamplingProfiler
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+def test_sampling_profiler():
+    """只記錄指定的執行緒，輸出 root → leaf 的 collapsed stack"""
+    print("🔥 測試取樣剖析\n")
+    profiler = SamplingProfiler(max_seconds=1)
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name='profiled-worker')
+    worker.start()
+    try:
+        stacks = profiler.sample(0.2, interval=0.005, thread_prefix='profiled-worker')
+    finally:
+        stop.set()
+        worker.join()
+
+    output = profiler.collapse(stacks)
+    print(output.splitlines()[0][:120])
+    assert stacks and sum(stacks.values()) >= 5
+    for line in output.splitlines():
+        stack, count = line.rsplit(' ', 1)
+        frames = stack.split(';')
+        assert frames[0] == 'profiled-worker' and int(count) > 0
+    assert any('test_profiling.py:busy_loop' in stack for stack in stacks)
+
+
+def test_sampling_profiler_limits():
+    """秒數受上限約束、非法數值不會無限取樣，同時只允許一個剖析"""
+    print("\n⛔ 測試取樣限制\n")
+    profiler = SamplingProfiler(max_seconds=0.05)
+    assert profiler.sample(float('nan')) is not None
+    assert profiler.sample(3600, interval=0.01) is not None  # 被夾在 0.05 秒
+
+    profiler._running.acquire()
+    try:
+        profiler.sample(0.01)
+        assert False, "應拋出 ProfilerBusy"
+    except ProfilerBusy:
+        pass
+    finally:
+        profiler._running.release()
+
+
+def test_handler_profiler():
+    """抽中的處理器呼叫以 cProfile 剖析並依名稱累積；關閉時不剖析"""
+    print("\n🧪 測試處理器剖析\n")
+    registry = CommandRegistry()
+
+    async def handle_help(user_id, args, reply_token):
+        return sum(i * i for i in range(10000))
+
+    spec = registry.register('help', handle_help, commands=['/說明'])
+
+    import command_registry
+    original = command_registry.handler_profiler
+    try:
+        command_registry.handler_profiler = HandlerProfiler(sample_rate=1.0, enabled=True)
+        for _ in range(2):
+            asyncio.run(registry.dispatch(spec, 'U1', '', 'token'))
+        profiler = command_registry.handler_profiler
+        report = profiler.report(sort='cumulative', limit=20)
+        print(report[:300])
+        assert profiler.get_stats()['profiled_calls'] == {'help': 2}
+        assert '=== help（剖析 2 次）===' in report and 'handle_help' in report
+
+        profiler.reset()
+        assert profiler.report() == ''
+
+        command_registry.handler_profiler = HandlerProfiler(sample_rate=1.0, enabled=False)
+        asyncio.run(registry.dispatch(spec, 'U1', '', 'token'))
+        assert command_registry.handler_profiler.start() is None
+        assert command_registry.handler_profiler.get_stats()['profiled_calls'] == {}
+    finally:
+        command_registry.handler_profiler = original
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("效能剖析測試")
+    print("=" * 60)
+    test_sampling_profiler()
+    test_sampling_profiler_limits()
+    test_handler_profiler()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
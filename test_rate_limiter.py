@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+速率限制測試腳本
+
+驗證 token bucket 的消耗、補充與統計（記憶體模式）。
+"""
+
+import sys
+import os
+from unittest import mock
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from rate_limiter import RateLimiter, BucketRule, MemoryBucketStore
+
+
+def make_limiter(burst=2, per_minute=60):
+    rules = {
+        'user': BucketRule(burst, per_minute),
+        'group': BucketRule(burst, per_minute),
+        'command': BucketRule(1, per_minute),
+    }
+    return RateLimiter(rules=rules, backend='memory', enabled=True)
+
+
+def test_burst_then_throttle():
+    """測試容量用完後被限流"""
+    print("🪣 測試容量耗盡\n")
+    with mock.patch('rate_limiter.time.monotonic', return_value=1000.0):
+        limiter = make_limiter(burst=2)
+        results = [limiter.allow('user', 'U1') for _ in range(3)]
+    print(f"  連續三則訊息: {results}")
+    assert results == [True, True, False]
+
+    stats = limiter.get_stats()
+    print(f"  統計: {stats}")
+    assert stats['checked']['user'] == 3
+    assert stats['throttled']['user'] == 1
+
+
+def test_refill():
+    """測試時間經過後補充 token"""
+    print("\n⏳ 測試補充\n")
+    limiter = make_limiter(burst=1, per_minute=60)  # 每秒補充一個
+    with mock.patch('rate_limiter.time.monotonic', return_value=1000.0):
+        assert limiter.allow('user', 'U1') is True
+        assert limiter.allow('user', 'U1') is False
+    with mock.patch('rate_limiter.time.monotonic', return_value=1001.5):
+        assert limiter.allow('user', 'U1') is True
+    print("✅ PASS | 經過 1.5 秒後恢復")
+
+
+def test_keys_are_independent():
+    """測試不同用戶與範圍互不影響"""
+    print("\n🔑 測試獨立的 bucket\n")
+    with mock.patch('rate_limiter.time.monotonic', return_value=1000.0):
+        limiter = make_limiter(burst=1)
+        assert limiter.allow('user', 'U1') is True
+        assert limiter.allow('user', 'U2') is True
+        assert limiter.allow('group', 'U1') is True
+        assert limiter.allow('user', 'U1') is False
+    print("✅ PASS | 各 bucket 獨立計算")
+
+
+def test_disabled_and_notice_cooldown():
+    """測試關閉限流與提醒冷卻"""
+    print("\n🔕 測試關閉與提醒冷卻\n")
+    limiter = RateLimiter(rules={'user': BucketRule(0, 0)}, backend='memory', enabled=False)
+    assert limiter.allow('user', 'U1') is True
+
+    limiter = make_limiter()
+    assert limiter.should_notify('user:U1') is True
+    assert limiter.should_notify('user:U1') is False
+    assert limiter.should_notify('user:U2') is True
+    print("✅ PASS | 同一 key 冷卻期間只提醒一次")
+
+
+def test_prune_window_and_size_limit():
+    """閒置移除的時間依規則的補滿時間計算；數量超過上限時移除最久未更新的 bucket"""
+    print("\n🧹 測試 bucket 移除\n")
+    # 每 20 分鐘補充一個：被限流後 10 分鐘仍未補滿
+    limiter = RateLimiter(rules={'user': BucketRule(1, 0.05)}, backend='memory', enabled=True)
+    assert limiter.store.idle_seconds == 1200
+    with mock.patch('rate_limiter.time.monotonic', return_value=1000.0):
+        assert limiter.allow('user', 'U1') is True
+        assert limiter.allow('user', 'U1') is False
+    with mock.patch('rate_limiter.time.monotonic', return_value=1700.0):
+        assert limiter.allow('user', 'U2') is True  # 新 key 觸發移除
+        assert limiter.allow('user', 'U1') is False
+    with mock.patch('rate_limiter.time.monotonic', return_value=4000.0):
+        assert limiter.allow('user', 'U3') is True
+    assert len(limiter.store) == 1  # U1、U2 已補滿而被移除
+    print("✅ PASS | 未補滿的 bucket 不會被提前移除")
+
+    store = MemoryBucketStore(idle_seconds=float('inf'), max_keys=3)
+    rule = BucketRule(1, 0)
+    with mock.patch('rate_limiter.time.monotonic', return_value=1000.0):
+        for key in ('a', 'b', 'c', 'd', 'e'):
+            store.consume(key, rule)
+        assert store.consume('c', rule) is False
+        assert store.consume('a', rule) is True  # 已被移除，視同新的 bucket
+    print(f"  數量: {len(store)}，提前移除: {store.evicted}")
+    assert len(store) == 3 and store.evicted == 3
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("速率限制測試")
+    print("=" * 60)
+    test_burst_then_throttle()
+    test_refill()
+    test_keys_are_independent()
+    test_disabled_and_notice_cooldown()
+    test_prune_window_and_size_limit()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
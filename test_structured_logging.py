@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+結構化日誌測試腳本
+
+驗證 JSON 格式與 extra 欄位、經由佇列的非同步輸出、抽樣與用戶內容遮蔽。
+"""
+
+import sys
+import os
+import io
+import json
+import logging
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import structured_logging
+from structured_logging import JsonFormatter, SamplingFilter, setup_logging, stop_logging, user_content
+from tracing import Tracer
+
+
+def make_record(level=logging.INFO, msg="收到訊息", **extra):
+    record = logging.LogRecord('linebot', level, __file__, 1, msg, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_json_formatter():
+    """一行 JSON，包含 extra 欄位"""
+    print("🧾 測試 JSON 格式\n")
+    line = JsonFormatter().format(make_record(user_id='U1', text='<已遮蔽 3 字>'))
+    print(f"  {line}")
+    data = json.loads(line)
+    assert data['level'] == 'INFO' and data['logger'] == 'linebot' and data['msg'] == '收到訊息'
+    assert data['user_id'] == 'U1' and data['text'] == '<已遮蔽 3 字>'
+
+
+def test_sampling_filter():
+    """標記 sampled 的紀錄依比例保留，警告以上與未標記者一律保留"""
+    print("\n🎲 測試抽樣\n")
+    never = SamplingFilter(0.0)
+    assert never.filter(make_record()) is True
+    assert never.filter(make_record(sampled=True)) is False
+    assert never.filter(make_record(logging.WARNING, sampled=True)) is True
+    assert SamplingFilter(1.0).filter(make_record(sampled=True)) is True
+
+
+def test_user_content():
+    """用戶內容預設只記長度，truncate 模式截斷"""
+    print("\n🙈 測試用戶內容遮蔽\n")
+    assert user_content('我的電話是0912345678', mode='redact') == '<已遮蔽 15 字>'
+    assert user_content('abcdefgh', mode='truncate', max_chars=3) == 'abc…'
+    assert user_content('abc', mode='full') == 'abc'
+    assert user_content(None) is None
+
+
+def test_queue_output():
+    """紀錄經由背景執行緒寫出，stop_logging 後全部送出"""
+    print("\n📤 測試佇列輸出\n")
+    stop_logging()
+    stream = io.StringIO()
+    setup_logging(level='INFO', log_format='json', sample_rate=1.0, stream=stream)
+    try:
+        logger = logging.getLogger('linebot.test')
+        logger.debug("不會輸出")
+        logger.info("n8n 工作流觸發成功 %s", 'image_generation', extra={'status': 200})
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("處理失敗")
+    finally:
+        stop_logging()
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    print(f"  輸出 {len(lines)} 行")
+    assert [line['msg'] for line in lines] == ['n8n 工作流觸發成功 image_generation', '處理失敗']
+    assert lines[0]['status'] == 200
+    assert 'ValueError: boom' in lines[1]['exc']
+    assert structured_logging._listener is None
+
+
+def test_trace_context_on_all_loggers():
+    """非 linebot 的模組 logger 在 trace 中寫出的紀錄也帶有 trace_id / span_id"""
+    print("\n🔗 測試日誌附上 trace\n")
+    stop_logging()
+    stream = io.StringIO()
+    setup_logging(level='INFO', log_format='json', sample_rate=1.0, stream=stream)
+    tracer = Tracer(sample_rate=0.0, exporter=None)
+    try:
+        with tracer.start_trace('line.event') as root:
+            with tracer.span('line.api') as span:
+                logging.getLogger('line_dispatcher').warning("LINE API 重試")
+        logging.getLogger('rate_limiter').warning("沒有 trace")
+    finally:
+        stop_logging()
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    print(f"  {lines[0]}")
+    assert lines[0]['logger'] == 'line_dispatcher'
+    assert lines[0]['trace_id'] == root.trace_id and lines[0]['span_id'] == span.span_id
+    assert 'trace_id' not in lines[1]
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("結構化日誌測試")
+    print("=" * 60)
+    test_json_formatter()
+    test_sampling_filter()
+    test_user_content()
+    test_queue_output()
+    test_trace_context_on_all_loggers()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+任務狀態儲存測試腳本
+
+以 SQLite 記憶體資料庫驗證任務建立、批次狀態更新與 /查詢狀態 的查詢結果。
+"""
+
+import sys
+import os
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+from models import UserTask
+from task_store import TaskStore, TaskUpdateError, format_task_status
+
+
+def make_store():
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    UserTask.__table__.create(engine)
+    return TaskStore(engine_factory=lambda: engine)
+
+
+def test_create_and_query():
+    """建立的任務依建立時間由新到舊列出"""
+    print("📝 測試建立與查詢任務\n")
+    store = make_store()
+    first = store.create_task('U1', 'image_generation', {'prompt': '一隻龍'})
+    second = store.create_task('U1', 'rss_analysis', {'url': 'https://example.com/rss'})
+    store.create_task('U2', 'rss_analysis')
+
+    tasks = store.get_recent_tasks('U1')
+    print(f"  任務: {tasks}")
+    assert first and second and first != second
+    assert [task['task_key'] for task in tasks] == [second, first]
+    assert all(task['status'] == 'pending' for task in tasks)
+
+
+def test_bulk_updates():
+    """批次更新：已知任務更新、n8n 自建任務新增、已取消任務不被覆寫"""
+    print("\n🔄 測試批次狀態更新\n")
+    store = make_store()
+    running = store.create_task('U1', 'image_generation')
+    cancelled = store.create_task('U1', 'rss_analysis')
+    store.apply_updates([{'task_id': cancelled, 'status': 'cancelled'}])
+
+    summary = store.apply_updates([
+        {'task_id': running, 'status': 'running', 'message': '生成中'},
+        {'task_id': running, 'status': 'completed', 'message': '已寄出 Email', 'result': {'url': 'x'}},
+        {'task_id': cancelled, 'status': 'completed'},
+        {'task_id': 'n8n-1', 'status': 'running', 'user_id': 'U1', 'task_type': 'llm_analysis'},
+        {'task_id': 'missing', 'status': 'failed'},
+    ])
+    print(f"  摘要: {summary}")
+    assert summary == {'received': 5, 'updated': 1, 'inserted': 1, 'skipped_cancelled': 1, 'unknown': 1}
+
+    tasks = {task['task_key']: task for task in store.get_recent_tasks('U1')}
+    assert tasks[running]['status'] == 'completed'
+    assert tasks[running]['status_message'] == '已寄出 Email'
+    assert tasks[running]['completed_at'] is not None
+    assert tasks[cancelled]['status'] == 'cancelled'
+    assert tasks['n8n-1']['status'] == 'running'
+
+
+def test_invalid_update():
+    """無效的狀態或缺少 task_id 時整批拒絕"""
+    print("\n🚫 測試無效更新\n")
+    store = make_store()
+    for updates in ([{'status': 'running'}], [{'task_id': 'x', 'status': 'done'}]):
+        try:
+            store.apply_updates(updates)
+            raise AssertionError(f"預期拒絕: {updates}")
+        except TaskUpdateError as e:
+            print(f"✅ PASS | {e}")
+
+
+def test_cancel_tasks():
+    """取消只影響本人進行中的任務；指定 task_id 時只取消該任務"""
+    print("\n🛑 測試取消任務\n")
+    store = make_store()
+    first = store.create_task('U1', 'image_generation')
+    second = store.create_task('U1', 'rss_analysis')
+    done = store.create_task('U1', 'rss_analysis')
+    other = store.create_task('U2', 'image_generation')
+    store.apply_updates([{'task_id': done, 'status': 'completed'}])
+
+    assert store.cancel_tasks('U2', first) == []
+    assert [task['task_key'] for task in store.cancel_tasks('U1', first)] == [first]
+    cancelled = store.cancel_tasks('U1')
+    print(f"  取消: {cancelled}")
+    assert [task['task_key'] for task in cancelled] == [second]
+
+    statuses = {task['task_key']: task['status'] for task in store.get_recent_tasks('U1')}
+    assert statuses == {first: 'cancelled', second: 'cancelled', done: 'completed'}
+    assert store.get_recent_tasks('U2')[0]['task_key'] == other
+    assert store.get_recent_tasks('U2')[0]['status'] == 'pending'
+
+
+def test_format_status():
+    """回覆文字包含狀態與進度說明"""
+    print("\n💬 測試回覆文字\n")
+    store = make_store()
+    task_id = store.create_task('U1', 'image_generation')
+    store.apply_updates([{'task_id': task_id, 'status': 'running', 'message': '生成中'}])
+    text = format_task_status(store.get_recent_tasks('U1'))
+    print(text)
+    assert '🔄 處理中 圖片生成' in text and '生成中' in text
+    assert format_task_status([]) == "📋 目前沒有任務紀錄"
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("任務狀態儲存測試")
+    print("=" * 60)
+    test_create_and_query()
+    test_bulk_updates()
+    test_invalid_update()
+    test_cancel_tasks()
+    test_format_status()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
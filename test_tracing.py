@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+請求追蹤測試腳本
+
+驗證 span 的父子關係與 contextvars 傳遞、traceparent 解析與接續、
+抽樣，以及以本機 HTTP 伺服器代替 collector 的 OTLP/HTTP JSON 匯出。
+"""
+
+import sys
+import os
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from tracing import (
+    NOOP_SPAN, OtlpHttpExporter, TraceContextFilter, Tracer, bind, current_trace_id,
+    parse_traceparent, trace_headers
+)
+
+
+class RecordingExporter:
+    """記錄交給 exporter 的 span"""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def get_stats(self):
+        return {'exported': len(self.spans)}
+
+
+def test_span_tree():
+    """子 span 沿用 trace_id 並指向父 span；結束後恢復上一層"""
+    print("🌳 測試 span 父子關係\n")
+    exporter = RecordingExporter()
+    tracer = Tracer(sample_rate=1.0, exporter=exporter)
+
+    assert current_trace_id() is None
+    with tracer.span('orphan') as span:
+        assert span is NOOP_SPAN  # 沒有 trace 時不記錄
+
+    with tracer.start_trace('line.event', user_id='U1') as root:
+        with tracer.span('dialogflow.detect_intent') as child:
+            assert current_trace_id() == root.trace_id
+            assert trace_headers() == {'traceparent': child.traceparent}
+        try:
+            with tracer.span('n8n.post'):
+                raise RuntimeError('boom')
+        except RuntimeError:
+            pass
+    assert current_trace_id() is None
+
+    names = [span.name for span in exporter.spans]
+    print(f"  匯出: {names}")
+    assert names == ['dialogflow.detect_intent', 'n8n.post', 'line.event']
+    child, failed, root = exporter.spans
+    assert child.trace_id == root.trace_id and child.parent_id == root.span_id
+    assert root.parent_id is None and root.attributes == {'user_id': 'U1'}
+    assert failed.error == 'RuntimeError: boom'
+    assert root.end_ns >= child.end_ns >= child.start_ns >= root.start_ns
+
+
+def test_traceparent():
+    """合法的 traceparent 接續上游 trace 與抽樣決定，格式不符則開始新的 trace"""
+    print("\n🔗 測試 traceparent\n")
+    upstream = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+    assert parse_traceparent(upstream) == ('0af7651916cd43dd8448eb211c80319c', 'b7ad6b7169203331', True)
+    assert parse_traceparent('00-' + '0' * 32 + '-b7ad6b7169203331-01') is None
+    assert parse_traceparent('garbage') is None
+
+    exporter = RecordingExporter()
+    tracer = Tracer(sample_rate=0.0, exporter=exporter)
+    with tracer.start_trace('n8n.reply', traceparent=upstream) as span:
+        assert span.trace_id == '0af7651916cd43dd8448eb211c80319c'
+        assert span.parent_id == 'b7ad6b7169203331'
+        assert span.traceparent.endswith('-01')
+    with tracer.start_trace('n8n.reply', traceparent='garbage') as span:
+        assert span.trace_id != '0af7651916cd43dd8448eb211c80319c'
+    assert [span.name for span in exporter.spans] == ['n8n.reply']
+
+
+def test_sampling():
+    """未抽中的 trace 仍有 trace_id 可傳遞，但不匯出；link 沿用觸發者的抽樣決定"""
+    print("\n🎲 測試抽樣\n")
+    exporter = RecordingExporter()
+    tracer = Tracer(sample_rate=0.0, exporter=exporter)
+    with tracer.start_trace('line.webhook') as webhook:
+        with tracer.start_trace('line.event', link=webhook) as event:
+            with tracer.span('db.registration_check'):
+                assert current_trace_id() == event.trace_id
+    assert event.trace_id != webhook.trace_id
+    assert not event.sampled and event.traceparent.endswith('-00')
+    assert exporter.spans == []
+    stats = tracer.get_stats()
+    print(f"  統計: {stats}")
+    assert stats['traces'] == 2 and stats['sampled_traces'] == 0
+
+    tracer.sample_rate = 1.0
+    with tracer.start_trace('line.webhook') as webhook:
+        with tracer.start_trace('line.event', link=webhook) as event:
+            pass
+    assert event.links == [(webhook.trace_id, webhook.span_id)]
+    assert [span.name for span in exporter.spans] == ['line.event', 'line.webhook']
+
+
+def test_bind_and_log_filter():
+    """bind() 把 trace 帶到其他執行緒；日誌紀錄附上 trace_id"""
+    print("\n🧵 測試跨執行緒與日誌\n")
+    tracer = Tracer(sample_rate=1.0, exporter=RecordingExporter())
+    seen = {}
+
+    def on_flush():
+        seen['trace_id'] = current_trace_id()
+        record = logging.LogRecord('linebot', logging.INFO, __file__, 1, '合併訊息', None, None)
+        TraceContextFilter().filter(record)
+        seen['record_trace_id'] = record.trace_id
+
+    with tracer.start_trace('line.event') as span:
+        bound = bind(on_flush)
+    thread = threading.Thread(target=bound)
+    thread.start()
+    thread.join()
+    assert seen == {'trace_id': span.trace_id, 'record_trace_id': span.trace_id}
+
+
+def test_otlp_export():
+    """以本機 HTTP 伺服器代替 collector，驗證 OTLP/HTTP JSON 內容"""
+    print("\n📤 測試 OTLP 匯出\n")
+    received = []
+
+    class CollectorStandIn(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            received.append((self.path, json.loads(body)))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), CollectorStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        exporter = OtlpHttpExporter(f'http://127.0.0.1:{server.server_port}', service_name='line-bot-test')
+        tracer = Tracer(sample_rate=1.0, exporter=exporter)
+        with tracer.start_trace('line.event', user_id='U1'):
+            with tracer.span('line.api', endpoint='/v2/bot/message/reply') as span:
+                span.set_attribute('status', 200)
+        assert exporter.flush()
+    finally:
+        server.shutdown()
+
+    path, payload = received[0]
+    resource = payload['resourceSpans'][0]
+    spans = resource['scopeSpans'][0]['spans']
+    print(f"  {path}: {[span['name'] for span in spans]}")
+    assert path == '/v1/traces'
+    assert resource['resource']['attributes'][0]['value'] == {'stringValue': 'line-bot-test'}
+    api, event = spans
+    assert api['parentSpanId'] == event['spanId'] and api['traceId'] == event['traceId']
+    assert {'key': 'status', 'value': {'intValue': '200'}} in api['attributes']
+    assert 'parentSpanId' not in event
+    assert int(event['endTimeUnixNano']) >= int(event['startTimeUnixNano'])
+    assert exporter.get_stats()['exported'] == 2
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("請求追蹤測試")
+    print("=" * 60)
+    test_span_tree()
+    test_traceparent()
+    test_sampling()
+    test_bind_and_log_filter()
+    test_otlp_export()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
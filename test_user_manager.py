@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+用戶管理測試腳本
+
+以 SQLite 記憶體資料庫驗證註冊結果與衝突判斷（PostgreSQL 使用單一 upsert 語句，
+SQLite 走相同結果對應的備援路徑）。
+"""
+
+import sys
+import os
+import re
+from contextlib import contextmanager
+
+# 添加專案根目錄到 Python 路徑
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.pool import StaticPool
+
+import models
+from user_stats import UserStatsService
+from user_manager import (
+    UserManager, BATCH_METADATA_UPDATE, REGISTER_CREATED, REGISTER_LINE_ID_EXISTS, REGISTER_EMAIL_EXISTS,
+    build_search_query
+)
+
+PROFILE = {
+    'name': '王小明',
+    'english_name': 'Ming',
+    'department': '編輯部',
+    'mobile': '0912345678',
+    'extension': '#123',
+}
+
+
+@contextmanager
+def sqlite_database():
+    """暫時以 SQLite 記憶體資料庫取代 models 的引擎"""
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    models.Base.metadata.create_all(engine)
+    original = models._engine
+    models._engine = engine
+    try:
+        yield engine
+    finally:
+        models._engine = original
+        engine.dispose()
+
+
+def test_register_conflicts():
+    """重複的 LINE ID 與 email 分別回報"""
+    print("📝 測試註冊衝突判斷\n")
+    with sqlite_database():
+        manager = UserManager()
+        results = [
+            manager.register_user(line_id='U1', email='ming@example.com', **PROFILE),
+            manager.register_user(line_id='U1', email='other@example.com', **PROFILE),
+            manager.register_user(line_id='U2', email='ming@example.com', **PROFILE),
+        ]
+        print(f"  結果: {results}")
+        assert results == [REGISTER_CREATED, REGISTER_LINE_ID_EXISTS, REGISTER_EMAIL_EXISTS]
+        assert manager.get_user_by_line_id('U1')['email'] == 'ming@example.com'
+        assert manager.get_user_by_line_id('U2') is None
+
+
+def test_iter_and_search_users():
+    """串流列表與 keyset 分頁搜尋"""
+    print("\n🔎 測試用戶列表與搜尋分頁\n")
+    with sqlite_database():
+        manager = UserManager()
+        for i in range(5):
+            profile = dict(PROFILE, name=f'王{i}')
+            manager.add_user(line_id=f'U{i}', email=f'u{i}@example.com', role='editor', **profile)
+        manager.add_user(line_id='U9', email='x_y@example.com', **dict(PROFILE, name='李四'))
+
+        users = list(manager.iter_users(batch_size=2))
+        assert [u['line_id'] for u in users] == ['U0', 'U1', 'U2', 'U3', 'U4', 'U9']
+        assert users[0]['role'] == 'editor'
+        assert manager.get_all_users() == users
+        raw = next(manager.iter_users(raw=True))
+        assert raw['user_metadata'] == {'role': 'editor'} and raw['created_at'] is not None
+
+        first = manager.search_users('王', limit=2)
+        second = manager.search_users('王', limit=2, after=first[-1]['line_id'])
+        print(f"  第一頁: {[u['line_id'] for u in first]}，第二頁: {[u['line_id'] for u in second]}")
+        assert [u['line_id'] for u in first + second] == ['U0', 'U1', 'U2', 'U3']
+        assert second[0]['role'] == 'editor'
+        # 不傳 after 時以 limit/offset 分頁，並比對英文名與單位
+        assert [u['line_id'] for u in manager.search_users('王', limit=2, offset=2)] == ['U2', 'U3']
+        assert len(manager.search_users('ming', limit=10)) == 6
+        assert len(manager.search_users('編輯')) == 6
+        # LIKE 萬用字元視為一般字元
+        assert [u['line_id'] for u in manager.search_users('x_y')] == ['U9']
+        assert manager.search_users('u_@') == []
+
+
+@contextmanager
+def postgresql_lookalike(engine):
+    """
+    讓 SQLite 引擎回報為 postgresql，並建立空的 pg_extension / pg_trigger 表，
+    模擬無法 CREATE EXTENSION 或建立觸發器的託管資料庫
+    """
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE pg_extension (extname TEXT)")
+        conn.exec_driver_sql("CREATE TABLE pg_trigger (tgname TEXT, tgenabled TEXT)")
+    engine.dialect.name = 'postgresql'
+    models._feature_cache.clear()
+    try:
+        yield
+    finally:
+        del engine.dialect.name
+        models._feature_cache.clear()
+
+
+def test_search_without_pg_trgm():
+    """PostgreSQL 上沒有 pg_trgm 時退回 ILIKE 搜尋，而不是每次搜尋都失敗"""
+    print("\n🧩 測試缺少 pg_trgm 時的搜尋\n")
+    with sqlite_database() as engine:
+        manager = UserManager()
+        manager.add_user(line_id='U1', email='a@example.com', **PROFILE)
+        manager.add_user(line_id='U2', email='b@example.com', **dict(PROFILE, name='李四'))
+        with postgresql_lookalike(engine):
+            assert models.has_database_feature(engine, 'pg_trgm') is False
+            results = manager.search_users('王')
+            print(f"  結果: {[u['line_id'] for u in results]}")
+            assert [u['line_id'] for u in results] == ['U1']
+
+            # 檢查結果會快取：之後新增擴充也要等重新遷移或重啟才改用相似度排序
+            with engine.begin() as conn:
+                conn.exec_driver_sql("INSERT INTO pg_extension VALUES ('pg_trgm')")
+            assert models.has_database_feature(engine, 'pg_trgm') is False
+            models._feature_cache.clear()
+            assert models.has_database_feature(engine, 'pg_trgm') is True
+
+
+def test_statistics_without_trigger():
+    """PostgreSQL 上沒有統計觸發器時改為直接彙總 line_users，而不是讀取未維護的彙總表"""
+    print("\n🧮 測試缺少統計觸發器時的彙總\n")
+    with sqlite_database() as engine:
+        manager = UserManager()
+        manager.add_user(line_id='U1', email='a@example.com', **PROFILE)
+        manager.add_user(line_id='U2', email='b@example.com', **dict(PROFILE, department='業務部'))
+        with postgresql_lookalike(engine):
+            assert models.has_database_feature(engine, 'user_stats_trigger') is False
+            stats = UserStatsService(ttl_seconds=0).get()
+            print(f"  統計: {stats}")
+            assert stats['total_users'] == 2
+            assert stats['departments'] == {'編輯部': 1, '業務部': 1}
+
+
+def test_statistics_cache():
+    """統計依單位彙總，本行程寫入後清除快取"""
+    print("\n📊 測試用戶統計\n")
+    with sqlite_database() as engine:
+        manager = UserManager()
+        manager.add_user(line_id='U1', email='a@example.com', **PROFILE)
+        manager.add_user(line_id='U2', email='b@example.com', **dict(PROFILE, department='業務部'))
+        stats = manager.get_statistics()
+        print(f"  統計: {stats}")
+        assert stats['total_users'] == 2
+        assert stats['departments'] == {'編輯部': 1, '業務部': 1}
+        assert stats['latest_user_created'] is not None
+
+        # 其他行程直接寫入的資料在 TTL 內不會反映
+        with engine.begin() as conn:
+            conn.execute(models.User.__table__.insert().values(line_id='U3', email='c@example.com'))
+        assert manager.get_statistics()['total_users'] == 2
+
+        manager.delete_user('U1')
+        stats = manager.get_statistics()
+        assert stats['total_users'] == 2
+        assert stats['departments'] == {'': 1, '業務部': 1}
+
+
+def test_update_user_metadata():
+    """局部更新 user_metadata（單筆與批次），保留未提及的鍵"""
+    print("\n✏️ 測試 user_metadata 局部更新\n")
+    with sqlite_database():
+        manager = UserManager()
+        manager.add_user(line_id='U1', email='a@example.com', role='editor', **PROFILE)
+        manager.add_user(line_id='U2', email='b@example.com', **PROFILE)
+
+        assert manager.update_user('U1', name='新名字', theme='dark') is True
+        user = manager.get_user_by_line_id('U1')
+        print(f"  U1: {user}")
+        assert user['name'] == '新名字' and user['role'] == 'editor' and user['theme'] == 'dark'
+        assert manager.update_user('U404', theme='dark') is False
+
+        updated = manager.update_users_metadata({'U1': {'role': 'admin'}, 'U2': {'team': 'A'}, 'U404': {'x': 1}})
+        assert updated == 2
+        assert manager.get_user_by_line_id('U1')['role'] == 'admin'
+        assert manager.get_user_by_line_id('U1')['theme'] == 'dark'
+        assert manager.get_user_by_line_id('U2')['team'] == 'A'
+
+
+def compile_postgresql(stmt) -> str:
+    """以 PostgreSQL 方言編譯語句（不需連線），回傳單行 SQL；去掉參數後的型別轉換方便比對"""
+    sql = ' '.join(str(stmt.compile(dialect=postgresql.dialect())).split())
+    return re.sub(r'(%\(\w+\)s)::[A-Z ]+?(?=[,)]|$)', r'\1', sql)
+
+
+def test_postgresql_statements():
+    """SQLite 測試走不到的 PostgreSQL 專用語句：以 postgresql 方言編譯並檢查 SQL"""
+    print("\n🐘 測試 PostgreSQL 語句編譯\n")
+    values = {'line_id': 'U1', 'email': 'a@example.com', 'name': '王小明', 'user_metadata': {}}
+    sql = compile_postgresql(UserManager._register_statement(values))
+    print(f"  register: {sql}")
+    assert sql.startswith('WITH inserted AS (INSERT INTO line_users')
+    assert 'ON CONFLICT DO NOTHING RETURNING line_users.line_id' in sql
+    assert 'EXISTS (SELECT inserted.line_id FROM inserted) AS created' in sql
+    assert 'line_users.line_id = %(line_id_1)s) AS line_id_taken' in sql
+    assert 'line_users.email = %(email_1)s) AS email_taken' in sql
+
+    stmt = UserManager._update_statement('U1', {'name': '新名字'}, {'theme': 'dark'})
+    assert isinstance(stmt.compile(dialect=postgresql.dialect()).binds['patch'].type, postgresql.JSONB)
+    sql = compile_postgresql(stmt)
+    print(f"  update_user: {sql}")
+    assert sql.startswith('UPDATE line_users SET name=%(name)s')
+    assert "user_metadata=(coalesce(line_users.user_metadata, '{}'::jsonb) || %(patch)s)" in sql
+    assert sql.endswith('WHERE line_users.line_id = %(line_id_1)s')
+    # 沒有額外參數時不動 user_metadata
+    assert 'user_metadata' not in compile_postgresql(UserManager._update_statement('U1', {'name': 'x'}, {}))
+
+    compiled = BATCH_METADATA_UPDATE.compile(dialect=postgresql.dialect())
+    sql = ' '.join(str(compiled).split())
+    print(f"  update_users_metadata: {sql}")
+    assert "coalesce(u.user_metadata, '{}'::jsonb) || p.value" in sql
+    # JSONB 型別的參數會加上 ::JSONB，jsonb_each 才能展開
+    assert 'FROM jsonb_each(%(patches)s::JSONB) AS p(line_id, value)' in sql
+    assert isinstance(compiled.binds['patches'].type, postgresql.JSONB)
+
+    sql = compile_postgresql(build_search_query('王', limit=10))
+    print(f"  search: {sql}")
+    for column in ('name', 'english_name', 'email', 'department'):
+        assert f'line_users.{column} ILIKE %(' in sql
+        assert f'line_users.{column} %% %(' in sql
+        assert f'coalesce(similarity(line_users.{column}, %(' in sql
+    assert 'ORDER BY greatest(' in sql and 'DESC, line_users.line_id' in sql
+    # 非 ranked 時不使用 pg_trgm
+    sql = compile_postgresql(build_search_query('王', ranked=False, after='U1'))
+    assert 'similarity' not in sql and ' %% ' not in sql
+    assert 'line_users.line_id > %(line_id_1)s' in sql
+
+
+def main():
+    """主測試函數"""
+    print("=" * 60)
+    print("用戶管理測試")
+    print("=" * 60)
+    test_register_conflicts()
+    test_iter_and_search_users()
+    test_search_without_pg_trgm()
+    test_statistics_without_trigger()
+    test_statistics_cache()
+    test_update_user_metadata()
+    test_postgresql_statements()
+    print("\n" + "=" * 60)
+    print("測試完成！")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+請求追蹤
+
+每個 webhook 事件建立一個 trace，經 contextvars 傳遞到同一事件的資料庫查詢、
+Dialogflow、指令處理器、n8n 與 LINE API 呼叫，各自記錄為一個 span。
+trace_id 一律產生（日誌與轉發給 n8n 的 payload 可據以對照）；
+是否匯出在 trace 開始時依 TRACE_SAMPLE_RATE 決定，同一 trace 的 span 一起保留或捨棄。
+
+轉發給 n8n 時附上 W3C traceparent 標頭，n8n 回呼時帶回該標頭即可接續同一 trace。
+span 以 OTLP/HTTP JSON 格式由背景執行緒批次送到 {OTEL_EXPORTER_OTLP_ENDPOINT}/v1/traces，
+可直接使用 OpenTelemetry Collector、Jaeger 等；未設定端點時不匯出。
+佇列已滿時捨棄 span，不阻塞請求。
+
+跨執行緒（例如訊息合併的計時器）時以 bind() 帶入目前的追蹤上下文。
+
+設定（環境變數）:
+    OTEL_EXPORTER_OTLP_ENDPOINT=http://localhost:4318   # 未設定則不匯出
+    OTEL_SERVICE_NAME=line-bot
+    TRACE_SAMPLE_RATE=0.1
+    TRACE_EXPORT_BATCH_SIZE=256
+    TRACE_EXPORT_MAX_QUEUE=2048
+"""
+
+import atexit
+import contextvars
+import functools
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+# OTLP SpanKind
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+
+_TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+logger = logging.getLogger(__name__)
+
+
+def _new_id(bits: int) -> str:
+    # 全為 0 的 ID 在 W3C Trace Context 中無效
+    return f'{random.getrandbits(bits) or 1:0{bits // 4}x}'
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """解析 traceparent 標頭，回傳 (trace_id, parent_span_id, sampled)；格式不符時回傳 None"""
+    match = _TRACEPARENT_RE.match((value or '').strip().lower())
+    if not match or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+class Span:
+    """一段計時的工作；屬性在結束前都可以補上"""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'sampled', 'kind',
+                 'start_ns', 'end_ns', 'attributes', 'error', 'links')
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 kind: int = SPAN_KIND_INTERNAL, attributes: Dict = None, links: List = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = {key: value for key, value in (attributes or {}).items() if value is not None}
+        self.error = None
+        self.links = links or []
+
+    def set_attribute(self, key: str, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_error(self, message: str):
+        self.error = message
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+class _NoopSpan:
+    """沒有進行中的 trace 時使用，所有操作皆忽略"""
+
+    trace_id = None
+    traceparent = None
+    sampled = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def set_error(self, message):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('linebot_current_span', default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+def trace_headers() -> Dict[str, str]:
+    """對外呼叫時附加的 traceparent 標頭（沒有進行中的 trace 時為空）"""
+    span = _current_span.get()
+    return {'traceparent': span.traceparent} if span is not None else {}
+
+
+def bind(func):
+    """把目前的追蹤上下文帶到稍後在其他執行緒執行的函數"""
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+    return wrapper
+
+
+class TraceContextFilter(logging.Filter):
+    """在日誌紀錄加上 trace_id / span_id，方便以 trace 查詢日誌"""
+
+    def filter(self, record):
+        span = _current_span.get()
+        if span is not None:
+            record.trace_id = span.trace_id
+            record.span_id = span.span_id
+        return True
+
+
+def _attribute_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OtlpHttpExporter:
+    """以 OTLP/HTTP JSON 批次匯出 span"""
+
+    def __init__(self, endpoint: str, service_name: str = 'line-bot', batch_size: int = 256,
+                 max_queue: int = 2048, flush_interval: float = 2.0, timeout: float = 5.0):
+        endpoint = endpoint.rstrip('/')
+        self.url = endpoint if endpoint.endswith('/v1/traces') else endpoint + '/v1/traces'
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self._queue: queue.Queue = queue.Queue(max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._session = requests.Session()
+        self._stats = {'exported': 0, 'dropped': 0, 'failed': 0}
+
+    def export(self, span: Span):
+        """放入佇列後立即返回；佇列已滿時捨棄"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """送出佇列中的 span，等待完成（測試與結束時使用）"""
+        self._ensure_started()
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        pending: List[Span] = []
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval if pending else None)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, threading.Event):
+                self._send(pending)
+                pending = []
+                item.set()
+                continue
+            if item is not None:
+                pending.append(item)
+                if len(pending) < self.batch_size:
+                    continue
+            self._send(pending)
+            pending = []
+
+    def _send(self, spans: List[Span]):
+        if not spans:
+            return
+        try:
+            response = self._session.post(self.url, json=self.encode(spans), timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            with self._lock:
+                self._stats['failed'] += len(spans)
+            logger.warning("匯出 trace 失敗", extra={'spans': len(spans), 'error': str(e)})
+            return
+        with self._lock:
+            self._stats['exported'] += len(spans)
+
+    def encode(self, spans: List[Span]) -> Dict:
+        """OTLP ExportTraceServiceRequest（JSON 編碼）"""
+        return {
+            'resourceSpans': [{
+                'resource': {'attributes': [
+                    {'key': 'service.name', 'value': {'stringValue': self.service_name}}
+                ]},
+                'scopeSpans': [{
+                    'scope': {'name': 'linebot'},
+                    'spans': [self._encode_span(span) for span in spans],
+                }],
+            }]
+        }
+
+    @staticmethod
+    def _encode_span(span: Span) -> Dict:
+        data = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': span.kind,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': [
+                {'key': key, 'value': _attribute_value(value)} for key, value in span.attributes.items()
+            ],
+            'status': {'code': 2, 'message': span.error} if span.error else {'code': 0},
+        }
+        if span.parent_id:
+            data['parentSpanId'] = span.parent_id
+        if span.links:
+            data['links'] = [{'traceId': trace_id, 'spanId': span_id} for trace_id, span_id in span.links]
+        return data
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+
+def _exporter_from_env() -> Optional[OtlpHttpExporter]:
+    endpoint = os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT')
+    if not endpoint:
+        return None
+    return OtlpHttpExporter(
+        endpoint,
+        service_name=os.environ.get('OTEL_SERVICE_NAME', 'line-bot'),
+        batch_size=int(os.environ.get('TRACE_EXPORT_BATCH_SIZE', '256')),
+        max_queue=int(os.environ.get('TRACE_EXPORT_MAX_QUEUE', '2048')),
+    )
+
+
+class Tracer:
+    """建立 trace 與 span，結束時把抽中的 span 交給 exporter"""
+
+    def __init__(self, sample_rate: float = None, exporter: Optional[OtlpHttpExporter] = None):
+        self.sample_rate = sample_rate if sample_rate is not None else float(
+            os.environ.get('TRACE_SAMPLE_RATE', '0.1')
+        )
+        self.exporter = exporter if exporter is not None else _exporter_from_env()
+        self._lock = threading.Lock()
+        self._stats = {'traces': 0, 'sampled_traces': 0}
+
+    @contextmanager
+    def start_trace(self, name: str, traceparent: str = None, link: Optional[Span] = None,
+                    kind: int = SPAN_KIND_SERVER, **attributes):
+        """
+        開始新的 trace；帶有合法 traceparent 時接續上游的 trace 與抽樣決定
+        link: 觸發此 trace 的 span（例如事件所屬的 webhook 請求），沿用其抽樣決定並記錄為 link
+        """
+        parsed = parse_traceparent(traceparent)
+        links = []
+        if parsed:
+            trace_id, parent_id, sampled = parsed
+        else:
+            trace_id, parent_id = _new_id(128), None
+            if link is not None:
+                sampled = link.sampled
+                links.append((link.trace_id, link.span_id))
+            else:
+                sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+        with self._lock:
+            self._stats['traces'] += 1
+            if sampled:
+                self._stats['sampled_traces'] += 1
+        with self._activate(Span(name, trace_id, parent_id, sampled, kind, attributes, links)) as span:
+            yield span
+
+    @contextmanager
+    def span(self, name: str, kind: int = SPAN_KIND_INTERNAL, **attributes):
+        """目前 trace 底下的子 span；沒有進行中的 trace 時不記錄"""
+        parent = _current_span.get()
+        if parent is None:
+            yield NOOP_SPAN
+            return
+        with self._activate(Span(name, parent.trace_id, parent.span_id, parent.sampled, kind, attributes)) as span:
+            yield span
+
+    @contextmanager
+    def _activate(self, span: Span):
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            if span.error is None:
+                span.set_error(f'{type(e).__name__}: {e}')
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            if span.sampled and self.exporter is not None:
+                self.exporter.export(span)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['sample_rate'] = self.sample_rate
+        stats['exporting'] = self.exporter is not None
+        if self.exporter is not None:
+            stats.update({f'export_{key}': value for key, value in self.exporter.get_stats().items()})
+        return stats
+
+
+# 全局 tracer 實例
+tracer = Tracer()
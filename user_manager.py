@@ -1,15 +1,73 @@
 import logging
 from datetime import datetime
 import pytz
-from typing import Dict, Optional, List
+from typing import Dict, Iterator, Optional, List
 from sqlalchemy.orm import Session
-from models import User, get_db
-from sqlalchemy.exc import SQLAlchemyError
+from models import User, get_db, has_database_feature
+from sqlalchemy import bindparam, exists, func, or_, select, text, update
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from contextlib import contextmanager
+from user_stats import user_stats
 
 # 設定台北時區
 TAIPEI_TZ = pytz.timezone('Asia/Taipei')
 
+# register_user 的結果
+REGISTER_CREATED = 'created'
+REGISTER_LINE_ID_EXISTS = 'line_id_exists'
+REGISTER_EMAIL_EXISTS = 'email_exists'
+REGISTER_FAILED = 'failed'
+
+# 列表、搜尋與匯出讀取的欄位（只取欄位不載入 ORM 物件，串流時不佔用 identity map）
+USER_COLUMNS = (
+    User.line_id, User.name, User.english_name, User.department,
+    User.email, User.mobile, User.extension
+)
+EXPORT_COLUMNS = USER_COLUMNS + (User.created_at, User.updated_at, User.user_metadata)
+SEARCH_MAX_LIMIT = 200
+# update_user 可直接更新的欄位，其餘參數合併進 user_metadata
+PROFILE_FIELDS = ('name', 'english_name', 'department', 'email', 'mobile', 'extension')
+# 搜尋比對的欄位（PostgreSQL 上各有 pg_trgm GIN 索引，見 models.SCHEMA_MIGRATIONS）
+SEARCH_COLUMNS = (User.name, User.english_name, User.email, User.department)
+# update_users_metadata 在 PostgreSQL 上的批次語句：:patches 為 {line_id: patch} 的 JSONB
+BATCH_METADATA_UPDATE = text("""
+    UPDATE line_users AS u
+    SET user_metadata = coalesce(u.user_metadata, '{}'::jsonb) || p.value,
+        updated_at = :now
+    FROM jsonb_each(:patches) AS p(line_id, value)
+    WHERE u.line_id = p.line_id
+""").bindparams(bindparam('patches', type_=JSONB))
+
+
+def _like_pattern(query: str) -> str:
+    """轉為 ILIKE '%query%'，並跳脫使用者輸入中的萬用字元"""
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+
+def build_search_query(query: str, limit: int = 50, offset: int = 0, after: Optional[str] = None,
+                       ranked: bool = True):
+    """
+    用戶搜尋語句：任一搜尋欄位包含關鍵字，或（ranked 時）trigram 相似度超過門檻
+    ranked=True 依最高相似度排序並以 limit/offset 分頁（需 pg_trgm）；
+    否則依 line_id 排序，可傳 after（上一頁最後的 line_id）做 keyset 分頁
+    """
+    pattern = _like_pattern(query)
+    conditions = [column.ilike(pattern, escape='\\') for column in SEARCH_COLUMNS]
+    stmt = select(*USER_COLUMNS, User.user_metadata)
+    if ranked:
+        # % 運算子與 ILIKE 都能使用 trigram 索引，PostgreSQL 以 BitmapOr 合併
+        conditions += [column.bool_op('%')(query) for column in SEARCH_COLUMNS]
+        score = func.greatest(*(func.coalesce(func.similarity(column, query), 0) for column in SEARCH_COLUMNS))
+        stmt = stmt.where(or_(*conditions)).order_by(score.desc(), User.line_id)
+    else:
+        stmt = stmt.where(or_(*conditions)).order_by(User.line_id)
+        if after:
+            stmt = stmt.where(User.line_id > after)
+    return stmt.limit(max(1, min(limit, SEARCH_MAX_LIMIT))).offset(max(0, offset))
+
 class UserManager:
     """
     用戶管理系統 - PostgreSQL 版本
@@ -22,11 +80,7 @@ class UserManager:
         self._setup_logging()
     
     def _setup_logging(self):
-        """設置日誌系統"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-        )
+        """取得 logger；輸出格式與 handler 由應用程式的 structured_logging.setup_logging 統一設定"""
         self.logger = logging.getLogger('UserManager')
     
     @contextmanager
@@ -55,12 +109,96 @@ class UserManager:
                 )
                 db.add(user)
                 db.commit()
+                user_stats.invalidate()
                 self.logger.info(f"已新增用戶: {line_id}")
                 return True
         except SQLAlchemyError as e:
             self.logger.error(f"新增用戶失敗: {e}")
             return False
 
+    def register_user(self, line_id: str, name: str, english_name: str, department: str,
+                      email: str, mobile: str, extension: str, **kwargs) -> str:
+        """
+        註冊用戶：PostgreSQL 上以單一 INSERT ... ON CONFLICT DO NOTHING 完成，
+        同一語句回傳衝突的是 LINE ID 還是 email，並發送出的表單也不會得到 500
+        回傳 REGISTER_CREATED / REGISTER_LINE_ID_EXISTS / REGISTER_EMAIL_EXISTS / REGISTER_FAILED
+        """
+        now = datetime.utcnow()
+        values = {
+            'line_id': line_id,
+            'name': name,
+            'english_name': english_name,
+            'department': department,
+            'email': email,
+            'mobile': mobile,
+            'extension': extension,
+            'user_metadata': kwargs,
+            'created_at': now,
+            'updated_at': now
+        }
+        try:
+            with self._get_db() as db:
+                if db.get_bind().dialect.name == 'postgresql':
+                    result = self._register_upsert(db, values)
+                else:
+                    result = self._register_fallback(db, values)
+        except SQLAlchemyError as e:
+            self.logger.error(f"註冊用戶失敗: {e}")
+            return REGISTER_FAILED
+
+        if result == REGISTER_CREATED:
+            user_stats.invalidate()
+            self.logger.info(f"已新增用戶: {line_id}")
+        return result
+
+    @staticmethod
+    def _register_statement(values: Dict):
+        # CTE 中的 EXISTS 看到的是語句開始前的資料，正好用來判斷與哪一筆既有資料衝突
+        inserted = (
+            pg_insert(User.__table__)
+            .values(**values)
+            .on_conflict_do_nothing()
+            .returning(User.__table__.c.line_id)
+            .cte('inserted')
+        )
+        return select(
+            exists(select(inserted.c.line_id)).label('created'),
+            exists().where(User.line_id == values['line_id']).label('line_id_taken'),
+            exists().where(User.email == values['email']).label('email_taken')
+        )
+
+    @staticmethod
+    def _register_upsert(db: Session, values: Dict) -> str:
+        row = db.execute(UserManager._register_statement(values)).one()
+        db.commit()
+
+        if row.created:
+            return REGISTER_CREATED
+        if row.line_id_taken:
+            return REGISTER_LINE_ID_EXISTS
+        if row.email_taken:
+            return REGISTER_EMAIL_EXISTS
+        # 衝突的資料由同時進行的另一筆註冊寫入（語句開始時尚未提交），補查一次
+        return UserManager._conflict_reason(db, values)
+
+    @staticmethod
+    def _register_fallback(db: Session, values: Dict) -> str:
+        # 非 PostgreSQL（例如測試用 SQLite）：先寫入，違反唯一性時再判斷原因
+        try:
+            db.execute(User.__table__.insert().values(**values))
+            db.commit()
+            return REGISTER_CREATED
+        except IntegrityError:
+            db.rollback()
+            return UserManager._conflict_reason(db, values)
+
+    @staticmethod
+    def _conflict_reason(db: Session, values: Dict) -> str:
+        line_id_taken = db.execute(
+            select(exists().where(User.line_id == values['line_id']))
+        ).scalar()
+        return REGISTER_LINE_ID_EXISTS if line_id_taken else REGISTER_EMAIL_EXISTS
+
     def get_user_by_line_id(self, line_id: str) -> Optional[Dict]:
         """根據 LINE ID 獲取用戶"""
         try:
@@ -125,39 +263,77 @@ class UserManager:
             return None
 
     def update_user(self, line_id: str, **kwargs) -> bool:
-        """更新用戶資料"""
+        """
+        更新用戶資料：基本欄位直接寫入，其餘參數合併進 user_metadata
+        PostgreSQL 上以單一 UPDATE ... SET user_metadata = user_metadata || :patch 完成，不先讀出整筆資料
+        """
+        values = {field: kwargs.pop(field) for field in PROFILE_FIELDS if field in kwargs}
+        values['updated_at'] = datetime.utcnow()
         try:
             with self._get_db() as db:
-                user = db.query(User).filter(User.line_id == line_id).first()
-                if not user:
-                    return False
-
-                # 更新基本欄位
-                if 'name' in kwargs:
-                    user.name = kwargs.pop('name')
-                if 'english_name' in kwargs:
-                    user.english_name = kwargs.pop('english_name')
-                if 'department' in kwargs:
-                    user.department = kwargs.pop('department')
-                if 'email' in kwargs:
-                    user.email = kwargs.pop('email')
-                if 'mobile' in kwargs:
-                    user.mobile = kwargs.pop('mobile')
-                if 'extension' in kwargs:
-                    user.extension = kwargs.pop('extension')
-
-                # 更新其他元數據
-                if user.user_metadata is None:
-                    user.user_metadata = {}
-                user.user_metadata.update(kwargs)
-                
+                if db.get_bind().dialect.name == 'postgresql':
+                    updated = db.execute(self._update_statement(line_id, values, kwargs)).rowcount
+                else:
+                    updated = self._update_fallback(db, line_id, values, kwargs)
                 db.commit()
-                self.logger.info(f"已更新用戶: {line_id}")
-                return True
         except SQLAlchemyError as e:
             self.logger.error(f"更新用戶失敗: {e}")
             return False
 
+        if not updated:
+            return False
+        if 'department' in values:
+            user_stats.invalidate()
+        self.logger.info(f"已更新用戶: {line_id}")
+        return True
+
+    def update_users_metadata(self, patches: Dict[str, Dict]) -> int:
+        """
+        批次合併多位用戶的 user_metadata：{line_id: {key: value, ...}, ...}
+        PostgreSQL 上將所有 patch 以一個 JSONB 參數送出，由 jsonb_each 展開後單一 UPDATE 完成
+        回傳實際更新的用戶數
+        """
+        patches = {line_id: patch for line_id, patch in patches.items() if patch}
+        if not patches:
+            return 0
+        now = datetime.utcnow()
+        try:
+            with self._get_db() as db:
+                if db.get_bind().dialect.name == 'postgresql':
+                    updated = db.execute(BATCH_METADATA_UPDATE, {'patches': patches, 'now': now}).rowcount
+                else:
+                    updated = sum(
+                        self._update_fallback(db, line_id, {'updated_at': now}, patch)
+                        for line_id, patch in patches.items()
+                    )
+                db.commit()
+        except SQLAlchemyError as e:
+            self.logger.error(f"批次更新用戶失敗: {e}")
+            return 0
+        self.logger.info(f"已批次更新 {updated} 位用戶")
+        return updated
+
+    @staticmethod
+    def _update_statement(line_id: str, values: Dict, patch: Dict):
+        # PostgreSQL：以 || 在資料庫內合併 user_metadata
+        if patch:
+            values = {**values, 'user_metadata': func.coalesce(
+                User.user_metadata, text("'{}'::jsonb")
+            ).op('||')(bindparam('patch', patch, type_=JSONB))}
+        return update(User).where(User.line_id == line_id).values(**values)
+
+    @staticmethod
+    def _update_fallback(db: Session, line_id: str, values: Dict, patch: Dict) -> int:
+        # 非 PostgreSQL（例如測試用 SQLite）：在同一交易中讀出 user_metadata 合併後寫回
+        if patch:
+            current = db.execute(
+                select(User.user_metadata).where(User.line_id == line_id)
+            ).first()
+            if current is None:
+                return 0
+            values = {**values, 'user_metadata': {**(current[0] or {}), **patch}}
+        return db.execute(update(User).where(User.line_id == line_id).values(**values)).rowcount
+
     def delete_user(self, line_id: str) -> bool:
         """刪除用戶"""
         try:
@@ -166,6 +342,7 @@ class UserManager:
                 if user:
                     db.delete(user)
                     db.commit()
+                    user_stats.invalidate()
                     self.logger.info(f"已刪除用戶: {line_id}")
                     return True
                 return False
@@ -173,21 +350,49 @@ class UserManager:
             self.logger.error(f"刪除用戶失敗: {e}")
             return False
 
-    def search_users(self, query: str) -> List[Dict]:
-        """搜尋用戶"""
+    @staticmethod
+    def _row_to_dict(row) -> Dict:
+        """與 get_user_by_line_id 相同格式：基本欄位加上展開的 user_metadata"""
+        data = dict(row._mapping)
+        metadata = data.pop('user_metadata', None)
+        data.pop('created_at', None)
+        data.pop('updated_at', None)
+        return {**data, **(metadata or {})}
+
+    def iter_users(self, batch_size: int = 1000, raw: bool = False) -> Iterator[Dict]:
+        """
+        依 line_id 順序逐筆產生所有用戶，以伺服器端游標每次取 batch_size 筆
+        raw=True 時保留 user_metadata 與時間欄位（匯出用），否則格式同 get_all_users
+        """
+        query = (
+            select(*(EXPORT_COLUMNS if raw else USER_COLUMNS + (User.user_metadata,)))
+            .order_by(User.line_id)
+            .execution_options(stream_results=True, yield_per=batch_size)
+        )
         try:
             with self._get_db() as db:
-                users = db.query(User).filter(
-                    (User.name.ilike(f"%{query}%")) |
-                    (User.email.ilike(f"%{query}%"))
-                ).all()
-                
-                return [{
-                    'line_id': user.line_id,
-                    'name': user.name,
-                    'email': user.email,
-                    **user.metadata
-                } for user in users]
+                for row in db.execute(query):
+                    yield dict(row._mapping) if raw else self._row_to_dict(row)
+        except SQLAlchemyError as e:
+            self.logger.error(f"讀取用戶列表失敗: {e}")
+            raise
+
+    def search_users(self, query: str, limit: int = 50, offset: int = 0,
+                     after: Optional[str] = None) -> List[Dict]:
+        """
+        依姓名、英文名、email 或單位搜尋用戶
+        PostgreSQL 且已安裝 pg_trgm 時依 trigram 相似度排序（容許錯字），以 limit/offset 分頁；
+        傳入 after（上一頁最後一筆的 line_id）時改為依 line_id 的 keyset 分頁，適合逐頁走完所有結果
+        """
+        query = (query or '').strip()
+        if not query:
+            return []
+        try:
+            with self._get_db() as db:
+                # 沒有 pg_trgm（或非 PostgreSQL）時退回一般的 ILIKE 搜尋
+                ranked = after is None and has_database_feature(db.get_bind(), 'pg_trgm')
+                stmt = build_search_query(query, limit, offset if after is None else 0, after, ranked)
+                return [self._row_to_dict(row) for row in db.execute(stmt)]
         except SQLAlchemyError as e:
             self.logger.error(f"搜尋用戶失敗: {e}")
             return []
@@ -207,37 +412,24 @@ class UserManager:
         return self.get_user_by_line_id(line_id) is not None
 
     def get_all_users(self) -> List[Dict]:
-        """獲取所有用戶"""
+        """獲取所有用戶（大量資料請改用 iter_users 逐筆處理）"""
         try:
-            with self._get_db() as db:
-                users = db.query(User).all()
-                return [{
-                    'line_id': user.line_id,
-                    'name': user.name,
-                    'english_name': user.english_name,
-                    'department': user.department,
-                    'email': user.email,
-                    'mobile': user.mobile,
-                    'extension': user.extension,
-                    **(user.user_metadata or {})
-                } for user in users]
-        except SQLAlchemyError as e:
-            self.logger.error(f"獲取所有用戶失敗: {e}")
+            return list(self.iter_users())
+        except SQLAlchemyError:
             return []
 
     def get_statistics(self) -> Dict:
-        """獲取統計資訊"""
+        """獲取統計資訊（讀取觸發器維護的彙總表，並快取於行程內）"""
         try:
-            with self._get_db() as db:
-                total_users = db.query(User).count()
-                latest_user = db.query(User).order_by(User.created_at.desc()).first()
-                
-                return {
-                    "total_users": total_users,
-                    "latest_user_created": latest_user.created_at.replace(tzinfo=pytz.UTC).astimezone(TAIPEI_TZ).isoformat() if latest_user else None,
-                    "database_type": "PostgreSQL",
-                    "version": "1.0"
-                }
+            stats = user_stats.get()
+            latest = stats['latest_created_at']
+            return {
+                "total_users": stats['total_users'],
+                "departments": stats['departments'],
+                "latest_user_created": latest.replace(tzinfo=pytz.UTC).astimezone(TAIPEI_TZ).isoformat() if latest else None,
+                "database_type": "PostgreSQL",
+                "version": "1.0"
+            }
         except SQLAlchemyError as e:
             self.logger.error(f"獲取統計資訊失敗: {e}")
             return {
@@ -0,0 +1,81 @@
+"""
+用戶統計
+
+PostgreSQL 上 line_user_stats 由 line_users 的觸發器逐筆增減（見 models.SCHEMA_MIGRATIONS），
+讀取只需掃描每個單位一列，不必對 line_users 做 COUNT(*)；結果再於行程內快取 TTL 秒。
+觸發器不存在時（例如遷移因權限不足而失敗，或測試用 SQLite）改為直接彙總 line_users，
+避免彙總表未維護而一直回報 0。
+
+設定（環境變數）:
+    USER_STATS_CACHE_TTL_SECONDS=30   # 0 表示不快取
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import func, select
+
+from models import User, UserStats, has_database_feature
+
+
+def _default_engine():
+    from models import get_engine
+    return get_engine()
+
+
+class UserStatsService:
+    """讀取用戶統計並快取"""
+
+    def __init__(self, engine_factory: Callable = None, ttl_seconds: float = None):
+        self._engine_factory = engine_factory or _default_engine
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(
+            os.environ.get('USER_STATS_CACHE_TTL_SECONDS', '30')
+        )
+        self._lock = threading.Lock()
+        self._cached: Optional[Dict] = None
+        self._cached_at = 0.0
+
+    def get(self) -> Dict:
+        """
+        回傳 {'total_users', 'departments': {單位: 人數}, 'latest_created_at'}
+        資料庫錯誤時拋出 SQLAlchemyError
+        """
+        with self._lock:
+            if self._cached is not None and time.monotonic() - self._cached_at < self.ttl_seconds:
+                return self._cached
+
+        engine = self._engine_factory()
+        use_summary = has_database_feature(engine, 'user_stats_trigger')
+        with engine.connect() as conn:
+            if use_summary:
+                rows = conn.execute(
+                    select(UserStats.department, UserStats.user_count, UserStats.latest_created_at)
+                    .where(UserStats.user_count > 0)
+                ).all()
+            else:
+                department = func.coalesce(User.department, '')
+                rows = conn.execute(
+                    select(department, func.count(), func.max(User.created_at)).group_by(department)
+                ).all()
+
+        latest = [row[2] for row in rows if row[2] is not None]
+        stats = {
+            'total_users': sum(row[1] for row in rows),
+            'departments': {row[0]: row[1] for row in rows},
+            'latest_created_at': max(latest) if latest else None,
+        }
+        with self._lock:
+            self._cached = stats
+            self._cached_at = time.monotonic()
+        return stats
+
+    def invalidate(self):
+        """本行程新增或刪除用戶後清除快取，下次讀取即反映變更"""
+        with self._lock:
+            self._cached = None
+
+
+# 全局用戶統計實例
+user_stats = UserStatsService()
@@ -0,0 +1,125 @@
+"""
+Webhook 前置過濾器
+
+在 LINE SDK 建立事件物件之前，直接檢查原始 JSON，
+丟棄群組/聊天室中沒有 mention bot、也不是允許指令的文字訊息。
+留下的事件以 dispatch_events() 交給 WebhookHandler 登錄的處理器，
+被丟棄的事件不會建立 SDK 物件，簽章也不必再驗證一次。
+"""
+
+import inspect
+import threading
+
+from linebot.models import (
+    AccountLinkEvent, BeaconEvent, FollowEvent, JoinEvent, LeaveEvent, MemberJoinedEvent,
+    MemberLeftEvent, MessageEvent, PostbackEvent, ThingsEvent, UnfollowEvent, UnknownEvent,
+    UnsendEvent, VideoPlayCompleteEvent
+)
+
+from bot_config import bot_config
+
+# webhook 事件類型 → SDK 事件類別（與 WebhookParser.parse 相同）
+EVENT_CLASSES = {
+    'message': MessageEvent,
+    'follow': FollowEvent,
+    'unfollow': UnfollowEvent,
+    'join': JoinEvent,
+    'leave': LeaveEvent,
+    'postback': PostbackEvent,
+    'beacon': BeaconEvent,
+    'accountLink': AccountLinkEvent,
+    'memberJoined': MemberJoinedEvent,
+    'memberLeft': MemberLeftEvent,
+    'things': ThingsEvent,
+    'unsend': UnsendEvent,
+    'videoPlayComplete': VideoPlayCompleteEvent,
+}
+
+
+class GroupMessageFilter:
+    """依原始 webhook JSON 過濾群組中不需回應的文字訊息"""
+
+    GROUP_SOURCE_TYPES = ('group', 'room')
+
+    def __init__(self, config=None):
+        self.config = config or bot_config
+        self._lock = threading.Lock()
+        self._inspected = 0
+        self._dropped = 0
+
+    def should_drop(self, event):
+        """判斷單一事件（dict）是否可以直接丟棄"""
+        if event.get('type') != 'message':
+            return False
+        source = event.get('source') or {}
+        if source.get('type') not in self.GROUP_SOURCE_TYPES:
+            return False
+        message = event.get('message') or {}
+        if message.get('type') != 'text':
+            return False
+        return not self.config.should_respond_in_group(message.get('text', ''))
+
+    def filter_events(self, body_json):
+        """回傳需要交給 handler 處理的事件，並累計被丟棄的數量"""
+        events = body_json.get('events') or []
+        kept = []
+        inspected = dropped = 0
+        for event in events:
+            if event.get('type') == 'message':
+                inspected += 1
+            if self.should_drop(event):
+                dropped += 1
+            else:
+                kept.append(event)
+
+        if inspected:
+            with self._lock:
+                self._inspected += inspected
+                self._dropped += dropped
+        return kept
+
+    def get_stats(self):
+        """獲取過濾統計"""
+        with self._lock:
+            return {
+                'inspected_messages': self._inspected,
+                'dropped_group_messages': self._dropped
+            }
+
+
+def build_event(event):
+    """把原始事件 dict 建成 SDK 事件物件"""
+    return EVENT_CLASSES.get(event.get('type'), UnknownEvent).new_from_json_dict(event)
+
+
+def _find_handler(handler, event):
+    # 與 WebhookHandler.handle 相同的查找順序：事件_訊息類別 → 事件類別 → 預設處理器
+    func = None
+    if isinstance(event, MessageEvent):
+        func = handler._handlers.get(f'{type(event).__name__}_{type(event.message).__name__}')
+    if func is None:
+        func = handler._handlers.get(type(event).__name__)
+    return func if func is not None else handler._default
+
+
+def dispatch_events(handler, events, destination=None):
+    """
+    以 WebhookHandler 登錄的處理器逐筆處理（已驗證簽章、已過濾的）原始事件
+    等同 handler.handle 的分派，但只建立留下的事件
+    """
+    for raw_event in events:
+        event = build_event(raw_event)
+        func = _find_handler(handler, event)
+        if func is None:
+            continue
+        spec = inspect.getfullargspec(func)
+        if spec.varargs is not None or len(spec.args) == 2:
+            func(event, destination)
+        elif len(spec.args) == 1:
+            func(event)
+        else:
+            func()
+
+
+# 全局過濾器實例
+group_message_filter = GroupMessageFilter()